@@ -5,18 +5,36 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-import requests
 from logging import getLogger
 
-from app.models.extension import Extension, ExtensionBase
+import httpx
+
+from app.api.client.http import FederationClient
+from app.core.config import settings
+from app.models.extension import Extension, ExtensionBase, PhonebookChanges
 
 logger = getLogger(__name__)
 
 
-def call_get_phonebook(host: str):
-    response = requests.get(
-        host.rstrip("/") + "/api/v1/extension/phonebook",
+def call_get_phonebook(
+    host: str, etag: str | None = None
+) -> tuple[list[ExtensionBase] | None, str | None]:
+    """
+    returns the public phonebook of the given host and its etag. If an etag
+    is given and the phonebook did not change, None is returned as phonebook
+    """
+    headers = {}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+
+    response = FederationClient.instance().get(
+        host,
+        "/api/v1/extension/phonebook",
+        headers=headers,
+        timeout=settings.FEDERATION_PHONEBOOK_TIMEOUT,
     )
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        return None, etag
     response.raise_for_status()
 
     raw_extensions = response.json()
@@ -24,4 +42,24 @@ def call_get_phonebook(host: str):
     for e in raw_extensions:
         extensions.append(ExtensionBase.model_validate(e))
 
-    return extensions
+    return extensions, response.headers.get("ETag")
+
+
+def call_get_phonebook_changes(host: str, since: int) -> PhonebookChanges:
+    """
+    returns the changes of the public phonebook of the given host since the
+    given sequence number. Falls back to the full phonebook if the host does
+    not support incremental synchronization.
+    """
+    response = FederationClient.instance().get(
+        host,
+        "/api/v1/extension/phonebook/changes",
+        params={"since": since},
+        timeout=settings.FEDERATION_PHONEBOOK_TIMEOUT,
+    )
+    if response.status_code == httpx.codes.NOT_FOUND:
+        phonebook, _ = call_get_phonebook(host)
+        return PhonebookChanges(seq=0, full=True, upserts=phonebook)
+    response.raise_for_status()
+
+    return PhonebookChanges.model_validate(response.json())
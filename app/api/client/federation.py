@@ -5,9 +5,10 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-import requests
 from logging import getLogger
 
+from app.api.client.http import FederationClient
+
 from app.models.federation import OutgoingRequestStatus, PeerTeardownData
 from app.models.federation import IncomingPeeringRequest
 
@@ -15,8 +16,9 @@ logger = getLogger(__name__)
 
 
 def call_create_incoming_peering_request(host: str, request: IncomingPeeringRequest):
-    response = requests.post(
-        host.rstrip("/") + "/api/v1/federation/incoming/request",
+    response = FederationClient.instance().post(
+        host,
+        "/api/v1/federation/incoming/request",
         json=request.model_dump(exclude_unset=True),
     )
     response.raise_for_status()
@@ -24,8 +26,9 @@ def call_create_incoming_peering_request(host: str, request: IncomingPeeringRequ
 
 
 def call_revoke_incoming_peering_request(host: str, request_id: str, secret: str):
-    response = requests.delete(
-        host.rstrip("/") + f"/api/v1/federation/incoming/request/{request_id}",
+    response = FederationClient.instance().delete(
+        host,
+        f"/api/v1/federation/incoming/request/{request_id}",
         params={"secret": secret},
     )
     response.raise_for_status()
@@ -35,8 +38,9 @@ def call_revoke_incoming_peering_request(host: str, request_id: str, secret: str
 def call_set_outgoing_peering_request_status(
     host: str, request_id: str, status: OutgoingRequestStatus
 ):
-    response = requests.put(
-        host.rstrip("/") + f"/api/v1/federation/outgoing/request/{request_id}",
+    response = FederationClient.instance().put(
+        host,
+        f"/api/v1/federation/outgoing/request/{request_id}",
         json=status.model_dump(exclude_unset=True, exclude_none=True),
     )
     response.raise_for_status()
@@ -46,8 +50,8 @@ def call_set_outgoing_peering_request_status(
 
 
 def call_teardown_request(host: str, data: PeerTeardownData):
-    response = requests.post(
-        host.rstrip("/") + f"/api/v1/federation/peer/teardown", json=data.model_dump()
+    response = FederationClient.instance().post(
+        host, "/api/v1/federation/peer/teardown", json=data.model_dump()
     )
     response.raise_for_status()
     logger.info(f"Requested teardown of session '{data.name}' at {host}")
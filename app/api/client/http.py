@@ -0,0 +1,125 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from logging import getLogger
+import time
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import FEDERATION_REQUEST_ERRORS, FEDERATION_REQUEST_SECONDS
+from app.core.tracing import span
+
+logger = getLogger(__name__)
+
+# requests with those methods may be sent again if they failed, all other
+# requests are only repeated if the connection could not be established
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class FederationClient(object):
+    """
+    Shared HTTP client for all calls to other uURU instances. Connections are
+    pooled per peer host and kept alive between calls.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if FederationClient._instance is None:
+            FederationClient._instance = FederationClient()
+
+        return FederationClient._instance
+
+    def __init__(self):
+        self.client = httpx.Client(
+            http2=settings.FEDERATION_HTTP2,
+            timeout=httpx.Timeout(
+                settings.FEDERATION_HTTP_TIMEOUT,
+                connect=settings.FEDERATION_HTTP_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.FEDERATION_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.FEDERATION_HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=settings.FEDERATION_HTTP_KEEPALIVE,
+            ),
+        )
+
+    def close(self):
+        self.client.close()
+
+    def request(self, method: str, host: str, path: str, **kwargs) -> httpx.Response:
+        """
+        sends a request to the given uURU host and returns the response.
+        Failed requests are repeated up to FEDERATION_HTTP_RETRIES times with
+        an exponential backoff.
+        """
+        method = method.upper()
+        url = host.rstrip("/") + path
+        attempts = settings.FEDERATION_HTTP_RETRIES + 1
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.send(method, host, url, **kwargs)
+                if (
+                    last_attempt
+                    or method not in IDEMPOTENT_METHODS
+                    or response.status_code not in RETRY_STATUS_CODES
+                ):
+                    return response
+                logger.warning(f"{method} {url} returned {response.status_code}")
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # the request was never sent, so it is safe to retry it
+                if last_attempt:
+                    raise
+                logger.warning(f"{method} {url} failed to connect: {e}")
+            except httpx.TransportError as e:
+                if last_attempt or method not in IDEMPOTENT_METHODS:
+                    raise
+                logger.warning(f"{method} {url} failed: {e}")
+
+            time.sleep(settings.FEDERATION_HTTP_BACKOFF * (2**attempt))
+
+    def send(self, method: str, host: str, url: str, **kwargs) -> httpx.Response:
+        """
+        sends a single request and records its duration per peer
+        """
+        peer = host.rstrip("/")
+        started = time.perf_counter()
+        try:
+            with span(f"federation {method}", peer=peer, url=url) as request_span:
+                response = self.client.request(method, url, **kwargs)
+                if request_span is not None:
+                    request_span.set_attribute(
+                        "http.response.status_code", response.status_code
+                    )
+        except httpx.TransportError:
+            FEDERATION_REQUEST_ERRORS.inc(peer=peer, method=method)
+            raise
+        finally:
+            FEDERATION_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, peer=peer, method=method
+            )
+
+        if response.status_code >= 500:
+            FEDERATION_REQUEST_ERRORS.inc(peer=peer, method=method)
+        return response
+
+    def get(self, host: str, path: str, **kwargs) -> httpx.Response:
+        return self.request("GET", host, path, **kwargs)
+
+    def post(self, host: str, path: str, **kwargs) -> httpx.Response:
+        return self.request("POST", host, path, **kwargs)
+
+    def put(self, host: str, path: str, **kwargs) -> httpx.Response:
+        return self.request("PUT", host, path, **kwargs)
+
+    def delete(self, host: str, path: str, **kwargs) -> httpx.Response:
+        return self.request("DELETE", host, path, **kwargs)
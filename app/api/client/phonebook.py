@@ -0,0 +1,106 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from logging import getLogger
+from threading import Lock
+import time
+
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from app.api.client.extension import call_get_phonebook_changes
+from app.core.config import settings
+from app.models.crud import federation
+from app.models.federation import Peer
+
+logger = getLogger(__name__)
+
+
+class PeerPhonebookSync(object):
+    """
+    Synchronizes the public phonebooks of all peers into the local database.
+    Only changes since the last synchronization are requested, all peers are
+    synchronized concurrently. Peers which fail repeatedly are not asked again
+    until the circuit breaker timeout passed.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if PeerPhonebookSync._instance is None:
+            PeerPhonebookSync._instance = PeerPhonebookSync()
+
+        return PeerPhonebookSync._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        # circuit breaker state per peer id
+        self.failures: dict[str, int] = {}
+        self.open_until: dict[str, float] = {}
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.FEDERATION_PHONEBOOK_WORKERS,
+            thread_name_prefix="peer-phonebook",
+        )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def record_failure(self, peer: Peer):
+        peer_id = str(peer.id)
+        with self.lock:
+            self.failures[peer_id] = self.failures.get(peer_id, 0) + 1
+            if self.failures[peer_id] >= settings.FEDERATION_CIRCUIT_BREAKER_THRESHOLD:
+                self.open_until[peer_id] = (
+                    time.monotonic() + settings.FEDERATION_CIRCUIT_BREAKER_TIMEOUT
+                )
+                logger.warning(
+                    f"Not asking peer {peer.name} for its phonebook for the next {settings.FEDERATION_CIRCUIT_BREAKER_TIMEOUT} seconds"
+                )
+
+    def record_success(self, peer: Peer):
+        with self.lock:
+            self.failures.pop(str(peer.id), None)
+            self.open_until.pop(str(peer.id), None)
+
+    def sync_peer(self, engine: Engine, peer: Peer):
+        try:
+            changes = call_get_phonebook_changes(
+                peer.partner_uuru_host, peer.phonebook_seq
+            )
+        except Exception as e:
+            self.record_failure(peer)
+            logger.warning(
+                f"Failed to retrieve phonebook of peer {peer.name} @ {peer.partner_uuru_host}: {e}"
+            )
+            return
+
+        self.record_success(peer)
+        if not changes.full and len(changes.upserts) + len(changes.deletes) == 0:
+            return
+
+        with Session(engine) as session:
+            peer = federation.get_peer_by_id(session, str(peer.id))
+            if peer is None:  # peer was removed in the meantime
+                return
+            federation.apply_peer_phonebook_changes(session, peer, changes)
+
+    def job(self, engine: Engine):
+        with Session(engine) as session:
+            peers = federation.get_peers(session)
+            for peer in peers:
+                session.expunge(peer)
+
+        now = time.monotonic()
+        futures = [
+            self.executor.submit(self.sync_peer, engine, peer)
+            for peer in peers
+            if self.open_until.get(str(peer.id), 0) <= now
+        ]
+        wait(futures)
@@ -16,7 +16,7 @@ from app.core.config import settings
 from app.core.db import SessionDep
 from app.core.security import JWT_ALGORITHM
 from app.models.user import TokenPayload, User, UserRole
-from app.models.crud.user import get_user_by_id
+from app.models.crud.user import get_cached_user_by_id
 
 
 def get_current_user_optional(
@@ -46,12 +46,18 @@ def get_current_user(
             detail="Could not validate credentials",
         )
 
-    user = get_user_by_id(session, token_data.sub)
+    user = get_cached_user_by_id(session, token_data.sub)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
+    if user.token_version != token_data.ver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+
     return user
 
 
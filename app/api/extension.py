@@ -5,14 +5,17 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+import hashlib
+import json
 from typing import Literal, Optional
 
-from fastapi import APIRouter, status, HTTPException
+from fastapi import APIRouter, Depends, Request, Response, status, HTTPException
+from fastapi.responses import JSONResponse
 import sqlalchemy
 
 from app.api.deps import OptionalCurrentUser, SessionDep, CurrentUser
 from app.core.db import SessionAsteriskDep
-from app.core.ldap import LDAPDep
+from app.core.ratelimit import RateLimit
 from app.models.asterisk import PSContact
 from app.models.crud import CRUDNotAllowedException
 from app.models.crud.asterisk import (
@@ -25,6 +28,7 @@ from app.models.extension import (
     ExtensionCreate,
     ExtensionBase,
     ExtensionUpdate,
+    PhonebookChanges,
 )
 from app.models.crud.extension import (
     create_extension,
@@ -32,22 +36,26 @@ from app.models.crud.extension import (
     update_extension,
     delete_extension,
     filter_extensions_by_name,
+    get_phonebook_changes,
 )
 from app.models.user import UserRole
 
 router = APIRouter(prefix="/extension", tags=["extension"])
 
+# the phonebook can be polled without authentication by federated peers, it
+# shares the limit of the federation endpoints
+rate_limit = Depends(RateLimit("federation", "RATE_LIMIT_FEDERATION_IP"))
+
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=ExtensionBase)
 def create(
     session: SessionDep,
     session_asterisk: SessionAsteriskDep,
-    ldap: LDAPDep,
     user: CurrentUser,
     data: ExtensionCreate,
 ):
     try:
-        return create_extension(session, session_asterisk, ldap, user, data)
+        return create_extension(session, session_asterisk, user, data)
     except sqlalchemy.exc.IntegrityError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Extension already in use"
@@ -60,7 +68,6 @@ def create(
 def update(
     session: SessionDep,
     session_asterisk: SessionAsteriskDep,
-    ldap: LDAPDep,
     user: CurrentUser,
     extension: str,
     data: ExtensionUpdate,
@@ -73,7 +80,7 @@ def update(
         )
 
     try:
-        return update_extension(session, session_asterisk, ldap, user, ext, data)
+        return update_extension(session, session_asterisk, user, ext, data)
     except CRUDNotAllowedException as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
@@ -82,7 +89,6 @@ def update(
 def delete(
     session: SessionDep,
     session_asterisk: SessionAsteriskDep,
-    ldap: LDAPDep,
     user: CurrentUser,
     extension: str,
 ):
@@ -94,7 +100,7 @@ def delete(
         )
 
     try:
-        delete_extension(session, session_asterisk, ldap, user, ext)
+        delete_extension(session, session_asterisk, user, ext)
     except CRUDNotAllowedException as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
@@ -119,21 +125,54 @@ def get_own(session: SessionDep, user: CurrentUser):
     return user.extensions
 
 
-@router.get("/phonebook", response_model=list[ExtensionBase])
+def get_phonebook(
+    session: SessionDep,
+    user: OptionalCurrentUser,
+    query: Optional[str],
+    public: bool,
+) -> list[Extension]:
+    if not public and (user is None or user.role != UserRole.ADMIN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You may not request non-public extension",
+        )
+
+    return filter_extensions_by_name(session, user, query, public)
+
+
+@router.get(
+    "/phonebook", response_model=list[ExtensionBase], dependencies=[rate_limit]
+)
 def phonebook(
     *,
+    request: Request,
     session: SessionDep,
     user: OptionalCurrentUser = None,
     query: Optional[str] = None,
     public: bool = True,
 ):
-    if not public and (user is None or user.role != UserRole.ADMIN):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You may not request non-public extension",
+    extensions = get_phonebook(session, user, query, public)
+
+    # the phonebook is polled by federated peers, answer conditional requests
+    # based on the hash of the content
+    content = [
+        ExtensionBase.model_validate(e).model_dump(mode="json") for e in extensions
+    ]
+    digest = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+    etag = f'"{digest[:32]}"'
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
         )
 
-    return filter_extensions_by_name(session, user, query, public)
+    return JSONResponse(content, headers={"ETag": etag})
+
+
+@router.get("/phonebook/changes", dependencies=[rate_limit])
+def phonebook_changes(*, session: SessionDep, since: int = 0) -> PhonebookChanges:
+    # used by federated peers to synchronize the public phonebook incrementally
+    return get_phonebook_changes(session, since)
 
 
 @router.get("/all")
@@ -149,7 +188,7 @@ def admin_phonebook(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You may not request the all extensions!",
         )
-    return phonebook(session=session, user=user, query=query, public=public)
+    return get_phonebook(session=session, user=user, query=query, public=public)
 
 
 @router.get("/online")
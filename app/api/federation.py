@@ -6,13 +6,12 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 """
 
 from logging import getLogger
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
-from requests import HTTPError
 
-from app.api.client.extension import call_get_phonebook
 from app.api.deps import CurrentUser, OptionalCurrentUser
 from app.core.db import SessionAsteriskDep, SessionDep
+from app.core.ratelimit import RateLimit
 from app.models.crud import CRUDNotAllowedException, federation
 from app.models.extension import ExtensionBase
 from app.models.federation import (
@@ -31,6 +30,9 @@ from app.models.user import UserRole
 router = APIRouter(prefix="/federation", tags=["federation"])
 logger = getLogger(__name__)
 
+# applied to all endpoints which can be called without authentication
+rate_limit = Depends(RateLimit("federation", "RATE_LIMIT_FEDERATION_IP"))
+
 
 @router.post("/outgoing/request")
 def create_outgoing_peering_request(
@@ -139,7 +141,7 @@ def set_incoming_peering_request_status(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
 
-@router.post("/incoming/request")
+@router.post("/incoming/request", dependencies=[rate_limit])
 def create_incoming_peering_request(
     session: SessionDep, request: IncomingPeeringRequest
 ):
@@ -150,7 +152,7 @@ def create_incoming_peering_request(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
 
-@router.delete("/incoming/request/{request_id}")
+@router.delete("/incoming/request/{request_id}", dependencies=[rate_limit])
 def revoke_incoming_peering_request(session: SessionDep, request_id: str, secret: str):
     try:
         federation.revoke_incoming_peering_request(session, request_id, secret)
@@ -159,7 +161,7 @@ def revoke_incoming_peering_request(session: SessionDep, request_id: str, secret
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
 
-@router.put("/outgoing/request/{request_id}")
+@router.put("/outgoing/request/{request_id}", dependencies=[rate_limit])
 def set_outgoing_peering_request_status(
     session: SessionDep,
     session_asterisk: SessionAsteriskDep,
@@ -233,7 +235,7 @@ def delete_peer(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
 
-@router.post("/peer/teardown")
+@router.post("/peer/teardown", dependencies=[rate_limit])
 def teardown_request(
     session: SessionDep, session_asterisk: SessionAsteriskDep, data: PeerTeardownData
 ):
@@ -252,26 +254,14 @@ class PeerPhonebook(BaseModel):
     phonebook: list[ExtensionBase]
 
 
-@router.get("/phonebook")
+@router.get("/phonebook", dependencies=[rate_limit])
 def get_peer_phonebooks(session: SessionDep) -> list[PeerPhonebook]:
     try:
         peers = federation.get_peers(session)
     except CRUDNotAllowedException as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
-    phonebooks = []
-
-    for peer in peers:
-        try:
-            phonebook = call_get_phonebook(peer.partner_uuru_host)
-            for i in range(0, len(phonebook)):
-                phonebook[i].extension = peer.prefix + phonebook[i].extension
-        except Exception as e:
-            logger.warning(
-                f"Failed to retrieve phonebook of peer {peer.name} @ {peer.partner_uuru_host}"
-            )
-            logger.exception(e)
-            continue
-        phonebooks.append(PeerPhonebook(peer=peer, phonebook=phonebook))
-
-    return phonebooks
+    return [
+        PeerPhonebook(peer=peer, phonebook=federation.get_peer_phonebook(session, peer))
+        for peer in peers
+    ]
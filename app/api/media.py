@@ -8,7 +8,7 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 from logging import getLogger
 import os
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, status
 from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 
@@ -20,7 +20,13 @@ from app.models.media import AudioFormat, ImageFormat, Media, MediaType
 from app.models.crud import CRUDNotAllowedException, media as media_crud
 from app.models.user import UserRole
 from app.telephoning.main import Telephoning
-from app.util.media import get_converted_stream
+from app.util.media import (
+    get_converted_stream,
+    get_mime_type,
+    get_rendition,
+    get_stored_path,
+    media_file_response,
+)
 
 router = APIRouter(prefix="/media", tags=["media"])
 logger = getLogger(__name__)
@@ -134,17 +140,24 @@ def update_media(
 # TODO: Decide if this endpoint should be login only
 @router.get("/byid/{media_id}", response_class=FileResponse)
 @router.get("/byid/{media_id}.{ext}", response_class=FileResponse)
-def get_media_content(session: SessionDep, media_id: str, ext: Optional[str] = None):
+def get_media_content(
+    request: Request, session: SessionDep, media_id: str, ext: Optional[str] = None
+):
     media = media_crud.get_media_by_id(session, media_id)
     if media is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
 
-    path = os.path.join(settings.MEDIA_PATH, media.stored_as)
-    return path
+    path = get_stored_path(media)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+
+    return media_file_response(request, path, get_mime_type(media, None))
 
 
-@router.get("/byextension/{extension_id}/{query}", response_class=StreamingResponse)
-def get_media_by_name(session: SessionDep, extension_id: str, query: str):
+@router.get("/byextension/{extension_id}/{query}", response_class=FileResponse)
+def get_media_by_name(
+    request: Request, session: SessionDep, extension_id: str, query: str
+):
     extension = get_extension_by_id(session, extension_id, False)
     if extension is None:
         raise HTTPException(
@@ -178,11 +191,16 @@ def get_media_by_name(session: SessionDep, extension_id: str, query: str):
     if media is None or descr is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    if media.media.type != MediaType.RAW:
-        mime = f"{media.media.type.value}/{descr.out_format.out_type}"
-    else:
-        mime = "application/octet-stream"
+    mime = get_mime_type(media.media, descr.out_format)
+
+    if not settings.MEDIA_CACHE_RENDITIONS:
+        return StreamingResponse(
+            get_converted_stream(media.media, descr.out_format), media_type=mime
+        )
+
+    try:
+        path = get_rendition(media.media, descr.out_format)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    return StreamingResponse(
-        get_converted_stream(media.media, descr.out_format), media_type=mime
-    )
+    return media_file_response(request, path, mime)
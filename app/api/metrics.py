@@ -0,0 +1,130 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import secrets
+from typing import Annotated
+
+from fastapi import APIRouter, Header, HTTPException, Response, status
+from sqlalchemy import distinct
+from sqlmodel import Session, col, func, select
+
+from app.core.config import settings
+from app.core.db import engine, engine_asterisk
+from app.core.metrics import Gauge, registry
+from app.core.startup import Startup
+from app.models.asterisk import PSContact
+from app.models.extension import Extension
+
+router = APIRouter(tags=["metrics"])
+
+
+def collect_db_pools():
+    for name, db_engine in (("app", engine), ("asterisk", engine_asterisk)):
+        pool = db_engine.pool
+        # only pools with a fixed size report those numbers
+        if not hasattr(pool, "checkedout"):
+            continue
+
+        yield {"engine": name, "state": "checked_out"}, pool.checkedout()
+        yield {"engine": name, "state": "idle"}, pool.checkedin()
+        yield {"engine": name, "state": "overflow"}, max(pool.overflow(), 0)
+        yield {"engine": name, "state": "size"}, pool.size()
+
+
+def collect_extensions():
+    # the databases may live on different servers, only the registered
+    # endpoints are read from asterisk and counted in the application DB
+    with Session(engine_asterisk) as session_asterisk:
+        online = session_asterisk.exec(select(distinct(PSContact.endpoint))).all()
+
+    with Session(engine) as session:
+        totals = session.exec(
+            select(Extension.type, func.count()).group_by(Extension.type)
+        ).all()
+        online_counts = (
+            dict(
+                session.exec(
+                    select(Extension.type, func.count())
+                    .where(col(Extension.extension).in_(online))
+                    .group_by(Extension.type)
+                ).all()
+            )
+            if online
+            else {}
+        )
+
+    for phone_type, total in totals:
+        online_count = online_counts.get(phone_type, 0)
+        yield {"type": phone_type, "online": "true"}, online_count
+        yield {"type": phone_type, "online": "false"}, total - online_count
+
+
+def collect_startup_phases():
+    for phase, seconds in Startup.instance().phases.items():
+        yield {"phase": phase}, seconds
+
+
+registry.register(
+    Gauge(
+        "uuru_db_pool_connections",
+        "Connections of the database pools",
+        ["engine", "state"],
+        collector=collect_db_pools,
+    )
+)
+registry.register(
+    Gauge(
+        "uuru_extensions",
+        "Extensions by phone type and online state",
+        ["type", "online"],
+        collector=collect_extensions,
+    )
+)
+registry.register(
+    Gauge(
+        "uuru_startup_phase_seconds",
+        "Duration of the imports and startup phases of this worker",
+        ["phase"],
+        collector=collect_startup_phases,
+    )
+)
+registry.register(
+    Gauge(
+        "uuru_ready",
+        "Whether this worker finished its startup",
+        collector=lambda: [({}, int(Startup.instance().ready))],
+    )
+)
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics(authorization: Annotated[str | None, Header()] = None) -> Response:
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if settings.METRICS_TOKEN is not None and not secrets.compare_digest(
+        authorization or "", f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+        )
+
+    return Response(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/ready", include_in_schema=False)
+def get_ready(response: Response) -> dict:
+    """
+    readiness probe, answers with 503 until the startup finished, the jobs
+    may still be running their first time
+    """
+    if not Startup.instance().ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return Startup.instance().status()
@@ -5,7 +5,6 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-from datetime import datetime
 from logging import getLogger
 from typing import Optional
 
@@ -17,6 +16,7 @@ from pydantic import BaseModel
 from app.api.deps import CurrentUser, OptionalCurrentUser
 from app.core.config import settings
 from app.core.db import SessionAsteriskDep, SessionDep
+from app.core.metrics import EXTERNAL_CALL_ERRORS, observe_call
 from app.models.crud import CRUDNotAllowedException
 from app.models.crud.asterisk import get_contact, get_known_dialplan_extensions
 from app.models.crud.extension import get_extension_by_id
@@ -58,7 +58,7 @@ def get_phone_types(user: CurrentUser) -> list[PhoneType]:
 
 @router.get("/websip")
 def create_websip(
-    session_asterisk: SessionAsteriskDep, user: OptionalCurrentUser
+    session: SessionDep, session_asterisk: SessionAsteriskDep, user: OptionalCurrentUser
 ) -> WebSIPExtension:
     if not settings.ENABLE_WEBSIP:
         raise HTTPException(
@@ -71,38 +71,50 @@ def create_websip(
             detail="WebSIP is only available for logged in users",
         )
 
-    extension = WebSIPManager.instance().create_extension(session_asterisk, user)
+    extension = WebSIPManager.instance().create_extension(
+        session, session_asterisk, user
+    )
 
     return extension
 
 
 @router.delete("/websip")
-def delete_websip(session_asterisk: SessionAsteriskDep, extension: str, password: str):
+def delete_websip(
+    session: SessionDep,
+    session_asterisk: SessionAsteriskDep,
+    extension: str,
+    password: str,
+):
     if not settings.ENABLE_WEBSIP:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="WebSIP is disabled"
         )
 
-    ext = WebSIPManager.instance().get_extension(extension)
+    try:
+        ext = WebSIPManager.instance().get_extension(session, extension)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     if ext.auth_pass != password:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Wrong password for extension"
         )
 
-    WebSIPManager.instance().delete_extension(session_asterisk, ext)
+    WebSIPManager.instance().delete_extension(session, session_asterisk, extension)
 
     return {}
 
 
 @router.put("/websip", status_code=status.HTTP_204_NO_CONTENT)
-def put_websip(extension: str):
+def put_websip(session: SessionDep, extension: str):
     if not settings.ENABLE_WEBSIP:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="WebSIP is disabled"
         )
 
-    ext = WebSIPManager.instance().get_extension(extension)
-    ext.last_seen = datetime.now()
+    try:
+        WebSIPManager.instance().refresh_extension(session, extension)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
     return {}
 
@@ -141,14 +153,16 @@ def originate_call(
 
     client = Telephoning.instance().get_ami_client()
     adapter = AMIClientAdapter(client)
-    response: FutureResponse = adapter.Originate(
-        Channel=f"PJSIP/{source}", Exten=dest, Priority=1, Context="pjsip_internal"
-    )
+    with observe_call("ami", "Originate"):
+        response: FutureResponse = adapter.Originate(
+            Channel=f"PJSIP/{source}", Exten=dest, Priority=1, Context="pjsip_internal"
+        )
 
     logger.info(f"Originated call from {source} to {dest}")
     logger.debug(f"Received AMI response:\n{response.response}")
 
     if response.response is not None:
+        EXTERNAL_CALL_ERRORS.inc(service="ami", operation="Originate")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="unable to originate call due to error from AMI",
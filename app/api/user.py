@@ -5,8 +5,9 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+from threading import BoundedSemaphore
 from typing import Annotated
-from fastapi import APIRouter, Body, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, status
 from datetime import datetime, timedelta
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
@@ -16,7 +17,12 @@ from sqlmodel import select, delete as sql_delete
 from app.api.deps import CurrentUser, OptionalCurrentUser
 from app.core.db import SessionDep
 from app.core.config import settings
-from app.core.security import create_access_token, generate_invite_code
+from app.core.ratelimit import RateLimit, RateLimiter, get_client_address
+from app.core.security import (
+    PasswordHashExecutor,
+    create_access_token,
+    generate_invite_code,
+)
 from app.models.crud import CRUDNotAllowedException
 from app.models.crud.user import (
     authenticate_user,
@@ -33,6 +39,7 @@ from app.models.user import (
     InviteVariant,
     PasswordChange,
     Token,
+    User,
     UserPublic,
     UserCreate,
     UserRole,
@@ -41,26 +48,57 @@ from app.models.user import (
 
 router = APIRouter(prefix="/user", tags=["user"])
 
+login_slots = BoundedSemaphore(settings.LOGIN_MAX_CONCURRENT)
+
 
 class Credentials(BaseModel):
     username: str
     password: str = Field(min_length=10, max_length=100)
 
 
-@router.post("/login")
-def login(session: SessionDep, credentials: Annotated[Credentials, Body()]) -> Token:
-    user = authenticate_user(session, credentials.username, credentials.password)
-    if not user:
-        raise HTTPException(status_code=400, detail="Incorrect username or password")
-
+def set_auth_cookie(response: JSONResponse, user: User):
     expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    token = create_access_token(user.id, expires)
-    response = JSONResponse({"detail": "OK"})
+    token = create_access_token(user.id, expires, user.token_version)
     response.set_cookie(
         "auth",
         token,
         httponly=True,
     )
+
+
+@router.post(
+    "/login", dependencies=[Depends(RateLimit("login", "RATE_LIMIT_LOGIN_IP"))]
+)
+def login(
+    request: Request,
+    session: SessionDep,
+    credentials: Annotated[Credentials, Body()],
+) -> Token:
+    # counted per address as well, otherwise anybody could lock a user out
+    # with failed logins for their username
+    RateLimiter.instance().check(
+        "login-user",
+        f"{credentials.username.lower()}:{get_client_address(request)}",
+        settings.RATE_LIMIT_LOGIN_USER,
+    )
+
+    if not login_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts, please try again later",
+            headers={"Retry-After": "5"},
+        )
+
+    try:
+        user = authenticate_user(session, credentials.username, credentials.password)
+    finally:
+        login_slots.release()
+
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+
+    response = JSONResponse({"detail": "OK"})
+    set_auth_cookie(response, user)
     return response
 
 
@@ -106,13 +144,27 @@ def update(
     except CRUDNotAllowedException as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
+    if user_id is None and data.password is not None:
+        # the password change invalidated the current session token
+        response = JSONResponse({"detail": "OK"})
+        set_auth_cookie(response, user)
+        return response
+
 
 @router.post(
-    "/register", response_model=UserPublic, status_code=status.HTTP_201_CREATED
+    "/register",
+    response_model=UserPublic,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimit("register", "RATE_LIMIT_REGISTER_IP"))],
 )
 def register(
     *, session: SessionDep, executing: OptionalCurrentUser = None, new: UserCreate
 ):
+    if new.invite is not None:
+        RateLimiter.instance().check(
+            "invite", new.invite.lower(), settings.RATE_LIMIT_INVITE
+        )
+
     try:
         user = create_user(session, executing, new)
     except CRUDNotAllowedException as e:
@@ -135,7 +187,17 @@ def change_password(*, session: SessionDep, user: CurrentUser, data: PasswordCha
     except CRUDNotAllowedException as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
-    return {"detail": "OK"}
+    response = JSONResponse({"detail": "OK"})
+    set_auth_cookie(response, user)
+    return response
+
+
+@router.get("/hashing")
+def hashing_stats(*, user: CurrentUser) -> dict:
+    if user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only!")
+
+    return PasswordHashExecutor.instance().stats()
 
 
 @router.get("/all")
@@ -8,13 +8,14 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 import secrets
 import string
 from logging import INFO, getLevelNamesMapping
-from typing import Annotated, Any, Literal
+from typing import Annotated, Any, Literal, Self
 
 from pydantic import (
     AnyUrl,
     BaseModel,
     BeforeValidator,
     computed_field,
+    model_validator,
 )
 from pydantic_core import MultiHostUrl
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -72,6 +73,37 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 11520  # 8 days
     LIMIT_REGISTRATION: bool = False
 
+    # argon2 password hashing, existing hashes are updated on the next login
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536  # KiB
+    ARGON2_PARALLELISM: int = 4
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+    PASSWORD_HASH_TIMEOUT: float = 10
+    LOGIN_MAX_CONCURRENT: int = 16
+
+    # requests per client address within RATE_LIMIT_WINDOW
+    # seconds, "database" shares the counters between all workers
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "database"] = "memory"
+    RATE_LIMIT_WINDOW: int = 60
+    RATE_LIMIT_LOGIN_IP: int = 30
+    RATE_LIMIT_LOGIN_USER: int = 10
+    RATE_LIMIT_REGISTER_IP: int = 10
+    RATE_LIMIT_INVITE: int = 10
+    RATE_LIMIT_FEDERATION_IP: int = 60
+    RATE_LIMIT_PROVISIONING_IP: int = 300
+    RATE_LIMIT_DECT_REGISTRATION: int = 10
+    # requests from these networks are counted for the address in their
+    # X-Forwarded-For header, e.g. the network of a reverse proxy
+    TRUSTED_PROXIES: list[str] = []
+
+    # users are cached to resolve session tokens without a database query
+    USER_CACHE_TTL: int = 30
+    USER_CACHE_SIZE: int = 1024
+    # seconds until changes of a user made by another worker are noticed
+    USER_CACHE_SYNC_INTERVAL: float = 2
+
     ALLOWED_USERNAME_CHARS: str = string.ascii_letters + string.digits
 
     ## NETWORK
@@ -169,12 +201,58 @@ class Settings(BaseSettings):
     LDAP_PUBLIC_BIND_USER: str = "cn=public,dc=uuru"
     LDAP_PUBLIC_BIND_PASSWORD: str = "public"
 
+    # connections to the ldap server are pooled and reused between requests
+    LDAP_POOL_SIZE: int = 4
+    LDAP_POOL_TIMEOUT: float = 10
+    LDAP_CONNECT_TIMEOUT: int = 5
+    # idle connections are checked with a whoami request after this time
+    LDAP_HEALTH_CHECK_INTERVAL: int = 60
+
+    # changes are written to the directory in the background
+    LDAP_SYNC_BATCH_SIZE: int = 100
+    LDAP_SYNC_BATCH_DELAY: float = 0.5
+    LDAP_SYNC_RETRY_BACKOFF: float = 1
+    LDAP_SYNC_MAX_BACKOFF: float = 300
+    # the whole directory is compared against the database in this interval
+    LDAP_RECONCILE_INTERVAL: int = 3600
+    LDAP_RECONCILE_PAGE_SIZE: int = 500
+
     ## BEHAVIOR
 
     LOGLEVEL: Literal["CRITICAL", "FATAL", "ERROR", "WARNING", "INFO", "DEBUG"] = "INFO"
     ENVIRONMENT: Literal["local", "production"] = "local"
     LIFESPAN_DROP_DB: bool = False
 
+    # prometheus metrics on /metrics, protected by a bearer token if set
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str | None = None
+
+    # number of worker processes, the container passes it to uvicorn
+    WORKERS: int = 1
+
+    # state which all workers have to share, "memory" only works with a
+    # single worker, "redis" requires the redis extra
+    STATE_BACKEND: Literal["memory", "database", "redis"] = "memory"
+    STATE_REDIS_URL: str = "redis://localhost:6379/0"
+
+    # only the worker holding the scheduler lease runs the background jobs,
+    # another worker takes over after the lease expired
+    SCHEDULER_LEADER_ELECTION: bool = True
+    SCHEDULER_LEASE_SECONDS: int = 30
+    SCHEDULER_RENEW_INTERVAL: int = 10
+    # missed runs of a job are combined into one
+    SCHEDULER_COALESCE: bool = True
+    SCHEDULER_MAX_INSTANCES: int = 1
+    SCHEDULER_MISFIRE_GRACE_TIME: int = 30
+
+    # OpenTelemetry tracing, requires the opentelemetry-sdk package
+    TRACING_ENABLED: bool = False
+    TRACING_EXPORTER: Literal["otlp", "file"] = "otlp"
+    TRACING_OTLP_ENDPOINT: str | None = None
+    TRACING_FILE: str = "./traces.jsonl"
+    TRACING_SERVICE_NAME: str = "uuru"
+    TRACING_SAMPLE_RATIO: float = 1.0
+
     @computed_field
     @property
     def logging_loglevel(self) -> int:
@@ -193,6 +271,12 @@ class Settings(BaseSettings):
     MEDIA_IMAGE_STORAGE_FORMAT: str = "png"
     MEDIA_AUDIO_STORAGE_FORMAT: str = "mp3"
 
+    # converted media is cached in this subdirectory of MEDIA_PATH, if caching
+    # is disabled media is converted on every request and streamed
+    MEDIA_CACHE_RENDITIONS: bool = True
+    MEDIA_RENDITION_DIRECTORY: str = ".renditions"
+    MEDIA_CACHE_MAX_AGE: int = 3600
+
     ## TELEPHONE
 
     EXTENSION_DIGITS: int = 4
@@ -212,6 +296,25 @@ class Settings(BaseSettings):
     # files in "app/telephoning/phonetypes/" without the .py suffix
     ENABLED_PHONE_FLAVORS: list[str] = ["sip"]
 
+    # provisioning templates are compiled once and the compiled code is
+    # cached in this directory (default: temp directory), rendered files
+    # are cached per phone flavor
+    PROVISIONING_BYTECODE_CACHE: bool = True
+    PROVISIONING_BYTECODE_CACHE_DIR: str | None = None
+    PROVISIONING_CACHE_SIZE: int = 1000
+    # unknown keys cause a refresh of the index at most in this interval
+    PROVISIONING_INDEX_REFRESH: float = 5
+
+    # AGI scripts of phone flavors are served by uURU itself
+    FASTAGI_ENABLED: bool = True
+    FASTAGI_HOST: str = "0.0.0.0"
+    FASTAGI_PORT: int = 4573
+    FASTAGI_TIMEOUT: float = 60
+    # asterisk has to connect from one of these networks (empty: from
+    # everywhere) and pass the secret if one is set
+    FASTAGI_ALLOWED_NETWORKS: list[str] = ["127.0.0.0/8", "::1/128"]
+    FASTAGI_SECRET: str | None = None
+
     ## WEBSIP
 
     ENABLE_WEBSIP: bool = True
@@ -219,6 +322,8 @@ class Settings(BaseSettings):
     WEBSIP_WS_HOST: str = "ws://127.0.0.1:8088/ws"
     # those extensions should also be reserved in RESERVED_EXTENSIONS
     WEBSIP_EXTENSION_RANGE: tuple[int, int] = [9900, 9999]
+    # number of endpoints which are created in advance
+    WEBSIP_WARM_POOL_SIZE: int = 0
 
     ## SITE
 
@@ -236,6 +341,19 @@ class Settings(BaseSettings):
     OMM_USER: str = "omm"
     OMM_PASSWORD: str | None = None
     OMM_VERIFY_CERT: bool = True
+    # the device list is fetched in this interval to find new handsets
+    OMM_FULL_SYNC_INTERVAL: int = 60
+    # seconds to wait for single requests and for listing all devices/users
+    OMM_REQUEST_TIMEOUT: float = 10
+    OMM_SYNC_TIMEOUT: float = 120
+    # temporary extensions kept ready for new handsets
+    OMM_TMP_POOL_SIZE: int = 20
+    OMM_TMP_POOL_BATCH: int = 10
+
+    # innovaphone phones report their address with every update request,
+    # reports are written in this interval and expire after the ttl
+    INNOVAPHONE_SD_FLUSH_INTERVAL: float = 10
+    INNOVAPHONE_SD_TARGET_TTL: int = 86400
 
     GRANDSTREAM_WIFI_SSID: str | None = None
     GRANDSTREAM_WIFI_PASSWD: str | None = None
@@ -245,11 +363,55 @@ class Settings(BaseSettings):
     FEDERATION_IAX2_HOST: str = ASTERISK_HOST
     FEDERATION_UURU_HOST: str = WEB_HOST
 
+    # peer phonebooks are synchronized concurrently into the local database
+    # every FEDERATION_PHONEBOOK_SYNC_INTERVAL seconds
+    FEDERATION_PHONEBOOK_TIMEOUT: float = 5
+    FEDERATION_PHONEBOOK_SYNC_INTERVAL: int = 60
+    FEDERATION_PHONEBOOK_WORKERS: int = 8
+    # changes of the own phonebook are handed to peers once they are older
+    # than the longest transaction and removed after the retention, peers
+    # which are further behind get the full phonebook
+    FEDERATION_PHONEBOOK_CHANGE_DELAY: float = 10
+    FEDERATION_PHONEBOOK_CHANGE_RETENTION: int = 7 * 24 * 3600
+    # after this amount of failed requests a peer is not asked again until
+    # the timeout (seconds) passed
+    FEDERATION_CIRCUIT_BREAKER_THRESHOLD: int = 3
+    FEDERATION_CIRCUIT_BREAKER_TIMEOUT: int = 60
+
+    # shared http client used for all calls to peers
+    FEDERATION_HTTP_TIMEOUT: float = 10
+    FEDERATION_HTTP_CONNECT_TIMEOUT: float = 3
+    FEDERATION_HTTP_RETRIES: int = 2
+    FEDERATION_HTTP_BACKOFF: float = 0.5
+    FEDERATION_HTTP_MAX_CONNECTIONS: int = 20
+    FEDERATION_HTTP_KEEPALIVE: float = 30
+    # h2 is installed by the http2 extra of httpx
+    FEDERATION_HTTP2: bool = False
+
     ## AMI
     ASTERISK_AMI_USER: str = "uuru_ami_user"
     ASTERISK_AMI_PASS: str = "uuru_ami_secret"
     ASTERISK_AMI_ADDR: str = "172.17.0.1"
     ASTERSIK_AMI_PORT: int = 5038
 
+    @model_validator(mode="after")
+    def check_workers(self) -> Self:
+        # every worker would otherwise sign tokens with its own random key and
+        # keep its own state, requests would randomly fail
+        if self.WORKERS <= 1:
+            return self
+
+        if "SECRET_KEY" not in self.model_fields_set:
+            raise ValueError("UURU_SECRET_KEY is required with multiple workers")
+        if self.STATE_BACKEND == "memory":
+            raise ValueError(
+                "UURU_STATE_BACKEND must be database or redis with multiple workers"
+            )
+        if self.RATE_LIMIT_BACKEND == "memory":
+            raise ValueError(
+                "UURU_RATE_LIMIT_BACKEND must be database with multiple workers"
+            )
+        return self
+
 
 settings = Settings()
@@ -5,6 +5,7 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+from datetime import datetime
 from logging import getLogger
 from typing import Annotated
 from fastapi import Depends
@@ -37,11 +38,19 @@ def init_asterisk_db(session_asterisk: Session) -> None:
     dialplan = Dialplan.from_db(
         session_asterisk, exten="_" + ("X" * settings.EXTENSION_DIGITS)
     )
+    stored = [
+        (prio, entry.assemble()) for prio, entry in dialplan.get_ordered_entries()
+    ]
     dialplan.add(Dial(devices=["${PJSIP_DIAL_CONTACTS(${EXTEN})}"]), prio=1)
-    dialplan.store(session_asterisk)
+    # every worker runs this on startup, rewriting an unchanged dialplan only
+    # costs time and locks the table
+    if stored != [
+        (prio, entry.assemble()) for prio, entry in dialplan.get_ordered_entries()
+    ]:
+        dialplan.store(session_asterisk)
 
 
-def init_db(session: Session) -> None:
+def init_db(session: Session, engine=engine) -> None:
     SQLModel.metadata.create_all(engine, tables=[x.__table__ for x in tables])
     logger.info(f"Created tables")
 
@@ -61,6 +70,14 @@ def init_db(session: Session) -> None:
         )
         logger.info(f"Created initial user ({settings.DEFAULT_ROOT_USER})")
 
+    # federated peers treat sequence number 0 as "no sync position", the
+    # first change marks the start of the sequence, so peers of an unchanged
+    # phonebook get empty deltas instead of the full phonebook every time
+    if session.exec(select(PhonebookChange.id).limit(1)).first() is None:
+        session.add(PhonebookChange(extension="", created=datetime(1970, 1, 1)))
+        session.commit()
+        logger.info("Created the start of the phonebook change sequence")
+
 
 def drop_db(engine=engine) -> None:
     SQLModel.metadata.drop_all(engine, [x.__table__ for x in tables])
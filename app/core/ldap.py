@@ -5,41 +5,117 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-from typing import Annotated
-from fastapi import Depends
-from ldap3 import Connection, Server
+from logging import getLogger
+from queue import Empty, LifoQueue
+from threading import BoundedSemaphore
+import time
+
+from ldap3 import NONE, ROUND_ROBIN, SIMPLE, Connection, Server, ServerPool
+from ldap3.core.exceptions import LDAPException
 
 from app.core.config import settings
 
+logger = getLogger(__name__)
+
+
+class LDAPPool(object):
+    """
+    Pool of long-lived, bound LDAP connections. Connections are created on
+    demand (up to LDAP_POOL_SIZE), reused between requests and replaced by a
+    freshly bound connection if they fail the health check.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if LDAPPool._instance is None:
+            LDAPPool._instance = LDAPPool()
+
+        return LDAPPool._instance
 
-class LDAPClient:
     def __init__(self):
-        self.server = Server(settings.LDAP_SERVER, get_info="ALL")
-        self.connection = None
+        # LDAP_SERVER may contain multiple comma separated servers
+        servers = [
+            Server(
+                server.strip(),
+                get_info=NONE,
+                connect_timeout=settings.LDAP_CONNECT_TIMEOUT,
+            )
+            for server in settings.LDAP_SERVER.split(",")
+        ]
+        self.server_pool = ServerPool(servers, ROUND_ROBIN, active=True, exhaust=True)
+
+        self.idle: LifoQueue[tuple[Connection, float]] = LifoQueue()
+        self.slots = BoundedSemaphore(settings.LDAP_POOL_SIZE)
 
-    def connect(self):
-        self.connection = Connection(
-            self.server,
+    def connect(self) -> Connection:
+        connection = Connection(
+            self.server_pool,
             settings.LDAP_USER,
             settings.LDAP_PASSWORD,
-            authentication="SIMPLE",
+            authentication=SIMPLE,
             auto_bind=True,
+            receive_timeout=settings.LDAP_CONNECT_TIMEOUT,
         )
-        if not self.connection.bound:
+        if not connection.bound:
             raise ConnectionError("Failed to connect to the ldap server")
 
-    def unbind(self):
-        if self.connection:
-            self.connection.unbind()
+        logger.debug("Opened new LDAP connection")
+        return connection
+
+    def is_healthy(self, connection: Connection, last_used: float) -> bool:
+        if connection.closed or not connection.bound:
+            return False
+
+        # only check connections which were idle for a while
+        if time.monotonic() - last_used < settings.LDAP_HEALTH_CHECK_INTERVAL:
+            return True
+
+        try:
+            connection.extend.standard.who_am_i()
+            return connection.result["result"] == 0
+        except LDAPException:
+            return False
+
+    def discard(self, connection: Connection):
+        try:
+            connection.unbind()
+        except LDAPException:
+            pass
+
+    def acquire(self) -> Connection:
+        if not self.slots.acquire(timeout=settings.LDAP_POOL_TIMEOUT):
+            raise ConnectionError("No ldap connection available")
+
+        try:
+            while True:
+                try:
+                    connection, last_used = self.idle.get_nowait()
+                except Empty:
+                    return self.connect()
+
+                if self.is_healthy(connection, last_used):
+                    return connection
 
+                logger.info("Replacing broken LDAP connection")
+                self.discard(connection)
+        except:
+            self.slots.release()
+            raise
 
-def get_ldap():
-    client = LDAPClient()
-    client.connect()
-    try:
-        yield client.connection
-    finally:
-        client.unbind()
+    def release(self, connection: Connection):
+        if connection.closed:
+            self.discard(connection)
+        else:
+            self.idle.put((connection, time.monotonic()))
+        self.slots.release()
 
+    def close(self):
+        while True:
+            try:
+                connection, _ = self.idle.get_nowait()
+            except Empty:
+                break
+            self.discard(connection)
 
-LDAPDep = Annotated[Connection, Depends(get_ldap)]
@@ -0,0 +1,303 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+from logging import getLogger
+import math
+from threading import Lock
+import time
+from typing import Callable, Iterable
+
+from app.core.tracing import span
+
+logger = getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# (metric name, labels, value)
+Sample = tuple[str, dict[str, str], float]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_sample(name: str, labels: dict[str, str], value: float) -> str:
+    if not labels:
+        return f"{name} {format_value(value)}"
+
+    label_string = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+    return f"{name}{{{label_string}}} {format_value(value)}"
+
+
+class Metric(object):
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        self.values: dict[tuple, object] = {}
+
+    def key(self, labels: dict[str, str]) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def samples(self) -> list[Sample]:
+        raise NotImplementedError()
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        lines.extend(format_sample(*sample) for sample in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[Sample]:
+        with self.lock:
+            return [
+                (self.name, dict(zip(self.labelnames, key)), value)
+                for key, value in self.values.items()
+            ]
+
+
+class Gauge(Metric):
+    """
+    gauge whose samples are produced by a collector when metrics are
+    requested, used for values which are cheaper to read than to track
+    """
+
+    TYPE = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        collector: Callable[[], Iterable[tuple[dict[str, str], float]]] | None = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.collector = collector
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self) -> list[Sample]:
+        if self.collector is not None:
+            try:
+                return [
+                    (self.name, labels, value) for labels, value in self.collector()
+                ]
+            except Exception:
+                logger.exception(f"Failed to collect metric {self.name}")
+                return []
+
+        with self.lock:
+            return [
+                (self.name, dict(zip(self.labelnames, key)), value)
+                for key, value in self.values.items()
+            ]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # counts per bucket, sum
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> list[Sample]:
+        with self.lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self.values.items()
+            ]
+
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": format_value(bound)}
+                samples.append((f"{self.name}_bucket", bucket_labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class MetricsRegistry(object):
+    """
+    Holds all metrics of this process and renders them in the prometheus
+    text format. Every worker process has its own registry.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if MetricsRegistry._instance is None:
+            MetricsRegistry._instance = MetricsRegistry()
+
+        return MetricsRegistry._instance
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry.instance()
+
+HTTP_REQUEST_SECONDS: Histogram = registry.register(
+    Histogram(
+        "uuru_http_request_duration_seconds",
+        "Duration of HTTP requests by route",
+        ["method", "route", "status"],
+    )
+)
+JOB_SECONDS: Histogram = registry.register(
+    Histogram(
+        "uuru_job_duration_seconds",
+        "Duration of scheduled background jobs",
+        ["job"],
+        buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300),
+    )
+)
+JOB_FAILURES: Counter = registry.register(
+    Counter(
+        "uuru_job_failures_total",
+        "Scheduled background jobs which raised an exception",
+        ["job"],
+    )
+)
+EXTERNAL_CALL_SECONDS: Histogram = registry.register(
+    Histogram(
+        "uuru_external_call_duration_seconds",
+        "Duration of calls to AMI, LDAP and the OMM",
+        ["service", "operation"],
+    )
+)
+EXTERNAL_CALL_ERRORS: Counter = registry.register(
+    Counter(
+        "uuru_external_call_errors_total",
+        "Failed calls to AMI, LDAP and the OMM",
+        ["service", "operation"],
+    )
+)
+MEDIA_CONVERSION_SECONDS: Histogram = registry.register(
+    Histogram(
+        "uuru_media_conversion_duration_seconds",
+        "Duration of media conversions",
+        ["type"],
+        buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    )
+)
+FEDERATION_REQUEST_SECONDS: Histogram = registry.register(
+    Histogram(
+        "uuru_federation_request_duration_seconds",
+        "Duration of requests to federated peers",
+        ["peer", "method"],
+    )
+)
+FEDERATION_REQUEST_ERRORS: Counter = registry.register(
+    Counter(
+        "uuru_federation_request_errors_total",
+        "Requests to federated peers which failed or returned a server error",
+        ["peer", "method"],
+    )
+)
+
+
+@contextmanager
+def observe_call(service: str, operation: str):
+    """
+    measures the duration of a call to an external service, exceptions are
+    counted as errors and re-raised
+    """
+    started = time.perf_counter()
+    try:
+        with span(f"{service} {operation}"):
+            yield
+    except:
+        EXTERNAL_CALL_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.observe(
+            time.perf_counter() - started, service=service, operation=operation
+        )
+
+
+def timed_job(name: str, function: Callable) -> Callable:
+    """
+    wraps a scheduler job so that its duration and failures are recorded
+    """
+
+    @wraps(function)
+    def job(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with span(f"job {name}"):
+                return function(*args, **kwargs)
+        except:
+            JOB_FAILURES.inc(job=name)
+            raise
+        finally:
+            JOB_SECONDS.observe(time.perf_counter() - started, job=name)
+
+    return job
@@ -0,0 +1,228 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from functools import lru_cache
+import ipaddress
+from logging import getLogger
+import math
+from threading import Lock
+import time
+
+from fastapi import Request
+from sqlalchemy import Engine
+from sqlmodel import Session, col, delete, select
+
+from app.core.config import settings
+from app.core.upsert import check_upsert_support, upsert
+from app.models.ratelimit import RateLimitCounter
+
+logger = getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+class MemoryRateLimitBackend(object):
+    """
+    Keeps the counters of the current and the previous window in memory,
+    every worker process counts on its own.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # name -> (slot, hits in slot, hits in previous slot)
+        self.counters: dict[str, tuple[int, int, int]] = {}
+
+    def hit(self, name: str, slot: int) -> tuple[int, int]:
+        with self.lock:
+            counter_slot, hits, previous = self.counters.get(name, (slot, 0, 0))
+
+            if counter_slot == slot - 1:
+                previous, hits = hits, 0
+            elif counter_slot != slot:
+                previous, hits = 0, 0
+
+            hits += 1
+            self.counters[name] = (slot, hits, previous)
+
+        return previous, hits
+
+    def cleanup(self, slots: dict[str, int]):
+        with self.lock:
+            for name, (counter_slot, _, _) in list(self.counters.items()):
+                scope = name.split(":", 1)[0]
+                if counter_slot < slots.get(scope, counter_slot) - 1:
+                    del self.counters[name]
+
+
+class DatabaseRateLimitBackend(object):
+    """
+    Stores the counters in the database, so all workers of a deployment
+    share them. Counters are increased atomically with an upsert.
+    """
+
+    def __init__(self, engine: Engine):
+        check_upsert_support(engine)
+        self.engine = engine
+
+    def increment_statement(self, name: str, slot: int):
+        table = RateLimitCounter.__table__
+        return upsert(
+            self.engine,
+            table,
+            {"name": name, "slot": slot, "hits": 1},
+            ["name", "slot"],
+            {"hits": table.c.hits + 1},
+        )
+
+    def hit(self, name: str, slot: int) -> tuple[int, int]:
+        with Session(self.engine) as session:
+            session.exec(self.increment_statement(name, slot))
+            counts = dict(
+                session.exec(
+                    select(RateLimitCounter.slot, RateLimitCounter.hits)
+                    .where(RateLimitCounter.name == name)
+                    .where(col(RateLimitCounter.slot).in_([slot - 1, slot]))
+                ).all()
+            )
+            session.commit()
+
+        return counts.get(slot - 1, 0), counts.get(slot, 0)
+
+    def cleanup(self, slots: dict[str, int]):
+        with Session(self.engine) as session:
+            for scope, slot in slots.items():
+                session.exec(
+                    delete(RateLimitCounter)
+                    .where(col(RateLimitCounter.name).startswith(f"{scope}:"))
+                    .where(RateLimitCounter.slot < slot - 1)
+                )
+            session.commit()
+
+
+class RateLimiter(object):
+    """
+    Sliding window rate limiter. The number of requests in the last window is
+    estimated from the counters of the current and the previous fixed window,
+    weighted by how much of the previous window is still covered.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if RateLimiter._instance is None:
+            RateLimiter._instance = RateLimiter()
+
+        return RateLimiter._instance
+
+    def __init__(self):
+        self.backend = MemoryRateLimitBackend()
+
+        # scope -> window length, required for the cleanup
+        self.windows: dict[str, int] = {}
+
+    def start(self, engine: Engine):
+        if settings.RATE_LIMIT_BACKEND == "database":
+            self.backend = DatabaseRateLimitBackend(engine)
+
+    def check(self, scope: str, key: str, limit: int, window: int | None = None):
+        """
+        counts a request of key in the given scope and raises
+        RateLimitExceeded if more than limit requests were made in the window
+        """
+        if not settings.RATE_LIMIT_ENABLED or limit <= 0:
+            return
+
+        window = window or settings.RATE_LIMIT_WINDOW
+        self.windows[scope] = window
+
+        now = time.time()
+        slot = int(now // window)
+        elapsed = now - slot * window
+
+        name = f"{scope}:{key}"[:255]
+        try:
+            previous, current = self.backend.hit(name, slot)
+        except Exception:
+            # don't lock everybody out because the counters are unavailable
+            logger.exception("Failed to count request for rate limiting")
+            return
+
+        estimate = previous * (window - elapsed) / window + current
+        if estimate > limit:
+            logger.warning(f"Rate limit of {scope} exceeded by {key}")
+            raise RateLimitExceeded(max(1, math.ceil(window - elapsed)))
+
+    def cleanup(self):
+        now = time.time()
+        slots = {scope: int(now // window) for scope, window in self.windows.items()}
+        try:
+            self.backend.cleanup(slots)
+        except Exception:
+            logger.exception("Failed to clean up rate limit counters")
+
+
+@lru_cache
+def get_trusted_networks(
+    networks: tuple[str, ...],
+) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+    return [ipaddress.ip_network(network) for network in networks]
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+
+    return any(
+        ip in network
+        for network in get_trusted_networks(tuple(settings.TRUSTED_PROXIES))
+    )
+
+
+def get_client_address(request: Request) -> str:
+    """
+    returns the address of the client, X-Forwarded-For is only used if the
+    request was made by a trusted proxy, otherwise clients could choose the
+    address they are counted for
+    """
+    address = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(address):
+        return address
+
+    # every proxy appends the address it got the request from, the last
+    # address which isn't a trusted proxy is the client
+    forwarded = request.headers.get("x-forwarded-for", "")
+    for hop in reversed(forwarded.split(",")):
+        hop = hop.strip()
+        if hop and not is_trusted_proxy(hop):
+            return hop
+
+    return address
+
+
+class RateLimit(object):
+    """
+    dependency which limits the requests per client address, the limit is
+    read from the setting with the given name
+    """
+
+    def __init__(self, scope: str, limit_setting: str):
+        self.scope = scope
+        self.limit_setting = limit_setting
+
+    def __call__(self, request: Request):
+        RateLimiter.instance().check(
+            f"{self.scope}-ip",
+            get_client_address(request),
+            getattr(settings, self.limit_setting),
+        )
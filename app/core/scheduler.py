@@ -0,0 +1,192 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime
+from functools import wraps
+from logging import getLogger
+import time
+from typing import Callable
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, JobEvent
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge, registry, timed_job
+from app.models.crud.scheduler import acquire_job_lease, release_job_lease
+
+logger = getLogger(__name__)
+
+# name of the lease in the job lease table
+LEASE_NAME = "scheduler"
+
+JOB_SKIPPED: Counter = registry.register(
+    Counter(
+        "uuru_job_skipped_total",
+        "Runs of background jobs which were skipped by the scheduler",
+        ["job", "reason"],
+    )
+)
+
+
+class LeaderLost(Exception):
+    """
+    raised by leader jobs which notice that this worker lost the lease
+    """
+
+
+class LeaderElection(object):
+    """
+    Every worker process runs a scheduler, but only the worker holding the
+    scheduler lease runs the leader jobs. The lease is renewed regularly, if
+    the leader dies it expires and the next worker trying to renew it takes
+    over.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if LeaderElection._instance is None:
+            LeaderElection._instance = LeaderElection()
+
+        return LeaderElection._instance
+
+    def __init__(self):
+        self.engine: Engine | None = None
+        self.scheduler: BackgroundScheduler | None = None
+        # monotonic time until which this worker holds the lease
+        self.leader_until = 0.0
+        # leadership at the last election, used to log changes
+        self.leader = False
+        # ids of the jobs which only run on the leader
+        self.jobs: set[str] = set()
+
+    def start(self, engine: Engine, scheduler: BackgroundScheduler):
+        self.engine = engine
+        self.scheduler = scheduler
+        scheduler.add_listener(
+            self.job_skipped, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+        )
+
+        if not settings.SCHEDULER_LEADER_ELECTION:
+            return
+
+        scheduler.add_job(
+            self.elect,
+            "interval",
+            seconds=settings.SCHEDULER_RENEW_INTERVAL,
+            id="leader_election",
+            next_run_time=datetime.now(),
+        )
+
+    def stop(self):
+        """
+        releases the lease, the next worker doesn't have to wait for the
+        expiry, call it after the scheduler was shut down
+        """
+        if not settings.SCHEDULER_LEADER_ELECTION or not self.is_leader():
+            return
+
+        self.leader_until = 0.0
+        try:
+            with Session(self.engine) as session:
+                release_job_lease(session, LEASE_NAME)
+        except Exception:
+            logger.exception("Failed to release the scheduler lease")
+
+    def is_leader(self) -> bool:
+        if not settings.SCHEDULER_LEADER_ELECTION:
+            return True
+        return time.monotonic() < self.leader_until
+
+    def check_leader(self):
+        """
+        raises LeaderLost if this worker doesn't hold the lease anymore. Long
+        running leader jobs call it between their steps, so they stop before
+        another worker which took over the lease runs the same job.
+        """
+        if not self.is_leader():
+            raise LeaderLost()
+
+    def elect(self):
+        started = time.monotonic()
+        try:
+            with Session(self.engine) as session:
+                acquired = acquire_job_lease(
+                    session, LEASE_NAME, settings.SCHEDULER_LEASE_SECONDS
+                )
+        except Exception:
+            # the lease in the database expires at the same time
+            logger.exception("Failed to renew the scheduler lease")
+        else:
+            if acquired:
+                self.leader_until = started + settings.SCHEDULER_LEASE_SECONDS
+            else:
+                self.leader_until = 0.0
+
+        leader = self.is_leader()
+        if leader == self.leader:
+            return
+
+        self.leader = leader
+        if leader:
+            logger.info("This worker is now running the background jobs")
+            self.run_jobs_now()
+        else:
+            logger.warning("This worker stopped running the background jobs")
+
+    def run_jobs_now(self):
+        """
+        starts the leader jobs right away after a failover instead of
+        waiting for their next interval
+        """
+        for job_id in self.jobs:
+            job = self.scheduler.get_job(job_id)
+            if job is not None:
+                job.modify(next_run_time=datetime.now())
+
+    def job_skipped(self, event: JobEvent):
+        reason = "missed" if event.code == EVENT_JOB_MISSED else "max_instances"
+        JOB_SKIPPED.inc(job=event.job_id, reason=reason)
+
+
+def leader_job(name: str, function: Callable) -> Callable:
+    """
+    wraps a scheduler job which only runs on the leader, the job has to be
+    added with name as its id
+    """
+    election = LeaderElection.instance()
+    election.jobs.add(name)
+
+    @wraps(function)
+    def fenced(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except LeaderLost:
+            logger.warning(f"Stopped job {name}, this worker lost the lease")
+            JOB_SKIPPED.inc(job=name, reason="leader_lost")
+
+    job = timed_job(name, fenced)
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        if not election.is_leader():
+            return
+        return job(*args, **kwargs)
+
+    return run
+
+
+registry.register(
+    Gauge(
+        "uuru_scheduler_leader",
+        "Whether this worker runs the background jobs",
+        collector=lambda: [({}, int(LeaderElection.instance().is_leader()))],
+    )
+)
@@ -7,33 +7,130 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 
 import random
 import string
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from threading import BoundedSemaphore, Lock
+import time
+from typing import Any, Callable
 
 import jwt
 from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 
 from app.core.config import settings
 
 JWT_ALGORITHM = "HS256"
-hasher = PasswordHasher()
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+hasher = PasswordHasher(
+    time_cost=settings.ARGON2_TIME_COST,
+    memory_cost=settings.ARGON2_MEMORY_COST,
+    parallelism=settings.ARGON2_PARALLELISM,
+)
+
+
+class PasswordHashingOverloaded(Exception): ...
+
+
+class PasswordHashExecutor(object):
+    """
+    Runs the memory-hard password hashing on a small dedicated thread pool,
+    so a flood of logins can't occupy every request thread and all memory.
+    Only a limited number of operations may wait for a worker, everything
+    beyond that is rejected with PasswordHashingOverloaded.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if PasswordHashExecutor._instance is None:
+            PasswordHashExecutor._instance = PasswordHashExecutor()
+
+        return PasswordHashExecutor._instance
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="argon2"
+        )
+        self.slots = BoundedSemaphore(
+            settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+        )
+
+        self.lock = Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def run(self, function: Callable, *args):
+        if not self.slots.acquire(timeout=settings.PASSWORD_HASH_TIMEOUT):
+            with self.lock:
+                self.rejected += 1
+            raise PasswordHashingOverloaded("Too many password operations in progress")
+
+        submitted = time.monotonic()
+        with self.lock:
+            self.queued += 1
+
+        def task():
+            waited = time.monotonic() - submitted
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            try:
+                return function(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        try:
+            return self.executor.submit(task).result()
+        finally:
+            self.slots.release()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": settings.PASSWORD_HASH_WORKERS,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+def _verify(hashed_password: str, plain_password: str) -> bool:
     try:
         return hasher.verify(hashed_password, plain_password)
-    except VerifyMismatchError:
+    except (VerifyMismatchError, InvalidHashError):
         return False
 
 
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return PasswordHashExecutor.instance().run(
+        _verify, hashed_password, plain_password
+    )
+
+
 def get_password_hash(password: str) -> str:
-    return hasher.hash(password)
+    return PasswordHashExecutor.instance().run(hasher.hash, password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    return hasher.check_needs_rehash(hashed_password)
 
 
-def create_access_token(subject: str | Any, expires_delta: timedelta) -> str:
+def create_access_token(
+    subject: str | Any, expires_delta: timedelta, version: int = 0
+) -> str:
     expire = datetime.now(timezone.utc) + expires_delta
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {"exp": expire, "sub": str(subject), "ver": version}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
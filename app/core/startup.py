@@ -0,0 +1,61 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from contextlib import contextmanager
+from logging import getLogger
+import time
+
+logger = getLogger(__name__)
+
+
+class Startup(object):
+    """
+    Records how long the imports and the phases of the application startup
+    took and whether the application is ready to serve requests.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if Startup._instance is None:
+            Startup._instance = Startup()
+
+        return Startup._instance
+
+    def __init__(self):
+        # created with the first import of this module
+        self.created = time.perf_counter()
+        # phase -> seconds
+        self.phases: dict[str, float] = {}
+        self.ready = False
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        logger.debug(f"Startup phase {name} took {seconds:.3f}s")
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark_ready(self):
+        self.ready = True
+        slowest = sorted(self.phases.items(), key=lambda phase: -phase[1])[:3]
+        logger.info(
+            f"Ready after {time.perf_counter() - self.created:.2f}s, slowest: "
+            + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest)
+        )
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phases": dict(self.phases),
+        }
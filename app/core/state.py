@@ -0,0 +1,304 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime, timedelta
+import json
+from logging import getLogger
+from threading import Lock
+import time
+from typing import Any
+
+import sqlalchemy
+from sqlalchemy import Engine
+from sqlmodel import Session, col, delete, or_, select
+
+from app.core.config import settings
+from app.core.upsert import check_upsert_support, upsert
+from app.models.state import SharedStateEntry
+
+logger = getLogger(__name__)
+
+# seconds between removals of expired entries
+CLEANUP_INTERVAL = 600
+
+
+class MemoryStateBackend(object):
+    """
+    Keeps the state in this process, only suitable if uURU runs with a
+    single worker.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # (namespace, key) -> (monotonic expiry or None, value)
+        self.entries: dict[tuple[str, str], tuple[float | None, str]] = {}
+
+    @staticmethod
+    def alive(expires: float | None) -> bool:
+        return expires is None or expires > time.monotonic()
+
+    @staticmethod
+    def expiry(ttl: float | None) -> float | None:
+        return None if ttl is None else time.monotonic() + ttl
+
+    def get(self, namespace: str, key: str) -> str | None:
+        with self.lock:
+            expires, value = self.entries.get((namespace, key), (None, None))
+            return value if self.alive(expires) else None
+
+    def set(self, namespace: str, key: str, value: str, ttl: float | None):
+        with self.lock:
+            self.entries[(namespace, key)] = (self.expiry(ttl), value)
+
+    def add(self, namespace: str, key: str, value: str, ttl: float | None) -> str:
+        with self.lock:
+            expires, stored = self.entries.get((namespace, key), (None, None))
+            if stored is not None and self.alive(expires):
+                return stored
+
+            self.entries[(namespace, key)] = (self.expiry(ttl), value)
+            return value
+
+    def delete(self, namespace: str, key: str):
+        with self.lock:
+            self.entries.pop((namespace, key), None)
+
+    def items(self, namespace: str) -> dict[str, str]:
+        with self.lock:
+            return {
+                key: value
+                for (entry_namespace, key), (expires, value) in self.entries.items()
+                if entry_namespace == namespace and self.alive(expires)
+            }
+
+    def cleanup(self):
+        with self.lock:
+            for name, (expires, _) in list(self.entries.items()):
+                if not self.alive(expires):
+                    del self.entries[name]
+
+
+class DatabaseStateBackend(object):
+    """
+    Stores the state in the sharedstateentry table of the application
+    database, so all workers of a deployment share it.
+    """
+
+    def __init__(self, engine: Engine):
+        check_upsert_support(engine)
+        self.engine = engine
+
+    @staticmethod
+    def expiry(ttl: float | None) -> datetime | None:
+        return None if ttl is None else datetime.now() + timedelta(seconds=ttl)
+
+    @staticmethod
+    def alive():
+        return or_(
+            col(SharedStateEntry.expires).is_(None),
+            SharedStateEntry.expires > datetime.now(),
+        )
+
+    def upsert_statement(self, namespace: str, key: str, value: str, expires):
+        return upsert(
+            self.engine,
+            SharedStateEntry.__table__,
+            {"namespace": namespace, "key": key, "value": value, "expires": expires},
+            ["namespace", "key"],
+            {"value": value, "expires": expires},
+        )
+
+    def get(self, namespace: str, key: str) -> str | None:
+        with Session(self.engine) as session:
+            return session.exec(
+                select(SharedStateEntry.value)
+                .where(SharedStateEntry.namespace == namespace)
+                .where(SharedStateEntry.key == key)
+                .where(self.alive())
+            ).first()
+
+    def set(self, namespace: str, key: str, value: str, ttl: float | None):
+        with Session(self.engine) as session:
+            session.exec(self.upsert_statement(namespace, key, value, self.expiry(ttl)))
+            session.commit()
+
+    def add(self, namespace: str, key: str, value: str, ttl: float | None) -> str:
+        with Session(self.engine) as session:
+            # an expired entry doesn't count
+            session.exec(
+                delete(SharedStateEntry)
+                .where(SharedStateEntry.namespace == namespace)
+                .where(SharedStateEntry.key == key)
+                .where(SharedStateEntry.expires < datetime.now())
+            )
+            session.add(
+                SharedStateEntry(
+                    namespace=namespace, key=key, value=value, expires=self.expiry(ttl)
+                )
+            )
+            try:
+                session.commit()
+                return value
+            except sqlalchemy.exc.IntegrityError:
+                # another worker was faster
+                session.rollback()
+
+        stored = self.get(namespace, key)
+        return value if stored is None else stored
+
+    def delete(self, namespace: str, key: str):
+        with Session(self.engine) as session:
+            session.exec(
+                delete(SharedStateEntry)
+                .where(SharedStateEntry.namespace == namespace)
+                .where(SharedStateEntry.key == key)
+            )
+            session.commit()
+
+    def items(self, namespace: str) -> dict[str, str]:
+        with Session(self.engine) as session:
+            return dict(
+                session.exec(
+                    select(SharedStateEntry.key, SharedStateEntry.value)
+                    .where(SharedStateEntry.namespace == namespace)
+                    .where(self.alive())
+                ).all()
+            )
+
+    def cleanup(self):
+        with Session(self.engine) as session:
+            session.exec(
+                delete(SharedStateEntry).where(
+                    SharedStateEntry.expires < datetime.now()
+                )
+            )
+            session.commit()
+
+
+class RedisStateBackend(object):
+    """
+    Stores the state in redis or a compatible server (valkey, dragonfly),
+    entries expire on the server.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def name(namespace: str, key: str) -> str:
+        return f"uuru:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> str | None:
+        return self.client.get(self.name(namespace, key))
+
+    def set(self, namespace: str, key: str, value: str, ttl: float | None):
+        self.client.set(
+            self.name(namespace, key),
+            value,
+            px=None if ttl is None else int(ttl * 1000),
+        )
+
+    def add(self, namespace: str, key: str, value: str, ttl: float | None) -> str:
+        name = self.name(namespace, key)
+        if self.client.set(
+            name, value, px=None if ttl is None else int(ttl * 1000), nx=True
+        ):
+            return value
+
+        stored = self.client.get(name)
+        return value if stored is None else stored
+
+    def delete(self, namespace: str, key: str):
+        self.client.delete(self.name(namespace, key))
+
+    def items(self, namespace: str) -> dict[str, str]:
+        prefix = self.name(namespace, "")
+        names = list(self.client.scan_iter(match=f"{prefix}*", count=500))
+        if not names:
+            return {}
+
+        return {
+            name.removeprefix(prefix): value
+            for name, value in zip(names, self.client.mget(names))
+            # expired between the scan and the read
+            if value is not None
+        }
+
+    def cleanup(self):
+        pass
+
+
+class SharedState(object):
+    """
+    Key value store for state which has to be the same in all workers. Values
+    are json encoded and grouped by namespace. Which backend is used is
+    configured by STATE_BACKEND.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if SharedState._instance is None:
+            SharedState._instance = SharedState()
+
+        return SharedState._instance
+
+    def __init__(self):
+        self.backend = MemoryStateBackend()
+
+    def start(self, engine: Engine):
+        if settings.STATE_BACKEND == "database":
+            self.backend = DatabaseStateBackend(engine)
+        elif settings.STATE_BACKEND == "redis":
+            try:
+                import redis
+            except ImportError:
+                if settings.WORKERS > 1:
+                    raise RuntimeError(
+                        "Redis state backend requested but redis is missing"
+                    )
+                logger.warning(
+                    "Redis state backend requested but redis is missing, "
+                    "keeping the state in memory"
+                )
+                return
+
+            self.backend = RedisStateBackend(
+                redis.Redis.from_url(settings.STATE_REDIS_URL, decode_responses=True)
+            )
+
+        logger.info(f"Using {settings.STATE_BACKEND} state backend")
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        value = self.backend.get(namespace, key)
+        return default if value is None else json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float | None = None):
+        self.backend.set(namespace, key, json.dumps(value), ttl)
+
+    def add(self, namespace: str, key: str, value: Any, ttl: float | None = None):
+        """
+        stores value if the key doesn't exist yet, returns the stored value
+        so all workers agree on the value of the first one
+        """
+        return json.loads(self.backend.add(namespace, key, json.dumps(value), ttl))
+
+    def delete(self, namespace: str, key: str):
+        self.backend.delete(namespace, key)
+
+    def items(self, namespace: str) -> dict[str, Any]:
+        return {
+            key: json.loads(value)
+            for key, value in self.backend.items(namespace).items()
+        }
+
+    def cleanup(self):
+        try:
+            self.backend.cleanup()
+        except Exception:
+            logger.exception("Failed to remove expired state")
@@ -0,0 +1,234 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+from logging import getLogger
+from typing import Callable
+
+from fastapi import FastAPI, Request
+from sqlalchemy import Engine, event
+from sqlmodel import Session
+
+from app.core.config import settings
+
+logger = getLogger(__name__)
+
+# statements are cut to this length in span attributes
+MAX_STATEMENT_LENGTH = 1000
+
+
+class Tracing(object):
+    """
+    Optional OpenTelemetry instrumentation. Spans are only created if
+    TRACING_ENABLED is set and the opentelemetry sdk is installed, otherwise
+    all helpers in this module do nothing.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if Tracing._instance is None:
+            Tracing._instance = Tracing()
+
+        return Tracing._instance
+
+    def __init__(self):
+        self.tracer = None
+        self.provider = None
+        # file the spans are written to by the file exporter
+        self.trace_file = None
+        self.engine_names: dict[Engine, str] = {}
+
+    def setup(self, app: FastAPI, engines: dict[str, Engine]):
+        """
+        configures the exporter and instruments the app and the given
+        engines, this has to be called before the app is started
+        """
+        if not settings.TRACING_ENABLED:
+            return
+
+        try:
+            from opentelemetry import trace
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.sdk.trace.sampling import (
+                ParentBased,
+                TraceIdRatioBased,
+            )
+        except ImportError:
+            logger.warning("Tracing requested but opentelemetry-sdk is missing")
+            return
+
+        exporter = self.create_exporter()
+        if exporter is None:
+            return
+
+        self.provider = TracerProvider(
+            resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}),
+            sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)),
+        )
+        self.provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(self.provider)
+        self.tracer = trace.get_tracer("uuru")
+
+        for name, engine in engines.items():
+            self.instrument_engine(name, engine)
+        self.instrument_sessions()
+        self.instrument_app(app)
+
+        logger.info(f"Tracing enabled, exporting via {settings.TRACING_EXPORTER}")
+
+    def create_exporter(self):
+        if settings.TRACING_EXPORTER == "file":
+            from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+            # one json document per line
+            self.trace_file = open(settings.TRACING_FILE, "a")
+            return ConsoleSpanExporter(
+                out=self.trace_file,
+                formatter=lambda span: span.to_json(indent=None) + "\n",
+            )
+
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError:
+            logger.warning(
+                "OTLP tracing requested but opentelemetry-exporter-otlp-proto-http "
+                "is missing"
+            )
+            return None
+
+        if settings.TRACING_OTLP_ENDPOINT is None:
+            # falls back to the OTEL_EXPORTER_OTLP_* environment variables
+            return OTLPSpanExporter()
+        return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+
+    def shutdown(self):
+        if self.provider is not None:
+            self.provider.shutdown()
+
+        # closed after the remaining spans were exported
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+    def instrument_engine(self, name: str, engine: Engine):
+        self.engine_names[engine] = name
+        tracer = self.tracer
+
+        def before_cursor_execute(conn, cursor, statement, params, context, many):
+            context._uuru_span = tracer.start_span(
+                f"db {statement.split(' ', 1)[0].upper()}",
+                attributes={
+                    "db.system": engine.dialect.name,
+                    "db.statement": statement[:MAX_STATEMENT_LENGTH],
+                    "uuru.engine": name,
+                },
+            )
+
+        def after_cursor_execute(conn, cursor, statement, params, context, many):
+            span = getattr(context, "_uuru_span", None)
+            if span is not None:
+                span.end()
+
+        def handle_error(exception_context):
+            context = exception_context.execution_context
+            span = getattr(context, "_uuru_span", None)
+            if span is not None:
+                span.record_exception(exception_context.original_exception)
+                span.end()
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
+
+    def instrument_sessions(self):
+        """
+        commits are no statements, the span covers flush and commit
+        """
+        tracer = self.tracer
+
+        def before_commit(session: Session):
+            name = self.engine_names.get(session.get_bind(), "unknown")
+            session.info["uuru_span"] = tracer.start_span(
+                "db COMMIT", attributes={"uuru.engine": name}
+            )
+
+        def end_commit(session: Session):
+            span = session.info.pop("uuru_span", None)
+            if span is not None:
+                span.end()
+
+        event.listen(Session, "before_commit", before_commit)
+        event.listen(Session, "after_commit", end_commit)
+        event.listen(Session, "after_soft_rollback", lambda s, _: end_commit(s))
+
+    def instrument_app(self, app: FastAPI):
+        try:
+            from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+            FastAPIInstrumentor.instrument_app(app)
+            return
+        except ImportError:
+            pass
+
+        @app.middleware("http")
+        async def trace_request(request: Request, call_next):
+            with span(f"{request.method} {request.url.path}") as request_span:
+                response = await call_next(request)
+                if request_span is not None:
+                    route = request.scope.get("route")
+                    request_span.update_name(
+                        f"{request.method} {getattr(route, 'path', 'unmatched')}"
+                    )
+                    request_span.set_attribute(
+                        "http.response.status_code", response.status_code
+                    )
+                return response
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    creates a span which is the parent of all spans created within, yields
+    None if tracing is disabled
+    """
+    tracer = Tracing.instance().tracer
+    if tracer is None:
+        yield None
+        return
+
+    attributes = {k: str(v) for k, v in attributes.items() if v is not None}
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def traced(name: str | None = None) -> Callable:
+    """
+    decorator which runs the function in a span named after the function
+    """
+
+    def decorator(function: Callable) -> Callable:
+        module = function.__module__.rsplit(".", 1)[-1]
+        span_name = name or f"{module}.{function.__name__}"
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if Tracing.instance().tracer is None:
+                return function(*args, **kwargs)
+
+            with span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,51 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from typing import Any
+
+from sqlalchemy import Engine, Table
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# database dialects which support inserting or updating a row atomically
+SUPPORTED_DIALECTS = ("postgresql", "sqlite", "mysql", "mariadb")
+
+
+def check_upsert_support(engine: Engine):
+    """
+    raises a RuntimeError if the database of the engine doesn't support
+    upserts, backends relying on them call it when they are started
+    """
+    if engine.dialect.name not in SUPPORTED_DIALECTS:
+        raise RuntimeError(
+            f"Unsupported database dialect {engine.dialect.name}, "
+            f"the shared backends require one of {', '.join(SUPPORTED_DIALECTS)}"
+        )
+
+
+def upsert(
+    engine: Engine,
+    table: Table,
+    values: dict[str, Any],
+    index_elements: list[str],
+    update: dict[str, Any],
+):
+    """
+    returns a statement inserting values into the table, a row conflicting
+    on the unique index_elements is updated with update instead
+    """
+    dialect = engine.dialect.name
+    if dialect in ("mysql", "mariadb"):
+        return mysql_insert(table).values(**values).on_duplicate_key_update(**update)
+
+    insert = postgres_insert if dialect == "postgresql" else sqlite_insert
+    return (
+        insert(table)
+        .values(**values)
+        .on_conflict_do_update(index_elements=index_elements, set_=update)
+    )
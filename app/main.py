@@ -6,12 +6,17 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 """
 
 from contextlib import asynccontextmanager
+from datetime import datetime
 import logging
 from pathlib import Path
+import time
+
+# imported first, the import phase covers all other imports
+from app.core.startup import Startup
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.exception_handlers import http_exception_handler
 from sqlmodel import Session
@@ -19,37 +24,132 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 from app.core.db import engine, engine_asterisk, init_asterisk_db, init_db, drop_db
 from app.core.config import settings
+from app.core.ldap import LDAPPool
+from app.core.metrics import HTTP_REQUEST_SECONDS, timed_job
+from app.core.tracing import Tracing
+from app.core.ratelimit import RateLimiter, RateLimitExceeded
+from app.core.scheduler import LeaderElection, leader_job
+from app.core.state import CLEANUP_INTERVAL, SharedState
+from app.core.security import PasswordHashingOverloaded
 
 from app.api.main import router as api_router
-from app.telephoning.websip import WebSIPManager
+from app.api.metrics import router as metrics_router
+from app.api.client.http import FederationClient
+from app.api.client.phonebook import PeerPhonebookSync
+from app.models.crud.extension import compact_phonebook_changes
+from app.models.crud.ldap import LDAPSync
+from app.telephoning.websip import JOB_INTERVAL, WebSIPManager
 from app.telephoning.main import Telephoning
+from app.telephoning.agi import FastAGIServer
+
+# seconds between removals of old phonebook changes
+PHONEBOOK_COMPACTION_INTERVAL = 3600
 
-background_scheduler = BackgroundScheduler()
+background_scheduler = BackgroundScheduler(
+    job_defaults={
+        "coalesce": settings.SCHEDULER_COALESCE,
+        "max_instances": settings.SCHEDULER_MAX_INSTANCES,
+        "misfire_grace_time": settings.SCHEDULER_MISFIRE_GRACE_TIME,
+    }
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    with Session(engine) as session:
+    startup = Startup.instance()
+
+    with startup.phase("init_db"), Session(engine) as session:
         init_db(session)
+        WebSIPManager.instance().setup(session)
 
-    with Session(engine_asterisk) as session_asterisk:
+    with startup.phase("init_asterisk_db"), Session(
+        engine_asterisk
+    ) as session_asterisk:
         init_asterisk_db(session_asterisk)
 
-    Telephoning.instance().start(app, background_scheduler)
+    with startup.phase("state"):
+        SharedState.instance().start(engine)
+
+    with startup.phase("ldap"):
+        LDAPPool.instance()
+        RateLimiter.instance().start(engine)
+        LDAPSync.instance().start(engine)
+
+    with startup.phase("telephoning"):
+        Telephoning.instance().start(app, background_scheduler)
+    with startup.phase("fastagi"):
+        await FastAGIServer.instance().start()
+
+    # all jobs are started in the background, the first runs don't delay
+    # the startup
+    background_scheduler.add_job(
+        leader_job("websip", WebSIPManager.instance().job),
+        "interval",
+        seconds=JOB_INTERVAL,
+        args=[engine, engine_asterisk],
+        id="websip",
+        next_run_time=datetime.now(),
+    )
+    background_scheduler.add_job(
+        leader_job("phonebook_sync", PeerPhonebookSync.instance().job),
+        "interval",
+        seconds=settings.FEDERATION_PHONEBOOK_SYNC_INTERVAL,
+        args=[engine],
+        id="phonebook_sync",
+        next_run_time=datetime.now(),
+    )
+    background_scheduler.add_job(
+        leader_job("phonebook_compaction", compact_phonebook_changes),
+        "interval",
+        seconds=PHONEBOOK_COMPACTION_INTERVAL,
+        args=[engine],
+        id="phonebook_compaction",
+    )
+    background_scheduler.add_job(
+        leader_job("ldap_reconcile", LDAPSync.instance().reconcile),
+        "interval",
+        seconds=settings.LDAP_RECONCILE_INTERVAL,
+        id="ldap_reconcile",
+        next_run_time=datetime.now(),
+    )
+    # the in memory rate limit counters of every worker have to be cleaned
+    background_scheduler.add_job(
+        timed_job("rate_limit_cleanup", RateLimiter.instance().cleanup),
+        "interval",
+        seconds=settings.RATE_LIMIT_WINDOW,
+        id="rate_limit_cleanup",
+    )
     background_scheduler.add_job(
-        WebSIPManager.instance().job, "interval", seconds=30, args=[engine_asterisk]
+        timed_job("state_cleanup", SharedState.instance().cleanup),
+        "interval",
+        seconds=CLEANUP_INTERVAL,
+        id="state_cleanup",
     )
-    background_scheduler.start()
+    with startup.phase("scheduler"):
+        LeaderElection.instance().start(engine, background_scheduler)
+        background_scheduler.start()
+
+    startup.mark_ready()
 
     yield
 
-    Telephoning.instance().stop()
-    background_scheduler.shutdown()
+    startup.ready = False
 
-    with Session(engine_asterisk) as session_asterisk:
-        WebSIPManager.instance().teardown(session_asterisk)
+    await FastAGIServer.instance().stop()
+    background_scheduler.shutdown()
+    # the flavors are stopped after their jobs finished
+    Telephoning.instance().stop()
+    LeaderElection.instance().stop()
+    PeerPhonebookSync.instance().shutdown()
+    FederationClient.instance().close()
+    LDAPSync.instance().stop()
+    LDAPPool.instance().close()
+    Tracing.instance().shutdown()
 
     if settings.LIFESPAN_DROP_DB:
+        # the WebSIP state is lost with the database, remove the endpoints
+        with Session(engine) as session, Session(engine_asterisk) as session_asterisk:
+            WebSIPManager.instance().teardown(session, session_asterisk)
         drop_db()
 
 
@@ -79,6 +179,29 @@ if settings.all_cors_origins:
 
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.include_router(metrics_router)
+
+Tracing.instance().setup(app, {"app": engine, "asterisk": engine_asterisk})
+
+Startup.instance().record("import", time.perf_counter() - Startup.instance().created)
+
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(
+        {"detail": "Too many requests, please try again later"},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(PasswordHashingOverloaded)
+async def password_hashing_overloaded(request: Request, exc: PasswordHashingOverloaded):
+    return JSONResponse(
+        {"detail": "Too many requests, please try again later"},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
 
 build_path = Path("frontend/build")
 app.mount("/app", StaticFiles(directory=build_path), name="static")
@@ -96,6 +219,25 @@ async def fallback(request: Request, call_next):
     return await call_next(request)
 
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # the route template keeps the number of label values small
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code,
+        )
+
+
 @app.get("/")
 def index():
     return RedirectResponse("/app/")
@@ -14,20 +14,38 @@ from app.models.asterisk import (
     PSContact,
 )
 from app.models.user import Invite, User
-from app.models.extension import Extension, TemporaryExtensions
-from app.models.federation import Peer, IncomingPeeringRequest, OutgoingPeeringRequest
-from app.models.media import ExtensionMedia, Media
+from app.models.extension import Extension, PhonebookChange, TemporaryExtensions
+from app.models.federation import (
+    Peer,
+    PeerPhonebookEntry,
+    IncomingPeeringRequest,
+    OutgoingPeeringRequest,
+)
+from app.models.discovery import DiscoveryTarget
+from app.models.media import ExtensionMedia, Media, MediaFile
+from app.models.ratelimit import RateLimitCounter
+from app.models.scheduler import JobLease
+from app.models.state import SharedStateEntry
+from app.models.websip import WebSIPSession
 
 tables = [
     User,
     Extension,
+    PhonebookChange,
     TemporaryExtensions,
     Invite,
     Peer,
+    PeerPhonebookEntry,
     IncomingPeeringRequest,
     OutgoingPeeringRequest,
     Media,
     ExtensionMedia,
+    MediaFile,
+    RateLimitCounter,
+    JobLease,
+    SharedStateEntry,
+    WebSIPSession,
+    DiscoveryTarget,
 ]
 asterisk_tables = [
     PSAor,
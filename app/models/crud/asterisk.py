@@ -7,9 +7,11 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 
 from logging import getLogger
 from pydantic import BaseModel
-from sqlmodel import Session, delete, distinct, func, select
+from sqlalchemy import update
+from sqlmodel import Session, col, delete, distinct, func, select
 
 from app.core.config import settings
+from app.core.tracing import traced
 from app.models.asterisk import (
     DialPlanEntry,
     IAXFriend,
@@ -30,6 +32,7 @@ from app.telephoning.main import Telephoning
 logger = getLogger(__name__)
 
 
+@traced()
 def create_sip_account(
     session_asterisk: Session,
     extension: str,
@@ -87,6 +90,7 @@ def create_sip_account(
     return [ps_aor, ps_auth, ps_endpoint]
 
 
+@traced()
 def update_sip_account(
     session_asterisk: Session, extension: Extension, autocommit=True
 ):
@@ -125,6 +129,39 @@ def update_sip_account(
     )
 
 
+@traced()
+def rotate_sip_account(
+    session_asterisk: Session,
+    extension: str,
+    extension_name: str,
+    password: str,
+    autocommit=True,
+) -> None:
+    """
+    sets new credentials and a new caller id on an existing sip account
+    """
+    try:
+        session_asterisk.exec(
+            update(PSAuth).where(PSAuth.id == extension).values(password=password)
+        )
+        session_asterisk.exec(
+            update(PSEndpoint)
+            .where(PSEndpoint.id == extension)
+            .values(callerid=f"{extension_name} <{extension}>")
+        )
+    except Exception as e:
+        logger.exception("Couldn't rotate credentials in asterisk DB")
+        if autocommit:
+            session_asterisk.rollback()
+        raise e
+
+    if autocommit:
+        session_asterisk.commit()
+
+    logger.info(f"Rotated credentials of {extension_name} <{extension}> in asterisk DB")
+
+
+@traced()
 def delete_sip_account(
     session_asterisk: Session, extension: str, autocommit=True
 ) -> None:
@@ -144,6 +181,34 @@ def delete_sip_account(
     logger.info(f"Deleted extension <{extension}> in asterisk DB")
 
 
+@traced()
+def delete_sip_accounts(
+    session_asterisk: Session, extensions: list[str], autocommit=True
+) -> None:
+    """
+    deletes the sip accounts of all given extensions with one statement per
+    table
+    """
+    if not extensions:
+        return
+
+    try:
+        for cls in [PSEndpoint, PSAuth, PSAor]:
+            session_asterisk.exec(delete(cls).where(col(cls.id).in_(extensions)))
+
+    except Exception as e:
+        logger.exception("Couldn't delete extensions in asterisk DB")
+        if autocommit:
+            session_asterisk.rollback()
+        raise e
+
+    if autocommit:
+        session_asterisk.commit()
+
+    logger.info(f"Deleted {len(extensions)} extensions in asterisk DB")
+
+
+@traced()
 def create_or_update_callgroup(
     session: Session,
     session_asterisk: Session,
@@ -193,6 +258,7 @@ def create_or_update_callgroup(
     )
 
 
+@traced()
 def create_iax_peer(session_asterisk: Session, peer: Peer, autocommit=True):
     # create iax peer
     friend = IAXFriend(
@@ -235,6 +301,7 @@ def create_iax_peer(session_asterisk: Session, peer: Peer, autocommit=True):
         raise
 
 
+@traced()
 def delete_iax_peer(
     session_asterisk: Session,
     peer: Peer,
@@ -275,6 +342,7 @@ def get_music_on_hold_by_name(session_asterisk: Session, name: str) -> MusicOnHo
     ).first()
 
 
+@traced()
 def create_music_on_hold(
     session_asterisk: Session, extension: Extension, media_name="moh", autocommit=True
 ):
@@ -299,6 +367,7 @@ def create_music_on_hold(
             raise
 
 
+@traced()
 def update_music_on_hold(
     session_asterisk: Session, extension: Extension, media_name="moh", autocommit=True
 ):
@@ -327,6 +396,7 @@ def update_music_on_hold(
         raise
 
 
+@traced()
 def delete_music_on_hold(
     session_asterisk: Session, extension: Extension, autocommit=True
 ):
@@ -5,23 +5,29 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+from datetime import datetime, timedelta
 import random
 from logging import getLogger
-from typing import Literal, Optional
+from typing import Any, Iterable, Literal, Optional
 
 import sqlalchemy
-from ldap3 import MODIFY_DELETE, MODIFY_REPLACE, Connection
-from sqlmodel import Session, col, or_, select
+from sqlalchemy import Engine, case
+from sqlmodel import Session, col, delete, func, or_, select
 
 from app.core.config import settings
 from app.core.security import generate_extension_password, generate_extension_token
+from app.core.tracing import span, traced
 from app.models.crud import CRUDNotAllowedException
-from app.models.crud.asterisk import delete_sip_account
+from app.models.crud.asterisk import delete_sip_account, delete_sip_accounts
+from app.models.crud.ldap import LDAPSync
 from app.models.crud.media import get_media_by_id
 from app.models.extension import (
     Extension,
+    ExtensionBase,
     ExtensionCreate,
     ExtensionUpdate,
+    PhonebookChange,
+    PhonebookChanges,
     TemporaryExtensions,
 )
 from app.models.media import ExtensionMedia
@@ -31,61 +37,103 @@ from app.telephoning.main import Telephoning
 logger = getLogger(__name__)
 
 
-def ldap_add(connection: Connection, extension: Extension):
-    ldap_data = {
-        "ou": settings.SITE_NAME,
-        "sn": extension.name,
-        "telephoneNumber": extension.extension,
-        "objectClass": "organizationalPerson",
-    }
-
-    if extension.location_name is not None and len(extension.location_name) > 0:
-        ldap_data["l"] = extension.location_name
+def record_phonebook_change(session: Session, extension: str):
+    """
+    records that the given extension changed, this has to be called in the
+    same transaction as the change itself
+    """
+    session.add(PhonebookChange(extension=extension))
+
+
+@traced()
+def get_phonebook_changes(session: Session, since: int = 0) -> PhonebookChanges:
+    """
+    returns all changes of the public phonebook since the given sequence
+    number. If the sequence number is unknown, the full phonebook is returned.
+    The sequence starts with a change created by init_db, so the returned
+    sequence number is never 0, which peers treat as "no sync position".
+
+    Change ids are assigned when a change is inserted, a change with a lower
+    id may still be uncommitted when a higher one is visible. The returned
+    sequence number is therefore the newest change older than
+    FEDERATION_PHONEBOOK_CHANGE_DELAY, newer changes are sent again with
+    the next request.
+    """
+    settled_before = datetime.now() - timedelta(
+        seconds=settings.FEDERATION_PHONEBOOK_CHANGE_DELAY
+    )
+    latest, oldest = session.exec(
+        select(
+            func.max(
+                case((PhonebookChange.created <= settled_before, PhonebookChange.id))
+            ),
+            func.min(PhonebookChange.id),
+        )
+    ).one()
+    if latest is None:
+        # all changes are recent
+        latest = oldest - 1 if oldest is not None else 0
+
+    if since <= 0 or since > latest or (oldest is not None and since < oldest - 1):
+        extensions = filter_extensions_by_name(session, public=True)
+        return PhonebookChanges(
+            seq=latest,
+            full=True,
+            upserts=[ExtensionBase.model_validate(e) for e in extensions],
+        )
 
-    connection.add(
-        f"cn={extension.extension},{settings.LDAP_BASE_DN}", attributes=ldap_data
+    changed = set(
+        session.exec(
+            select(PhonebookChange.extension)
+            .where(PhonebookChange.id > since)
+            .where(PhonebookChange.id <= latest)
+            # the start of the sequence doesn't belong to an extension
+            .where(PhonebookChange.extension != "")
+            .distinct()
+        ).all()
     )
 
-    if connection.result["result"] != 0:
-        logger.error(
-            f"Failed to add extension {extension.name} <{extension.extension}> to ldap"
-        )
-        raise CRUDNotAllowedException("Failed to add extension to LDAP")
+    public = session.exec(
+        select(Extension)
+        .where(col(Extension.extension).in_(changed))
+        .where(Extension.public == True)
+    ).all()
 
+    upserts = [ExtensionBase.model_validate(e) for e in public]
+    deletes = changed - {e.extension for e in upserts}
 
-def ldap_delete(connection: Connection, extension: Extension):
-    connection.delete(f"cn={extension.extension},{settings.LDAP_BASE_DN}")
+    return PhonebookChanges(seq=latest, upserts=upserts, deletes=sorted(deletes))
 
-    if connection.result["result"] != 0:
-        logger.error(
-            f"Failed to delete extension {extension.name} <{extension.extension}> from ldap"
-        )
-        raise CRUDNotAllowedException("Failed to delete extension from ldap")
-
-
-def ldap_update(connection: Connection, extension: Extension, update_data, prev_data):
-    ldap_data = {}
-    print(update_data)
-    if "location_name" in update_data:
-        if update_data["location_name"]:
-            ldap_data["l"] = [(MODIFY_REPLACE, [update_data["location_name"]])]
-        elif prev_data["location_name"]:
-            ldap_data["l"] = [(MODIFY_DELETE, [])]
-    if "name" in update_data:
-        ldap_data["sn"] = [(MODIFY_REPLACE, [update_data["name"]])]
-    connection.modify(f"cn={extension.extension},{settings.LDAP_BASE_DN}", ldap_data)
-
-    if connection.result["result"] != 0:
-        logger.error(
-            f"Failed to update extension {extension.name} <{extension.extension}> in ldap"
+
+def compact_phonebook_changes(engine: Engine):
+    """
+    removes changes older than FEDERATION_PHONEBOOK_CHANGE_RETENTION, the
+    newest change is kept so the sequence continues. Peers which request the
+    changes since a removed one get the full phonebook.
+    """
+    removed_before = datetime.now() - timedelta(
+        seconds=settings.FEDERATION_PHONEBOOK_CHANGE_RETENTION
+    )
+    with Session(engine) as session:
+        latest = session.exec(select(func.max(PhonebookChange.id))).one()
+        if latest is None:
+            return
+
+        result = session.exec(
+            delete(PhonebookChange)
+            .where(PhonebookChange.created < removed_before)
+            .where(PhonebookChange.id < latest)
         )
-        raise CRUDNotAllowedException("Failed to update extension in ldap")
+        session.commit()
+
+    if result.rowcount:
+        logger.info(f"Removed {result.rowcount} old phonebook changes")
 
 
+@traced()
 def create_extension(
     session: Session,
     session_asterisk: Session,
-    ldap: Connection,
     user: User,
     extension: ExtensionCreate,
     autocommit=True,
@@ -141,6 +189,7 @@ def create_extension(
             },
         )
         session.add(db_obj)
+        record_phonebook_change(session, db_obj.extension)
 
         for name in assigned_media.keys():
             ext_media = ExtensionMedia(
@@ -155,10 +204,8 @@ def create_extension(
             session.refresh(db_obj)
             session_asterisk.commit()
 
-        flavor.on_extension_create(session, session_asterisk, user, db_obj)
-
-        if extension.public:
-            ldap_add(ldap, extension)
+        with span("flavor.on_extension_create", flavor=type(flavor).__name__):
+            flavor.on_extension_create(session, session_asterisk, user, db_obj)
 
     except sqlalchemy.exc.IntegrityError:
         if autocommit:
@@ -178,6 +225,9 @@ def create_extension(
         session.refresh(db_obj)
         session_asterisk.commit()
 
+    if db_obj.public:
+        LDAPSync.instance().enqueue([db_obj.extension])
+
     logger.info(
         f"{user.username} created extension {extension.name} <{extension.extension}> in DB"
     )
@@ -185,10 +235,10 @@ def create_extension(
     return db_obj
 
 
+@traced()
 def update_extension(
     session: Session,
     session_asterisk: Session,
-    ldap: Connection,
     user: User,
     extension: Extension,
     update_data: ExtensionUpdate,
@@ -266,19 +316,14 @@ def update_extension(
             raise CRUDNotAllowedException("Extension name too long!")
 
         session.add(extension)
+        record_phonebook_change(session, extension.extension)
 
         if autocommit:
             session.commit()
             session.refresh(extension)
             session_asterisk.commit()
-        flavor.on_extension_update(session, session_asterisk, user, extension)
-
-        if prev_data["public"] and not extension.public:  # user change to not public
-            ldap_delete(ldap, extension)
-        elif not prev_data["public"] and extension.public:  # changed to public
-            ldap_add(ldap, extension)
-        else:  # modified
-            ldap_update(ldap, extension, data, prev_data)
+        with span("flavor.on_extension_update", flavor=type(flavor).__name__):
+            flavor.on_extension_update(session, session_asterisk, user, extension)
 
     except Exception as e:
         logger.exception("Failed updating extension")
@@ -292,6 +337,9 @@ def update_extension(
         session.refresh(extension)
         session_asterisk.commit()
 
+    if prev_data["public"] or extension.public:
+        LDAPSync.instance().enqueue([extension.extension])
+
     logger.info(
         f"{user.username} updated extension {extension.name} <{extension.extension}> in DB"
     )
@@ -299,10 +347,10 @@ def update_extension(
     return extension
 
 
+@traced()
 def delete_extension(
     session: Session,
     session_asterisk: Session,
-    ldap: Connection,
     user: User,
     extension: Extension,
     autocommit=True,
@@ -315,16 +363,15 @@ def delete_extension(
         raise CRUDNotAllowedException("Unkown phone type!")
 
     try:
-        flavor.on_extension_delete(session, session_asterisk, user, extension)
+        with span("flavor.on_extension_delete", flavor=type(flavor).__name__):
+            flavor.on_extension_delete(session, session_asterisk, user, extension)
 
         for e in extension.assigned_media:
             session.delete(e)
             session.refresh(extension)
 
         session.delete(extension)
-
-        if extension.public:
-            ldap_delete(ldap, extension)
+        record_phonebook_change(session, extension.extension)
     except Exception as e:
         logger.exception("Failed deleting extension")
         if autocommit:
@@ -337,11 +384,15 @@ def delete_extension(
         session.refresh(user)
         session_asterisk.commit()
 
+    if extension.public:
+        LDAPSync.instance().enqueue([extension.extension])
+
     logger.info(
         f"{user.username} deleted extension {extension.name} <{extension.extension}> in DB"
     )
 
 
+@traced()
 def delete_tmp_extension(
     session: Session,
     session_asterisk: Session,
@@ -365,6 +416,70 @@ def delete_tmp_extension(
     logger.info(f"Deleted temporary extension {tmp_extension.extension} in DB")
 
 
+@traced()
+def delete_tmp_extensions(
+    session: Session,
+    session_asterisk: Session,
+    tmp_extensions: list[TemporaryExtensions],
+    autocommit=True,
+) -> None:
+    """
+    deletes the given temporary extensions with one statement per table
+    """
+    if not tmp_extensions:
+        return
+
+    extensions = [tmp_extension.extension for tmp_extension in tmp_extensions]
+    try:
+        delete_sip_accounts(session_asterisk, extensions, autocommit=False)
+        session.exec(
+            delete(TemporaryExtensions).where(
+                col(TemporaryExtensions.extension).in_(extensions)
+            )
+        )
+    except Exception as e:
+        logger.exception("Failed to delete temporary extensions")
+        if autocommit:
+            session.rollback()
+            session_asterisk.rollback()
+        raise e
+
+    if autocommit:
+        session.commit()
+        session_asterisk.commit()
+
+    logger.info(f"Deleted {len(extensions)} temporary extensions in DB")
+
+
+def count_free_tmp_extensions(session: Session) -> int:
+    return session.exec(
+        select(func.count()).where(col(TemporaryExtensions.ppn).is_(None))
+    ).one()
+
+
+def take_free_tmp_extensions(session: Session, count: int) -> list[TemporaryExtensions]:
+    """
+    locks up to count temporary extensions of the pool until the session is
+    committed, extensions locked by other workers are skipped
+    """
+    return list(
+        session.exec(
+            select(TemporaryExtensions)
+            .where(col(TemporaryExtensions.ppn).is_(None))
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        ).all()
+    )
+
+
+def get_assigned_tmp_extensions(session: Session) -> list[TemporaryExtensions]:
+    return list(
+        session.exec(
+            select(TemporaryExtensions).where(col(TemporaryExtensions.ppn).is_not(None))
+        ).all()
+    )
+
+
 def get_extension_by_id(
     session: Session, extension_id: str, public=True
 ) -> Extension | None:
@@ -377,7 +492,7 @@ def get_extension_by_id(
 
 
 def get_extension_by_extra_field(
-    session: Session, key: str, value: any
+    session: Session, key: str, value: Any
 ) -> Extension | None:
     # TODO: This should be optimized!
     all_extensions = session.exec(select(Extension)).all()
@@ -387,6 +502,24 @@ def get_extension_by_extra_field(
     return None
 
 
+def get_extensions_by_extra_field(
+    session: Session, key: str, values: Iterable[str], types: list[str]
+) -> dict[str, Extension]:
+    """
+    returns the extensions of the given phone types whose extra field key
+    has one of the values, all values are resolved with one query
+    """
+    field = col(Extension.extra_fields)[key].as_string()
+    return {
+        extension.extra_fields[key]: extension
+        for extension in session.exec(
+            select(Extension)
+            .where(col(Extension.type).in_(types))
+            .where(field.in_(list(values)))
+        ).all()
+    }
+
+
 def get_extension_by_token(session: Session, token: str) -> Extension | None:
     return session.exec(select(Extension).where(Extension.token == token)).first()
 
@@ -420,6 +553,7 @@ def filter_extensions_by_name(
     return list(session.exec(query).all())
 
 
+@traced()
 def generate_free_extension(
     session: Session,
     user: Optional[User] = None,
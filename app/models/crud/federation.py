@@ -8,8 +8,8 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 from logging import getLogger
 from typing import Literal
 import uuid
-from requests import HTTPError
-from sqlmodel import Session, or_, select
+from httpx import HTTPError
+from sqlmodel import Session, col, delete, or_, select
 
 from app.api.client.federation import (
     call_create_incoming_peering_request,
@@ -17,14 +17,17 @@ from app.api.client.federation import (
     call_set_outgoing_peering_request_status,
     call_teardown_request,
 )
+from app.core.tracing import traced
 from app.models.crud import CRUDNotAllowedException
 from app.models.crud.asterisk import (
     create_iax_peer,
     delete_iax_peer,
 )
+from app.models.extension import ExtensionBase, PhonebookChanges
 from app.models.federation import (
     OutgoingRequestStatus,
     Peer,
+    PeerPhonebookEntry,
     OutgoingPeeringRequest,
     IncomingPeeringRequest,
     PeerTeardownData,
@@ -60,6 +63,7 @@ def get_outgoing_peering_requests(
     return list(session.exec(select(OutgoingPeeringRequest)).all())
 
 
+@traced()
 def create_outgoing_peering_request(
     session: Session,
     user: User,
@@ -136,6 +140,7 @@ def create_outgoing_peering_request(
     return db_obj
 
 
+@traced()
 def revoke_outgoing_peering_request(
     session: Session,
     user: User,
@@ -188,6 +193,7 @@ def get_incoming_peering_requests(session: Session, user: User) -> list[Peer]:
     return list(session.exec(select(IncomingPeeringRequest)).all())
 
 
+@traced()
 def accept_incoming_peering_request(
     session: Session,
     session_asterisk: Session,
@@ -244,6 +250,7 @@ def accept_incoming_peering_request(
         raise
 
 
+@traced()
 def decline_incoming_peering_request(
     session: Session,
     user: User,
@@ -284,6 +291,7 @@ def get_peers(session: Session) -> list[Peer]:
     return list(session.exec(select(Peer)).all())
 
 
+@traced()
 def teardown_peer(
     session: Session,
     session_asterisk: Session,
@@ -307,6 +315,7 @@ def teardown_peer(
     try:
         delete_iax_peer(session_asterisk, peer, False)
 
+        delete_peer_phonebook(session, peer, False)
         session.delete(peer)
         if autocommit:
             session.commit()
@@ -343,6 +352,7 @@ def get_incoming_peering_request_by_id(
     return session.exec(statement).first()
 
 
+@traced()
 def create_incoming_peering_request(
     session: Session, request: IncomingPeeringRequest, autocommit=True
 ):
@@ -368,6 +378,7 @@ def create_incoming_peering_request(
         raise
 
 
+@traced()
 def revoke_incoming_peering_request(
     session: Session, request_id: uuid.UUID, secret: str, autocommit=True
 ):
@@ -388,6 +399,7 @@ def revoke_incoming_peering_request(
         raise
 
 
+@traced()
 def accept_outgoing_peering_request(
     session: Session,
     session_asterisk: Session,
@@ -430,6 +442,7 @@ def accept_outgoing_peering_request(
         raise
 
 
+@traced()
 def decline_outgoing_peering_request(
     session: Session, request_id: uuid.UUID, secret: str, autocommit=True
 ):
@@ -450,6 +463,7 @@ def decline_outgoing_peering_request(
         raise
 
 
+@traced()
 def request_peer_teardown(
     session: Session, session_asterisk: Session, name: str, secret: str, autocommit=True
 ):
@@ -462,6 +476,7 @@ def request_peer_teardown(
 
     try:
         delete_iax_peer(session_asterisk, peer, False)
+        delete_peer_phonebook(session, peer, False)
         session.delete(peer)
         if autocommit:
             session.commit()
@@ -477,3 +492,90 @@ def get_peer_by_id(session: Session, peer_id: str) -> Peer | None:
     statement = select(Peer).where(Peer.id == uuid.UUID(peer_id))
     peer = session.exec(statement).first()
     return peer
+
+
+"""
+Peer Phonebooks
+"""
+
+
+def get_peer_phonebook(session: Session, peer: Peer) -> list[ExtensionBase]:
+    """
+    returns the locally synced phonebook of the peer, all extensions are
+    prefixed with the peer prefix
+    """
+    entries = session.exec(
+        select(PeerPhonebookEntry)
+        .where(PeerPhonebookEntry.peer_id == peer.id)
+        .order_by(PeerPhonebookEntry.extension)
+    ).all()
+
+    return [
+        ExtensionBase(
+            extension=peer.prefix + entry.extension,
+            name=entry.name,
+            type=entry.type,
+            location_name=entry.location_name,
+            lat=entry.lat,
+            lon=entry.lon,
+            public=True,
+        )
+        for entry in entries
+    ]
+
+
+@traced()
+def apply_peer_phonebook_changes(
+    session: Session, peer: Peer, changes: PhonebookChanges, autocommit=True
+):
+    """
+    applies phonebook changes received from the peer to the local copy
+    """
+    try:
+        statement = delete(PeerPhonebookEntry).where(
+            PeerPhonebookEntry.peer_id == peer.id
+        )
+        if not changes.full:
+            changed = changes.deletes + [e.extension for e in changes.upserts]
+            statement = statement.where(col(PeerPhonebookEntry.extension).in_(changed))
+        session.exec(statement)
+
+        for extension in changes.upserts:
+            session.add(
+                PeerPhonebookEntry(
+                    peer_id=peer.id,
+                    extension=extension.extension,
+                    name=extension.name,
+                    type=extension.type,
+                    location_name=extension.location_name,
+                    lat=extension.lat,
+                    lon=extension.lon,
+                )
+            )
+
+        peer.phonebook_seq = changes.seq
+        session.add(peer)
+        if autocommit:
+            session.commit()
+    except:
+        if autocommit:
+            session.rollback()
+        raise
+
+    logger.info(
+        f"Applied {len(changes.upserts)} updates and {len(changes.deletes)} deletions to phonebook of peer {peer.name}"
+    )
+
+
+@traced()
+def delete_peer_phonebook(session: Session, peer: Peer, autocommit=True):
+    try:
+        session.exec(
+            delete(PeerPhonebookEntry).where(PeerPhonebookEntry.peer_id == peer.id)
+        )
+        if autocommit:
+            session.commit()
+    except:
+        if autocommit:
+            session.rollback()
+        raise
@@ -0,0 +1,276 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from logging import getLogger
+from threading import Condition, Thread
+import time
+from typing import Iterable
+
+from ldap3 import MODIFY_REPLACE, Connection
+from ldap3.core.results import RESULT_NO_SUCH_OBJECT, RESULT_SUCCESS
+from ldap3.utils.conv import escape_filter_chars
+from sqlalchemy import Engine
+from sqlmodel import Session, col, select
+
+from app.core.config import settings
+from app.core.ldap import LDAPPool
+from app.core.metrics import observe_call
+from app.core.scheduler import LeaderElection
+from app.models.crud import CRUDNotAllowedException
+from app.models.extension import Extension
+
+logger = getLogger(__name__)
+
+
+def ldap_add(connection: Connection, extension: Extension):
+    ldap_data = {
+        "ou": settings.SITE_NAME,
+        "sn": extension.name,
+        "telephoneNumber": extension.extension,
+        "objectClass": "organizationalPerson",
+    }
+
+    if extension.location_name is not None and len(extension.location_name) > 0:
+        ldap_data["l"] = extension.location_name
+
+    connection.add(
+        f"cn={extension.extension},{settings.LDAP_BASE_DN}", attributes=ldap_data
+    )
+
+    if connection.result["result"] != 0:
+        logger.error(
+            f"Failed to add extension {extension.name} <{extension.extension}> to ldap"
+        )
+        raise CRUDNotAllowedException("Failed to add extension to LDAP")
+
+
+def ldap_sync(connection: Connection, number: str, extension: Extension | None):
+    """
+    brings the directory entry of the given extension number in line with the
+    extension, the entry is removed if the extension is gone or not public
+    """
+    dn = f"cn={number},{settings.LDAP_BASE_DN}"
+
+    if extension is None or not extension.public:
+        connection.delete(dn)
+        if connection.result["result"] not in (RESULT_SUCCESS, RESULT_NO_SUCH_OBJECT):
+            logger.error(f"Failed to delete extension <{number}> from ldap")
+            raise CRUDNotAllowedException("Failed to delete extension from ldap")
+        return
+
+    location = extension.location_name
+    connection.modify(
+        dn,
+        {
+            "ou": [(MODIFY_REPLACE, [settings.SITE_NAME])],
+            "sn": [(MODIFY_REPLACE, [extension.name])],
+            "l": [(MODIFY_REPLACE, [location] if location else [])],
+        },
+    )
+
+    if connection.result["result"] == RESULT_NO_SUCH_OBJECT:
+        ldap_add(connection, extension)
+    elif connection.result["result"] != RESULT_SUCCESS:
+        logger.error(
+            f"Failed to update extension {extension.name} <{extension.extension}> in ldap"
+        )
+        raise CRUDNotAllowedException("Failed to update extension in ldap")
+
+
+def first_value(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+class LDAPSync(object):
+    """
+    Keeps the ldap directory in sync with the public extensions. Changed
+    extension numbers are queued and written by a background thread in
+    batches, failed entries are retried with an exponential backoff.
+    The directory entry is always derived from the current database state,
+    so queueing the same number multiple times is harmless.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if LDAPSync._instance is None:
+            LDAPSync._instance = LDAPSync()
+
+        return LDAPSync._instance
+
+    def __init__(self):
+        self.condition = Condition()
+        # extension number -> monotonic time at which it should be synced
+        self.pending: dict[str, float] = {}
+        self.attempts: dict[str, int] = {}
+
+        self.engine: Engine | None = None
+        self.thread: Thread | None = None
+        self.running = False
+
+    def start(self, engine: Engine):
+        self.engine = engine
+        self.running = True
+        self.thread = Thread(target=self.run, name="ldap-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.thread is not None:
+            self.thread.join(timeout=settings.LDAP_POOL_TIMEOUT)
+            self.thread = None
+
+        if self.pending:
+            logger.warning(
+                f"{len(self.pending)} extensions not synced to ldap, "
+                "they will be fixed by the next reconciliation"
+            )
+
+    def enqueue(self, extensions: Iterable[str], delay: float | None = None):
+        if delay is None:
+            # give subsequent changes a moment to end up in the same batch
+            delay = settings.LDAP_SYNC_BATCH_DELAY
+
+        with self.condition:
+            due = time.monotonic() + delay
+            for extension in extensions:
+                self.pending[extension] = min(self.pending.get(extension, due), due)
+            self.condition.notify()
+
+    def take_batch(self) -> list[str]:
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+                batch = [e for e, due in self.pending.items() if due <= now]
+                if batch:
+                    batch = batch[: settings.LDAP_SYNC_BATCH_SIZE]
+                    for extension in batch:
+                        del self.pending[extension]
+                    return batch
+
+                timeout = None
+                if self.pending:
+                    timeout = min(self.pending.values()) - now
+                self.condition.wait(timeout)
+
+            return []
+
+    def retry(self, extensions: list[str]):
+        for extension in extensions:
+            attempts = self.attempts.get(extension, 0) + 1
+            self.attempts[extension] = attempts
+
+            delay = min(
+                settings.LDAP_SYNC_RETRY_BACKOFF * 2 ** (attempts - 1),
+                settings.LDAP_SYNC_MAX_BACKOFF,
+            )
+            self.enqueue([extension], delay)
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                return
+
+            try:
+                self.sync(batch)
+            except Exception:
+                logger.exception(f"Failed to sync {len(batch)} extensions to ldap")
+                self.retry(batch)
+
+    def sync(self, batch: list[str]):
+        with Session(self.engine) as session:
+            extensions = {
+                extension.extension: extension
+                for extension in session.exec(
+                    select(Extension).where(col(Extension.extension).in_(batch))
+                ).all()
+            }
+
+        failed = []
+        pool = LDAPPool.instance()
+        connection = pool.acquire()
+        try:
+            for number in batch:
+                try:
+                    with observe_call("ldap", "sync"):
+                        ldap_sync(connection, number, extensions.get(number))
+                    self.attempts.pop(number, None)
+                except CRUDNotAllowedException:
+                    failed.append(number)
+        finally:
+            pool.release(connection)
+
+        if failed:
+            logger.warning(f"Retrying ldap sync of {len(failed)} extensions")
+            self.retry(failed)
+
+        logger.debug(f"Synced {len(batch) - len(failed)} extensions to ldap")
+
+    def reconcile(self):
+        """
+        compares all entries of this site in the directory against the
+        public extensions and queues every extension which differs. It runs
+        as leader job and stops once this worker lost the scheduler lease.
+        """
+        election = LeaderElection.instance()
+        with Session(self.engine) as session:
+            public = {
+                extension.extension: (extension.name, extension.location_name or None)
+                for extension in session.exec(
+                    select(Extension).where(Extension.public == True)
+                ).all()
+            }
+
+        drift = set()
+        seen = set()
+
+        pool = LDAPPool.instance()
+        connection = pool.acquire()
+        site = escape_filter_chars(settings.SITE_NAME)
+        try:
+            with observe_call("ldap", "reconcile"):
+                entries = connection.extend.standard.paged_search(
+                    settings.LDAP_BASE_DN,
+                    f"(&(objectClass=organizationalPerson)(ou={site}))",
+                    attributes=["cn", "sn", "l"],
+                    paged_size=settings.LDAP_RECONCILE_PAGE_SIZE,
+                    generator=True,
+                )
+                for entry in entries:
+                    # the next page is only fetched when the iteration reaches it
+                    election.check_leader()
+                    if entry.get("type") != "searchResEntry":
+                        continue
+
+                    attributes = entry["attributes"]
+                    number = first_value(attributes.get("cn"))
+                    if number is None:
+                        continue
+
+                    seen.add(number)
+                    entry_data = (
+                        first_value(attributes.get("sn")),
+                        first_value(attributes.get("l")) or None,
+                    )
+                    if public.get(number) != entry_data:
+                        drift.add(number)
+        finally:
+            pool.release(connection)
+
+        drift.update(public.keys() - seen)
+        election.check_leader()
+
+        if drift:
+            logger.info(f"Reconciling {len(drift)} extensions with ldap")
+            self.enqueue(drift, 0)
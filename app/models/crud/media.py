@@ -5,17 +5,20 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+import hashlib
 from logging import getLogger
 import os
 import tempfile
 import uuid
 
 from fastapi import UploadFile
+import sqlalchemy
 from sqlmodel import Session, select
 
 from app.core.config import settings
+from app.core.tracing import traced
 from app.models.crud import CRUDNotAllowedException
-from app.models.media import AudioFormat, ImageFormat, Media, MediaType
+from app.models.media import AudioFormat, ImageFormat, Media, MediaFile, MediaType
 from app.models.user import User, UserRole
 from app.util import media as media_utils
 
@@ -23,6 +26,7 @@ from app.util import media as media_utils
 logger = getLogger(__name__)
 
 
+@traced()
 def create_media_from_upload(
     session: Session,
     user: User,
@@ -46,36 +50,6 @@ def create_media_from_upload(
                 f"Uploaded file is larger than the {max_size} upload limit!"
             )
 
-    data = file.file.read()
-    actual_type, actual_extension = media_utils.get_media_type(data)
-
-    # check that the uploaded type matches the supposed type
-    if supposed_type != MediaType.RAW and supposed_type != actual_type:
-        raise CRUDNotAllowedException(
-            f"The uploaded file does not seem to be actually an {supposed_type.value} file!"
-        )
-
-    # If a file that actuall is audio or image should be handled as a raw file
-    if supposed_type == MediaType.RAW:
-        actual_type = MediaType.RAW
-
-    # check that the provided default_format matches the uploaded media type
-    if (
-        actual_type == MediaType.IMAGE and not isinstance(default_format, ImageFormat)
-    ) or (
-        actual_type == MediaType.AUDIO and not isinstance(default_format, AudioFormat)
-    ):
-        raise CRUDNotAllowedException(
-            "The provideded default format does not match the uploaded file type!"
-        )
-
-    # Disallow RAW if configured
-    if actual_type == MediaType.RAW and not settings.MEDIA_ALLOW_RAW:
-        raise CRUDNotAllowedException("Raw media is not allowed!")
-
-    # create database model
-    db_obj = Media(name=name, type=actual_type, created_by_id=user.id, stored_as="")
-
     # convert to default format and store in media directory
     if not os.path.exists(settings.MEDIA_PATH):
         logger.error(f"Media upload directory {settings.MEDIA_PATH} does not exist!")
@@ -83,24 +57,92 @@ def create_media_from_upload(
             f"Media upload directory {settings.MEDIA_PATH} does not exist!"
         )
 
-    # create filename based on uuid and type
-    out_filename = db_obj.id.hex
-    if actual_type != MediaType.RAW:
-        out_filename += f".{default_format.out_type}"
-    out_path = os.path.join(settings.MEDIA_PATH, out_filename)
-    db_obj.stored_as = out_filename
+    # created in the media directory, so the stored file is moved in place
+    # atomically
+    with tempfile.TemporaryDirectory(
+        prefix=".upload-", dir=settings.MEDIA_PATH
+    ) as tmp_dir:
+        # copy the upload into a temporary file and hash it on the way
+        source_path = os.path.join(tmp_dir, "upload")
+        digest = hashlib.sha256()
+        header = b""
+        with open(source_path, "wb") as source:
+            chunk_size = media_utils.STREAM_CHUNK_SIZE
+            for chunk in iter(lambda: file.file.read(chunk_size), b""):
+                if not header:
+                    header = chunk
+                digest.update(chunk)
+                source.write(chunk)
+
+        actual_type, actual_extension = media_utils.get_media_type(header)
+
+        # check that the uploaded type matches the supposed type
+        if supposed_type != MediaType.RAW and supposed_type != actual_type:
+            raise CRUDNotAllowedException(
+                f"The uploaded file does not seem to be actually an {supposed_type.value} file!"
+            )
 
-    if actual_type == MediaType.RAW:
-        with open(out_path, "xb") as target:
-            target.write(data)
-    else:
-        with tempfile.NamedTemporaryFile(suffix=f".{actual_extension}") as source:
-            source.write(data)
-            source.seek(0)
+        # If a file that actuall is audio or image should be handled as a raw file
+        if supposed_type == MediaType.RAW:
+            actual_type = MediaType.RAW
+
+        # check that the provided default_format matches the uploaded media type
+        if (
+            actual_type == MediaType.IMAGE
+            and not isinstance(default_format, ImageFormat)
+        ) or (
+            actual_type == MediaType.AUDIO
+            and not isinstance(default_format, AudioFormat)
+        ):
+            raise CRUDNotAllowedException(
+                "The provideded default format does not match the uploaded file type!"
+            )
+
+        # Disallow RAW if configured
+        if actual_type == MediaType.RAW and not settings.MEDIA_ALLOW_RAW:
+            raise CRUDNotAllowedException("Raw media is not allowed!")
+
+        # create filename based on content hash and type, uploads of the same
+        # content share the stored file (and its renditions)
+        content_hash = digest.hexdigest()
+        out_filename = content_hash
+        if actual_type != MediaType.RAW:
+            out_filename += f".{default_format.out_type}"
+        out_path = os.path.join(settings.MEDIA_PATH, out_filename)
+
+        # the file may be removed by a concurrent delete of its last media,
+        # holding the lock until commit makes sure it is either still there
+        # or written again
+        lock_stored_file(session, out_filename)
+        if os.path.isfile(out_path):
+            logger.info(f"Media content {content_hash} is already stored")
+        elif actual_type == MediaType.RAW:
+            os.replace(source_path, out_path)
+        else:
+            typed_source_path = f"{source_path}.{actual_extension}"
+            os.rename(source_path, typed_source_path)
+
+            # convert next to the target and move it in place afterwards so
+            # concurrent uploads of the same content never see partial files
+            tmp_out_path = os.path.join(tmp_dir, out_filename)
             if actual_type == MediaType.IMAGE:
-                media_utils.convert_image(source.name, out_path, default_format)
+                media_utils.convert_image(
+                    typed_source_path, tmp_out_path, default_format
+                )
             elif actual_type == MediaType.AUDIO:
-                media_utils.convert_audio(source.name, out_path, default_format)
+                media_utils.convert_audio(
+                    typed_source_path, tmp_out_path, default_format
+                )
+            os.replace(tmp_out_path, out_path)
+
+    # create database model
+    db_obj = Media(
+        name=name,
+        type=actual_type,
+        created_by_id=user.id,
+        stored_as=out_filename,
+        content_hash=content_hash,
+    )
 
     session.add(db_obj)
     if autocommit:
@@ -125,6 +167,28 @@ def get_media_by_id(session: Session, media_id: str) -> Media | None:
     return session.exec(statement).first()
 
 
+def lock_stored_file(session: Session, stored_as: str) -> list[uuid.UUID]:
+    """
+    locks the given stored file until the end of the transaction and returns
+    the ids of the media using it. Uploads reusing the file and deletes
+    removing it are serialized by this lock. The lock row is created by the
+    first upload, concurrent first uploads wait for each other on its
+    primary key.
+    """
+    try:
+        with session.begin_nested():
+            session.add(MediaFile(stored_as=stored_as))
+    except sqlalchemy.exc.IntegrityError:
+        # the file is already known
+        pass
+
+    session.exec(
+        select(MediaFile).where(MediaFile.stored_as == stored_as).with_for_update()
+    ).one()
+    return list(session.exec(select(Media.id).where(Media.stored_as == stored_as)))
+
+
+@traced()
 def delete_media(session: Session, user: User, media: Media):
     if media.created_by_id != user.id and user.role != UserRole.ADMIN:
         raise CRUDNotAllowedException("You are not permitted to delete this media!")
@@ -138,12 +202,39 @@ def delete_media(session: Session, user: User, media: Media):
             f"This media is in use for {len(media.assigned_extensions)} extension(s)!"
         )
 
-    os.remove(path)
-    logger.info(f"rm {path}")
+    # the stored file is shared by all media with the same content, only
+    # remove it when the last reference is gone. It is moved aside before the
+    # commit releases the lock, so no upload can reuse it meanwhile, and only
+    # removed once the commit succeeded.
+    references = [
+        media_id
+        for media_id in lock_stored_file(session, media.stored_as)
+        if media_id != media.id
+    ]
     session.delete(media)
-    session.commit()
+
+    # the lock row is kept, uploads waiting for it would find nothing to lock
+    removed_path = None
+    if not references:
+        removed_path = f"{path}.{uuid.uuid4().hex}.deleted"
+        os.replace(path, removed_path)
+    else:
+        logger.info(f"Keeping {path}, still referenced by {len(references)} media")
+
+    try:
+        session.commit()
+    except Exception:
+        if removed_path is not None:
+            os.replace(removed_path, path)
+        raise
+
+    if removed_path is not None:
+        os.remove(removed_path)
+        media_utils.delete_renditions(media)
+        logger.info(f"rm {path}")
 
 
+@traced()
 def update_media(session: Session, user: User, media: Media, new_name: str) -> Media:
     if media.created_by_id != user.id and user.role != UserRole.ADMIN:
         raise CRUDNotAllowedException("You are not permitted to change this media!")
@@ -0,0 +1,67 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime, timedelta
+from logging import getLogger
+import os
+import socket
+
+import sqlalchemy
+from sqlalchemy import update
+from sqlmodel import Session, col, or_
+
+from app.models.scheduler import JobLease
+
+logger = getLogger(__name__)
+
+# identifies this worker process in the lease table
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_job_lease(session: Session, name: str, seconds: float) -> bool:
+    """
+    tries to take the lease of the given job for the given time, returns True
+    if this worker may run the job. The lease is taken if it expired or is
+    already held by this worker.
+    """
+    now = datetime.now()
+    expires = now + timedelta(seconds=seconds)
+
+    result = session.exec(
+        update(JobLease)
+        .where(JobLease.name == name)
+        .where(or_(JobLease.expires < now, col(JobLease.holder) == HOLDER))
+        .values(holder=HOLDER, expires=expires)
+    )
+    if result.rowcount == 1:
+        session.commit()
+        return True
+
+    session.rollback()
+    try:
+        session.add(JobLease(name=name, holder=HOLDER, expires=expires))
+        session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        # somebody else holds the lease
+        session.rollback()
+        return False
+
+    return True
+
+
+def release_job_lease(session: Session, name: str) -> None:
+    """
+    gives up the lease of the given job if this worker holds it, another
+    worker can then take it without waiting for the expiry
+    """
+    session.exec(
+        update(JobLease)
+        .where(JobLease.name == name)
+        .where(col(JobLease.holder) == HOLDER)
+        .values(expires=datetime.now())
+    )
+    session.commit()
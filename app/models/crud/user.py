@@ -6,12 +6,23 @@ Licensed under the MIT license. See LICENSE file in the project root for details
 """
 
 import uuid
+from collections import OrderedDict
 from logging import getLogger
+from threading import Lock
+import time
 
+from sqlalchemy.orm import make_transient_to_detached
 from sqlmodel import Session, col, select
 
 from app.core.config import settings
-from app.core.security import check_username, get_password_hash, verify_password
+from app.core.security import (
+    check_username,
+    get_password_hash,
+    password_needs_rehash,
+    verify_password,
+)
+from app.core.state import SharedState
+from app.core.tracing import traced
 from app.models.crud import CRUDNotAllowedException
 from app.models.user import (
     Invite,
@@ -24,7 +35,112 @@ from app.models.user import (
 
 logger = getLogger(__name__)
 
+STATE_NAMESPACE = "user_cache"
+
+
+class UserCache(object):
+    """
+    Short lived, size bounded cache of users by id. It is used to resolve
+    the user of a session token without querying the database. Cached entries
+    are detached copies and have to be merged into a session before use.
+    Invalidations are published as new version of the user in the shared
+    state. The versions are read at most every USER_CACHE_SYNC_INTERVAL
+    seconds, so cached users cost no query and the other workers drop their
+    copy within that interval.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if UserCache._instance is None:
+            UserCache._instance = UserCache()
+
+        return UserCache._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries: OrderedDict[uuid.UUID, tuple[float, str | None, User]] = (
+            OrderedDict()
+        )
+        # versions of all recently changed users and when they were read
+        self.versions: dict[str, str] = {}
+        self.versions_read: float | None = None
+
+    def version(self, user_id: uuid.UUID) -> str | None:
+        """
+        returns the current version of the user, it has to be read before the
+        user is loaded from the database
+        """
+        now = time.monotonic()
+        with self.lock:
+            if (
+                self.versions_read is not None
+                and now - self.versions_read < settings.USER_CACHE_SYNC_INTERVAL
+            ):
+                return self.versions.get(str(user_id))
+
+        versions = SharedState.instance().items(STATE_NAMESPACE)
+        with self.lock:
+            self.versions = versions
+            self.versions_read = now
+        return versions.get(str(user_id))
+
+    def get(self, user_id: uuid.UUID, version: str | None) -> User | None:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+
+            expires, cached_version, user = entry
+            if expires < time.monotonic() or cached_version != version:
+                del self.entries[user_id]
+                return None
+
+            self.entries.move_to_end(user_id)
+            return user
+
+    def put(self, user: User, version: str | None):
+        if settings.USER_CACHE_TTL <= 0:
+            return
+
+        copy = User(
+            id=user.id,
+            username=user.username,
+            role=user.role,
+            password_hash=user.password_hash,
+            token_version=user.token_version,
+        )
+        make_transient_to_detached(copy)
+
+        with self.lock:
+            self.entries[user.id] = (
+                time.monotonic() + settings.USER_CACHE_TTL,
+                version,
+                copy,
+            )
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > settings.USER_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: uuid.UUID):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+        if settings.USER_CACHE_TTL <= 0:
+            return
+
+        # copies cached before expire on their own after the ttl, the version
+        # doesn't have to be kept longer
+        version = uuid.uuid4().hex
+        SharedState.instance().set(
+            STATE_NAMESPACE, str(user_id), version, ttl=settings.USER_CACHE_TTL
+        )
+        with self.lock:
+            self.versions[str(user_id)] = version
 
+
+@traced()
 def create_user(
     session: Session,
     creating_user: User | None,
@@ -65,6 +181,7 @@ def create_user(
     return db_obj
 
 
+@traced()
 def update_user(
     session: Session,
     executing_user: User,
@@ -90,7 +207,9 @@ def update_user(
     if "password" in data and data["password"] is not None:
         password = data["password"]
         hashed = get_password_hash(password)
-        extra_data.update({"password_hash": hashed})
+        extra_data.update(
+            {"password_hash": hashed, "token_version": target_user.token_version + 1}
+        )
     target_user.sqlmodel_update(data, update=extra_data)
 
     session.add(target_user)
@@ -98,6 +217,8 @@ def update_user(
         session.commit()
         session.refresh(target_user)
 
+    UserCache.instance().invalidate(target_user.id)
+
     logger.info(
         f"{executing_user.username} updated user {target_user.username} ({target_user.role})"
     )
@@ -105,6 +226,7 @@ def update_user(
     return target_user
 
 
+@traced()
 def delete_user(
     session: Session, executing_user: User, user_to_delete: User, autocommit=True
 ) -> None:
@@ -115,6 +237,8 @@ def delete_user(
     if autocommit:
         session.commit()
 
+    UserCache.instance().invalidate(user_to_delete.id)
+
     logger.info(f"{executing_user.username} deleted user {user_to_delete.username}")
 
 
@@ -125,6 +249,22 @@ def get_user_by_id(session: Session, user_id: uuid.UUID) -> User | None:
     return user
 
 
+def get_cached_user_by_id(session: Session, user_id: str) -> User | None:
+    user_id = uuid.UUID(user_id)
+
+    cache = UserCache.instance()
+    version = cache.version(user_id)
+    cached = cache.get(user_id, version)
+    if cached is not None:
+        return session.merge(cached, load=False)
+
+    user = get_user_by_id(session, str(user_id))
+    if user is not None:
+        cache.put(user, version)
+
+    return user
+
+
 def get_user_by_username(session: Session, username: str) -> User | None:
     statement = select(User).where(User.username == username)
     user = session.exec(statement).first()
@@ -142,15 +282,27 @@ def filter_user_by_username(
     return list(session.exec(query).all())
 
 
+@traced()
 def authenticate_user(session: Session, username: str, password: str) -> User | None:
     db_user = get_user_by_username(session, username)
     if not db_user:
         return None
     if not verify_password(password, db_user.password_hash):
         return None
+
+    # the hashing parameters were changed since the password was set
+    if password_needs_rehash(db_user.password_hash):
+        db_user.password_hash = get_password_hash(password)
+        session.add(db_user)
+        session.commit()
+        session.refresh(db_user)
+        UserCache.instance().invalidate(db_user.id)
+        logger.info(f"Updated password hash of {db_user.username}")
+
     return db_user
 
 
+@traced()
 def change_password(
     session: Session, user: User, credentials: PasswordChange, autocommit=True
 ) -> User:
@@ -158,11 +310,15 @@ def change_password(
         raise CRUDNotAllowedException("Invalid current password")
 
     user.password_hash = get_password_hash(credentials.new_password)
+    # sessions on other devices have to log in again
+    user.token_version += 1
     session.add(user)
     if autocommit:
         session.commit()
         session.refresh(user)
 
+    UserCache.instance().invalidate(user.id)
+
     logger.info(f"{user.username} changed password")
 
     return user
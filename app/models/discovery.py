@@ -0,0 +1,18 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+class DiscoveryTarget(SQLModel, table=True):
+    # last address a phone reported, used for prometheus service discovery
+    extension: str = Field(primary_key=True)
+    flavor: str = Field(max_length=64, index=True)
+    last_ip: str = Field(max_length=45)
+    last_seen: datetime = Field(index=True)
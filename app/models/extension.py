@@ -5,6 +5,7 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+from datetime import datetime
 import json
 import random
 import string
@@ -235,11 +236,32 @@ class ExtensionUpdate(BaseModel):
         return json.loads(value)
 
 
+class PhonebookChange(SQLModel, table=True):
+    # every mutation of an extension is recorded with a monotonically increasing
+    # id, federated peers use it to request only the changes since their last sync
+    id: Optional[int] = Field(default=None, primary_key=True)
+    extension: str = Field(index=True)
+    # ids are assigned on insert, not on commit, only changes older than
+    # FEDERATION_PHONEBOOK_CHANGE_DELAY are handed out as sync position
+    created: datetime = Field(default_factory=datetime.now, index=True)
+
+
+class PhonebookChanges(BaseModel):
+    # the highest change id included in this response
+    seq: int
+    # if true, upserts contain the complete phonebook and all other entries
+    # known by the receiver must be dropped
+    full: bool = False
+    upserts: list[ExtensionBase] = []
+    deletes: list[str] = []
+
+
 class TemporaryExtensions(SQLModel, table=True):
     extension: str = Field(unique=True, primary_key=True)
     password: str
     uid: int
-    ppn: int
+    # unset while the extension waits in the pool for a handset
+    ppn: Optional[int] = Field(default=None, index=True)
 
     def generate_extension() -> int:
         return int(
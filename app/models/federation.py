@@ -5,9 +5,9 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-from typing import Literal
+from typing import Literal, Optional
 from pydantic import BaseModel, Field as PDField
-from sqlmodel import SQLModel, Field, String
+from sqlmodel import SQLModel, Field, String, UniqueConstraint
 import uuid
 
 
@@ -58,6 +58,25 @@ class Peer(PeerBase, table=True):
     # iaxfriend
     secret: str
 
+    # sequence number of the last phonebook change received from this peer
+    phonebook_seq: int = 0
+
+
+class PeerPhonebookEntry(SQLModel, table=True):
+    # local copy of an entry in the public phonebook of a peer, the extension
+    # is stored without the peer prefix
+    __table_args__ = (UniqueConstraint("peer_id", "extension"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    peer_id: uuid.UUID = Field(foreign_key="peer.id", index=True)
+
+    extension: str
+    name: str
+    type: str
+    location_name: Optional[str] = None
+    lat: Optional[int] = None
+    lon: Optional[int] = None
+
 
 class OutgoingPeeringRequestBase(SQLModel):
     name: str = PDField(pattern=r"^\w+$")
@@ -50,11 +50,20 @@ class Media(SQLModel, table=True):
 
     uploaded_at: datetime = Field(default_factory=datetime.now)
 
-    stored_as: str
+    # multiple media entries may share the same file, files are named by the
+    # sha256 of the uploaded content and deleted once no media references them
+    stored_as: str = Field(index=True)
+    content_hash: Optional[str] = Field(default=None, max_length=64, index=True)
 
     assigned_extensions: list["ExtensionMedia"] = Relationship(back_populates="media")
 
 
+class MediaFile(SQLModel, table=True):
+    # one row per stored file, uploads and deletes of media using the file
+    # lock it, so they never see a file which is written or removed
+    stored_as: str = Field(primary_key=True, max_length=255)
+
+
 class ExtensionMedia(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
 
@@ -0,0 +1,15 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from sqlmodel import SQLModel, Field
+
+
+class RateLimitCounter(SQLModel, table=True):
+    name: str = Field(primary_key=True, max_length=255)
+    # number of the time window this counter belongs to
+    slot: int = Field(primary_key=True)
+    hits: int = 0
@@ -0,0 +1,17 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+class JobLease(SQLModel, table=True):
+    # a job may only run on the worker holding its lease
+    name: str = Field(primary_key=True, max_length=64)
+    holder: str
+    expires: datetime
@@ -0,0 +1,22 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Text
+from sqlmodel import Field, SQLModel
+
+
+class SharedStateEntry(SQLModel, table=True):
+    # state which has to be the same in all worker processes
+    namespace: str = Field(primary_key=True, max_length=64)
+    key: str = Field(primary_key=True, max_length=255)
+    # json encoded value
+    value: str = Field(sa_type=Text)
+    # entries without expiry are kept until they are deleted
+    expires: Optional[datetime] = Field(default=None, index=True)
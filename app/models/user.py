@@ -34,6 +34,8 @@ class UserBase(SQLModel):
 class User(UserBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     password_hash: str
+    # increased whenever existing session tokens should become invalid
+    token_version: int = 0
 
     extensions: list[Extension] = Relationship(back_populates="user")
     media: list["Media"] = Relationship(back_populates="created_by")
@@ -156,3 +158,4 @@ class Token(BaseModel):
 class TokenPayload(BaseModel):
     exp: int
     sub: str
+    ver: int = 0
@@ -0,0 +1,29 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from sqlmodel import Field, SQLModel
+
+
+class WebSIPStatus(str, Enum):
+    # no endpoint exists in the asterisk DB
+    FREE = "free"
+    # an endpoint exists but isn't handed out
+    WARM = "warm"
+    ACTIVE = "active"
+
+
+class WebSIPSession(SQLModel, table=True):
+    extension: str = Field(primary_key=True, max_length=32)
+    status: WebSIPStatus = Field(default=WebSIPStatus.FREE, index=True)
+
+    auth_pass: Optional[str] = None
+    display_name: Optional[str] = None
+    last_seen: Optional[datetime] = Field(default=None, index=True)
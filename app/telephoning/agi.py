@@ -0,0 +1,212 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import asyncio
+from ipaddress import IPv4Network, IPv6Network, ip_address, ip_network
+from logging import getLogger
+import secrets
+from typing import Awaitable, Callable
+from urllib.parse import parse_qs
+
+from app.core.config import settings
+
+logger = getLogger(__name__)
+
+
+class AGIHangup(Exception): ...
+
+
+class AGIError(Exception): ...
+
+
+class AGIChannel(object):
+    """
+    A single FastAGI session, asterisk sends the channel variables first and
+    then waits for commands which are answered line by line.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.env: dict[str, str] = {}
+
+    async def read_line(self) -> str:
+        line = await asyncio.wait_for(
+            self.reader.readline(), timeout=settings.FASTAGI_TIMEOUT
+        )
+        if not line:
+            raise AGIHangup("Connection closed by asterisk")
+        return line.decode(errors="replace").rstrip("\r\n")
+
+    async def read_env(self) -> dict[str, str]:
+        while True:
+            line = await self.read_line()
+            if line == "":
+                return self.env
+
+            key, _, value = line.partition(":")
+            self.env[key.strip()] = value.strip()
+
+    async def command(self, *parts: str) -> str:
+        self.writer.write((" ".join(parts) + "\n").encode())
+        await self.writer.drain()
+
+        while True:
+            line = await self.read_line()
+            # asterisk notifies about hangups in between
+            if line == "HANGUP":
+                continue
+            if line.startswith("520-"):
+                # multi line usage message
+                while not line.startswith("520 "):
+                    line = await self.read_line()
+                raise AGIError(f"Invalid AGI command: {' '.join(parts)}")
+            break
+
+        if line.startswith("511"):
+            raise AGIHangup("Channel is dead")
+        if not line.startswith("200"):
+            raise AGIError(f"AGI command {parts[0]} failed: {line}")
+
+        result = line.partition("result=")[2].split(" ", 1)[0]
+        if result == "-1":
+            raise AGIHangup(f"AGI command {parts[0]} failed, channel hung up")
+        return result
+
+    async def answer(self):
+        return await self.command("ANSWER")
+
+    async def verbose(self, message: str, level: int = 1):
+        message = message.replace('"', "'")
+        return await self.command("VERBOSE", f'"{message}"', str(level))
+
+    async def stream_file(self, filename: str, escape_digits: str = ""):
+        return await self.command("STREAM FILE", filename, f'"{escape_digits}"')
+
+    async def hangup(self):
+        return await self.command("HANGUP")
+
+
+AGIHandler = Callable[[AGIChannel], Awaitable[None]]
+
+
+class FastAGIServer(object):
+    """
+    Serves AGI scripts from within uURU, asterisk connects to
+    agi://<host>:<port>/<script> instead of starting a process per call.
+    Phone flavors register their scripts by name. Only connections from
+    FASTAGI_ALLOWED_NETWORKS are accepted and, if FASTAGI_SECRET is set,
+    asterisk has to pass it as agi://<host>:<port>/<script>?secret=<secret>.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        if FastAGIServer._instance is None:
+            FastAGIServer._instance = FastAGIServer()
+
+        return FastAGIServer._instance
+
+    def __init__(self):
+        self.handlers: dict[str, AGIHandler] = {}
+        self.server: asyncio.Server | None = None
+        self.allowed_networks: list[IPv4Network | IPv6Network] = []
+
+    def register(self, script: str, handler: AGIHandler):
+        self.handlers[script] = handler
+
+    async def start(self):
+        if not settings.FASTAGI_ENABLED or not self.handlers:
+            return
+
+        self.allowed_networks = [
+            ip_network(network, strict=False)
+            for network in settings.FASTAGI_ALLOWED_NETWORKS
+        ]
+        if not self.allowed_networks and not settings.FASTAGI_SECRET:
+            logger.warning(
+                "FastAGI accepts connections from everywhere without a secret, "
+                "set UURU_FASTAGI_ALLOWED_NETWORKS or UURU_FASTAGI_SECRET"
+            )
+
+        # all workers may listen on the same port, the kernel distributes
+        # the connections between them
+        self.server = await asyncio.start_server(
+            self.handle,
+            settings.FASTAGI_HOST,
+            settings.FASTAGI_PORT,
+            reuse_port=True,
+        )
+        logger.info(
+            f"FastAGI listening on {settings.FASTAGI_HOST}:{settings.FASTAGI_PORT} "
+            f"for {', '.join(self.handlers)}"
+        )
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def is_allowed_peer(self, writer: asyncio.StreamWriter) -> bool:
+        if not self.allowed_networks:
+            return True
+
+        peer = writer.get_extra_info("peername")
+        if not peer:
+            return False
+
+        address = ip_address(peer[0])
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        return any(address in network for network in self.allowed_networks)
+
+    @staticmethod
+    def is_valid_secret(query: str) -> bool:
+        if not settings.FASTAGI_SECRET:
+            return True
+
+        secret = parse_qs(query).get("secret", [""])[0]
+        return secrets.compare_digest(
+            secret.encode(), settings.FASTAGI_SECRET.encode()
+        )
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channel = AGIChannel(reader, writer)
+        try:
+            if not self.is_allowed_peer(writer):
+                peer = writer.get_extra_info("peername")
+                logger.warning(f"Rejected FastAGI connection from {peer}")
+                return
+
+            env = await channel.read_env()
+            script, _, query = env.get("agi_network_script", "").partition("?")
+            script = script.strip("/")
+
+            if not self.is_valid_secret(query):
+                logger.warning(f"FastAGI request for {script} with invalid secret")
+                await channel.hangup()
+                return
+
+            handler = self.handlers.get(script)
+            if handler is None:
+                logger.warning(f"FastAGI request for unknown script {script}")
+                await channel.hangup()
+                return
+
+            await handler(channel)
+        except (AGIHangup, ConnectionError, asyncio.TimeoutError):
+            logger.debug("FastAGI channel closed early")
+        except Exception:
+            logger.exception("FastAGI handler failed")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
@@ -14,6 +14,7 @@ from pydantic.functional_validators import field_validator
 from pydantic.main import BaseModel
 from sqlmodel import Session, delete, select
 
+from app.core.tracing import traced
 from app.models.asterisk import DialPlanEntry
 
 # Import all applications here:
@@ -105,6 +106,7 @@ class Dialplan(BaseModel):
                 session_asterisk.rollback()
             raise
 
+    @traced("dialplan.store")
     def store(self, session_asterisk: Session, autocommit=True):
         """
         Deletes this dialplan and stores it again in the database
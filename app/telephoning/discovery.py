@@ -0,0 +1,182 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from datetime import datetime, timedelta
+import json
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+import sqlalchemy
+from sqlmodel import Session, col, delete, select
+
+from app.core.db import engine
+from app.core.state import SharedState
+from app.models.crud.extension import get_extensions_by_extra_field
+from app.models.discovery import DiscoveryTarget
+from app.models.extension import Extension
+
+logger = getLogger(__name__)
+
+# namespace of the generated responses in the shared state
+STATE_NAMESPACE = "service_discovery"
+# reports of unknown phones beyond this number are dropped until the next flush
+MAX_PENDING = 10000
+
+
+class DiscoveryRegistry(object):
+    """
+    Remembers the last address of every phone of a flavor for the prometheus
+    service discovery. Phones are identified by an extra field (e.g. their
+    mac), reports are collected in memory and written to the discoverytarget
+    table in batches by a background thread. The response of the service
+    discovery is generated by the flavor job, which only runs on the leader,
+    and is shared by all workers, so a scrape doesn't touch the targets.
+    """
+
+    def __init__(
+        self,
+        flavor: str,
+        types: list[str],
+        flush_interval: float,
+        ttl: int,
+        key: str = "mac",
+    ):
+        self.flavor = flavor
+        self.types = types
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.key = key
+
+        self.lock = Lock()
+        # extra field value -> (address, time of the report)
+        self.pending: dict[str, tuple[str, datetime]] = {}
+
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name=f"{flavor}-discovery", daemon=True)
+        self.thread.start()
+
+    def report(self, value: str, address: str):
+        with self.lock:
+            if len(self.pending) >= MAX_PENDING and value not in self.pending:
+                return
+            self.pending[value] = (address, datetime.now())
+
+    def stop(self, timeout: float | None = None):
+        """
+        stops the background thread and stores the remaining reports
+        """
+        self.stopped.set()
+        self.thread.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception(f"Failed to store {self.flavor} discovery targets")
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"Failed to store {self.flavor} discovery targets")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        with Session(engine) as session:
+            reports = {
+                extension.extension: pending[value]
+                for value, extension in get_extensions_by_extra_field(
+                    session, self.key, pending.keys(), self.types
+                ).items()
+            }
+            if not reports:
+                return
+
+            targets = {
+                target.extension: target
+                for target in session.exec(
+                    select(DiscoveryTarget).where(
+                        col(DiscoveryTarget.extension).in_(reports.keys())
+                    )
+                ).all()
+            }
+
+            for number, (address, seen) in reports.items():
+                target = targets.get(number)
+                if target is None:
+                    target = DiscoveryTarget(extension=number, flavor=self.flavor)
+
+                target.flavor = self.flavor
+                target.last_ip = address
+                target.last_seen = seen
+                session.add(target)
+
+            try:
+                session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # another worker added the same phone, it reports again
+                session.rollback()
+
+    def expire(self):
+        """
+        removes targets which didn't report within the ttl and regenerates
+        the response. Only the leader calls this, so an older response never
+        replaces a newer one.
+        """
+        with Session(engine) as session:
+            session.exec(
+                delete(DiscoveryTarget)
+                .where(DiscoveryTarget.flavor == self.flavor)
+                .where(
+                    DiscoveryTarget.last_seen
+                    < datetime.now() - timedelta(seconds=self.ttl)
+                )
+            )
+            session.commit()
+
+            self.rebuild(session)
+
+    @staticmethod
+    def target(extension: Extension, address: str) -> dict:
+        target = {
+            "targets": [address],
+            "labels": {
+                "instance": f"{extension.name} <{extension.extension}>",
+                "__meta_model": extension.type,
+            },
+        }
+
+        for metric, value in {
+            "__meta_location": extension.location_name,
+            "__meta_latitude": extension.lat_float,
+            "__meta_longitude": extension.lon_float,
+        }.items():
+            if value:
+                target["labels"][metric] = value
+
+        return target
+
+    def rebuild(self, session: Session):
+        rows = session.exec(
+            select(DiscoveryTarget, Extension)
+            .join(Extension, col(Extension.extension) == DiscoveryTarget.extension)
+            .where(DiscoveryTarget.flavor == self.flavor)
+            .order_by(DiscoveryTarget.extension)
+        ).all()
+
+        response = json.dumps(
+            [self.target(extension, target.last_ip) for target, extension in rows]
+        )
+        state = SharedState.instance()
+        if state.get(STATE_NAMESPACE, self.flavor) != response:
+            state.set(STATE_NAMESPACE, self.flavor, response)
+
+    def response(self) -> str:
+        return SharedState.instance().get(STATE_NAMESPACE, self.flavor, "[]")
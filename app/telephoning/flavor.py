@@ -5,7 +5,8 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-from typing import TYPE_CHECKING, Literal
+import re
+from typing import TYPE_CHECKING, Any, Literal
 
 from app.models.media import AudioFormat, ImageFormat, MediaType
 
@@ -13,7 +14,7 @@ if TYPE_CHECKING:
     from app.models.user import User
     from app.models.extension import Extension
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
 from pydantic import BaseModel
 from sqlmodel import Session
 
@@ -22,6 +23,17 @@ from app.core.config import settings
 CODEC = Literal["g722", "alaw", "ulaw", "g726", "gsm", "lpc10"]
 
 
+def normalize_mac(value: str) -> str | None:
+    """
+    accepts macs with any or without separators and returns them in the
+    format the extra fields use (aa-bb-cc-00-11-22)
+    """
+    digits = re.sub(r"[^0-9a-f]", "", value.lower())
+    if len(digits) != 12:
+        return None
+    return "-".join(digits[i : i + 2] for i in range(0, 12, 2))
+
+
 class MediaDescriptor(BaseModel):
     media_type: MediaType
     required: bool
@@ -100,6 +112,18 @@ class PhoneFlavor:
     # This dict defines which media is required (or optional) for this phonetype
     MEDIA: dict[str, MediaDescriptor] = {}
 
+    # Provisioning: if a template (in templates/telephoning) is set, it is
+    # rendered for the extension whose extra field PROVISIONING_KEY matches
+    # the requested value. If PROVISIONING_PATH is set, a route is created
+    # for it which must contain {key}, otherwise call self.provisioning.respond
+    # from your own route. The template gets `extension` and `settings` plus
+    # everything returned by provisioning_context.
+    PROVISIONING_TEMPLATE: str | None = None
+    PROVISIONING_PATH: str | None = None
+    PROVISIONING_KEY: str = "mac"
+    PROVISIONING_MEDIA_TYPE: str = "text/html"
+    PROVISIONING_AUTOESCAPE: bool = True
+
     def on_extension_create(
         self,
         session: Session,
@@ -147,15 +171,43 @@ class PhoneFlavor:
         """
         pass
 
+    def normalize_provisioning_key(self, value: str) -> str | None:
+        """
+        This method converts the value requested by a phone to the format of
+        the extra field, macs are accepted with any separators. If None is
+        returned the request is answered with 404.
+        """
+        if self.PROVISIONING_KEY == "mac":
+            return normalize_mac(value)
+        return value
+
+    def provisioning_context(
+        self, session: Session, extension: "Extension"
+    ) -> dict[str, Any]:
+        """
+        This method may return additional variables for the provisioning
+        template. They have to be json serializable, rendered files are cached
+        as long as the extension and those variables don't change.
+        """
+        return {}
+
     def job(self) -> None:
         """
         This function may implement a job which runs regulary in the app
-        background. The job is executed once on application start.
+        background. The first run starts in the background right after the
+        application start.
 
-        If itraises an NotImplementedError it will not be scheduled.
+        If it isn't overridden it will not be scheduled.
         """
         raise NotImplementedError
 
+    def stop(self) -> None:
+        """
+        This function is called on shutdown after the background jobs were
+        stopped, it may stop threads and close connections of the flavor.
+        """
+        pass
+
     def get_codec(self, extension: "Extension | None") -> CODEC | tuple[CODEC]:
         if isinstance(self.SUPPORTED_CODEC, str):
             return self.SUPPORTED_CODEC
@@ -169,6 +221,18 @@ class PhoneFlavor:
         return self.SUPPORTED_CODEC[extension.type]
 
     ## DO NOT OVERWRITE THOSE METHODS
+    def setup_provisioning(self, router: APIRouter):
+        # imported here, the provisioning requires the database
+        from app.telephoning.provisioning import Provisioning
+
+        self.provisioning = Provisioning(self)
+        if self.PROVISIONING_PATH is None:
+            return
+
+        @router.get(self.PROVISIONING_PATH)
+        def get_provisioning(request: Request, key: str) -> Response:
+            return self.provisioning.respond(request, key)
+
     def is_public(self):
         return settings.ALL_EXTENSION_TYPES_PUBLIC or not self.IS_SPECIAL
 
@@ -5,10 +5,13 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+from datetime import datetime
+from threading import Lock
 from typing import Self
 import importlib
 import pkgutil
-from fastapi import APIRouter, FastAPI
+import time
+from fastapi import APIRouter, Depends, FastAPI
 from apscheduler.schedulers.background import BackgroundScheduler
 import json
 from logging import getLogger
@@ -16,6 +19,10 @@ from logging import getLogger
 from asterisk.ami import AMIClient
 
 from app.core.config import settings
+from app.core.metrics import observe_call
+from app.core.ratelimit import RateLimit
+from app.core.scheduler import leader_job
+from app.core.startup import Startup
 from app.telephoning.flavor import PhoneFlavor
 
 logger = getLogger(__name__)
@@ -24,7 +31,10 @@ logger = getLogger(__name__)
 def load_phone_flavors() -> list[PhoneFlavor]:
     """
     loads all classes which inherit PhoneFlavor and are located in
-    "app/telephoning/phonetypes/*" and returns them as a list
+    "app/telephoning/phonetypes/*" and returns them as a list. Only the
+    modules of enabled flavors are imported, their routes and phone types
+    are required at startup. Flavors import large client libraries with
+    their first use.
     """
     package = importlib.import_module("app.telephoning.phonetypes")
 
@@ -33,7 +43,12 @@ def load_phone_flavors() -> list[PhoneFlavor]:
     for _, module_name, _ in pkgutil.iter_modules(package.__path__):
         if module_name not in settings.ENABLED_PHONE_FLAVORS:
             continue
+
+        started = time.perf_counter()
         module = importlib.import_module(f"app.telephoning.phonetypes.{module_name}")
+        Startup.instance().record(
+            f"import {module_name}", time.perf_counter() - started
+        )
 
         for attr_name in dir(module):
             attr = getattr(module, attr_name)
@@ -60,7 +75,14 @@ class Telephoning(object):
         return Telephoning._instance
 
     def __init__(self):
-        self.router = APIRouter(prefix=settings.TELEPHONING_PREFIX, tags=["phones"])
+        # phones fetch their provisioning without authentication
+        self.router = APIRouter(
+            prefix=settings.TELEPHONING_PREFIX,
+            tags=["phones"],
+            dependencies=[
+                Depends(RateLimit("provisioning", "RATE_LIMIT_PROVISIONING_IP"))
+            ],
+        )
 
         self.flavor_classes = load_phone_flavors()
         self.flavors: dict[str, PhoneFlavor] = {}
@@ -69,11 +91,11 @@ class Telephoning(object):
         self.all_types = []
 
         self.ami_client = AMIClient(settings.ASTERISK_AMI_ADDR, settings.ASTERSIK_AMI_PORT)
+        # the login happens with the first request which needs the AMI
+        self.ami_lock = Lock()
+        self.ami_logged_in = False
 
     def start(self, app: FastAPI, scheduler: BackgroundScheduler):
-
-        self.setup_ami()
-
         for cls in self.flavor_classes:
             # 1st: create instance
             flavor_name = cls.__name__.lower()
@@ -87,16 +109,21 @@ class Telephoning(object):
 
             # 2nd: create routes
             router = APIRouter(prefix=f"/{flavor_name}")
+            if flavor.PROVISIONING_TEMPLATE is not None:
+                flavor.setup_provisioning(router)
             flavor.generate_routes(router)
             self.router.include_router(router)
 
-            # 3rd: initiate job
-            try:
-                flavor.job()
-            except NotImplementedError:
-                pass  # do not schedule job
-            else:
-                scheduler.add_job(flavor.job, "interval", seconds=flavor.JOB_INTERVAL)
+            # 3rd: schedule job, the first run starts in the background as
+            # soon as the scheduler is running, only the leader runs it
+            if type(flavor).job is not PhoneFlavor.job:
+                scheduler.add_job(
+                    leader_job(flavor_name, flavor.job),
+                    "interval",
+                    seconds=flavor.JOB_INTERVAL,
+                    id=flavor_name,
+                    next_run_time=datetime.now(),
+                )
 
             logger.debug(f"Initiated router and job for {flavor_name}")
 
@@ -117,12 +144,26 @@ class Telephoning(object):
         app.include_router(self.router)
 
     def stop(self):
-        self.ami_client.logoff()
+        for name, flavor in self.flavors.items():
+            try:
+                flavor.stop()
+            except Exception:
+                logger.exception(f"Failed to stop phone flavor {name}")
+
+        if self.ami_logged_in:
+            self.ami_client.logoff()
 
     def setup_ami(self):
-        self.ami_client.login(settings.ASTERISK_AMI_USER, settings.ASTERISK_AMI_PASS)
+        with observe_call("ami", "Login"):
+            self.ami_client.login(
+                settings.ASTERISK_AMI_USER, settings.ASTERISK_AMI_PASS
+            )
+        self.ami_logged_in = True
 
     def get_ami_client(self):
+        with self.ami_lock:
+            if not self.ami_logged_in:
+                self.setup_ami()
         return self.ami_client
 
     @staticmethod
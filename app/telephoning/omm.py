@@ -0,0 +1,190 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from itertools import count
+from logging import getLogger
+from queue import Empty, PriorityQueue
+from threading import Thread
+import time
+from typing import Any, Callable
+from weakref import WeakSet
+
+from app.core.metrics import (
+    EXTERNAL_CALL_ERRORS,
+    EXTERNAL_CALL_SECONDS,
+    Counter,
+    Gauge,
+    registry,
+)
+from app.core.tracing import span
+
+logger = getLogger(__name__)
+
+# lower values are handled first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+OMM_TIMEOUTS: Counter = registry.register(
+    Counter(
+        "uuru_omm_timeouts_total",
+        "OMM requests the caller stopped waiting for",
+        ["operation"],
+    )
+)
+
+
+# errors after which the connection to the OMM is opened again
+CONNECTION_ERRORS = (OSError, EOFError)
+
+
+class OMMTimeout(Exception): ...
+
+
+class OMMWorker(object):
+    """
+    Runs all requests to the OMM on a single thread. Requests are queued by
+    priority, so a registration during a call doesn't wait for a running
+    device sync to finish. A request is a function which gets the OMM client,
+    multiple OMM calls in one function are therefore never interleaved with
+    other requests. Batches are queued as one request per item, so
+    interactive requests only wait for the item which is running.
+    """
+
+    # running workers, their queues are exported as metric
+    workers: WeakSet["OMMWorker"] = WeakSet()
+
+    def __init__(self, connect: Callable[[], Any], name: str = "omm"):
+        # creates the client, called on the worker thread with the first
+        # request and with the next request after the connection failed
+        self.connect = connect
+        self.client = None
+        self.queue: PriorityQueue = PriorityQueue()
+        # keeps the order of requests with the same priority
+        self.sequence = count()
+
+        self.thread = Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+        OMMWorker.workers.add(self)
+
+    def call(
+        self,
+        name: str,
+        function: Callable[[Any], Any],
+        priority: int = PRIORITY_BACKGROUND,
+        timeout: float | None = None,
+        reconcile: Callable[[Any], None] | None = None,
+    ):
+        """
+        queues function and waits until it was executed, raises OMMTimeout if
+        it didn't finish within timeout seconds. A request which is already
+        running when the timeout expires still finishes, its result is then
+        passed to reconcile (on a separate thread), so changes made on the
+        OMM are not lost.
+        """
+        future = Future()
+        self.queue.put((priority, next(self.sequence), name, function, future))
+
+        try:
+            # the span includes the time spent waiting in the queue
+            with span(f"omm {name}", priority=priority):
+                return future.result(timeout)
+        except FutureTimeoutError:
+            # a request which didn't start yet is dropped
+            if not future.cancel() and reconcile is not None:
+                future.add_done_callback(
+                    lambda done: self.reconcile(name, done, reconcile)
+                )
+            self.record(name, 0, timeout=True)
+            raise OMMTimeout(f"OMM request {name} timed out after {timeout}s")
+
+    @staticmethod
+    def reconcile(name: str, future: Future, reconcile: Callable[[Any], None]):
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        def run():
+            try:
+                reconcile(future.result())
+                logger.info(f"Reconciled OMM request {name} after its timeout")
+            except Exception:
+                logger.exception(f"Failed to reconcile OMM request {name}")
+
+        # reconcile may queue OMM requests itself, it must not block the
+        # worker thread which calls this
+        Thread(target=run, name="omm-reconcile", daemon=True).start()
+
+    def stop(self, timeout: float | None = None):
+        """
+        stops the worker after the running request, queued requests are
+        cancelled
+        """
+        self.queue.put((PRIORITY_INTERACTIVE, -1, None, None, None))
+        self.thread.join(timeout)
+
+        while True:
+            try:
+                _, _, _, _, future = self.queue.get_nowait()
+            except Empty:
+                break
+            if future is not None:
+                future.cancel()
+
+    def run(self):
+        while True:
+            _, _, name, function, future = self.queue.get()
+            if function is None:
+                return
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started = time.monotonic()
+            try:
+                if self.client is None:
+                    self.client = self.connect()
+                future.set_result(function(self.client))
+            except Exception as e:
+                if isinstance(e, CONNECTION_ERRORS):
+                    logger.warning(f"Lost the connection to the OMM: {e}")
+                    self.disconnect()
+                self.record(name, time.monotonic() - started, error=True)
+                future.set_exception(e)
+            else:
+                self.record(name, time.monotonic() - started)
+
+    def disconnect(self):
+        client, self.client = self.client, None
+        close = getattr(client, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def record(self, name: str, seconds: float, error=False, timeout=False):
+        if error or timeout:
+            EXTERNAL_CALL_ERRORS.inc(service="omm", operation=name)
+        if timeout:
+            OMM_TIMEOUTS.inc(operation=name)
+            return
+
+        EXTERNAL_CALL_SECONDS.observe(seconds, service="omm", operation=name)
+
+        if seconds > 1:
+            logger.warning(f"OMM request {name} took {seconds:.2f}s")
+
+
+registry.register(
+    Gauge(
+        "uuru_omm_queued_requests",
+        "OMM requests waiting for the OMM worker",
+        collector=lambda: [
+            ({}, sum(worker.queue.qsize() for worker in OMMWorker.workers))
+        ],
+    )
+)
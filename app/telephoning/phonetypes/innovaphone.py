@@ -5,17 +5,14 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
-from fastapi import APIRouter, HTTPException, Request, status
-from fastapi.responses import PlainTextResponse
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel, Field, IPvAnyAddress
-from pydantic_extra_types.mac_address import MacAddress
 
-from app.models.crud.extension import get_extension_by_extra_field
 from app.models.media import ImageFormat, MediaType
+from app.telephoning.discovery import DiscoveryRegistry
 from app.telephoning.phonetypes.sip import SIP
-from app.telephoning.templates import templates
 from app.core.config import settings
-from app.core.db import SessionDep
 
 # from app.models.crud.extension import get_extension_by_mac
 from app.telephoning.flavor import MediaDescriptor
@@ -36,6 +33,8 @@ class Innovaphone(SIP):
     EXTRA_FIELDS = InnovaphoneFields
     DISPLAY_INDEX = 0
     IS_SPECIAL = True
+    JOB_INTERVAL = 60
+    PROVISIONING_TEMPLATE = "innovaphone.j2.cfg"
 
     MEDIA = {
         "background_image": MediaDescriptor(
@@ -51,72 +50,35 @@ class Innovaphone(SIP):
     def __init__(self):
         super().__init__()
 
-        self.prometheus_sd_target: dict[str, tuple[dict, IPvAnyAddress]] = {}
-
-    def update_sd_targets_by_mac(
-        self, session: SessionDep, mac: MacAddress, last_ip: IPvAnyAddress
-    ):
-        extension = get_extension_by_extra_field(session, "mac", mac)
-        if not extension:
-            return
+        self.discovery = DiscoveryRegistry(
+            "innovaphone",
+            self.PHONE_TYPES,
+            settings.INNOVAPHONE_SD_FLUSH_INTERVAL,
+            settings.INNOVAPHONE_SD_TARGET_TTL,
+        )
 
-        extension = extension.model_dump()
-        extension.update({"last_ip": last_ip})
+    def job(self):
+        self.discovery.expire()
 
-        self.prometheus_sd_target.update({extension.get("extension"): extension})
+    def stop(self):
+        self.discovery.stop(settings.INNOVAPHONE_SD_FLUSH_INTERVAL)
 
     def generate_routes(self, router: APIRouter):
 
         ########################################################################
         @router.get("/update")
-        def get_update(
-            session: SessionDep, mac: str, localip: IPvAnyAddress
-        ) -> PlainTextResponse:
-            self.update_sd_targets_by_mac(session, mac, localip)
+        def get_update(mac: str, localip: IPvAnyAddress) -> PlainTextResponse:
+            # written in the background, phones poll this regularly
+            self.discovery.report(mac, str(localip))
             return PlainTextResponse(
                 f"mod cmd UP0 cfg http://{settings.WEB_HOST}{settings.TELEPHONING_PREFIX}/innovaphone/config?mac={mac} iresetn"
             )
 
         ########################################################################
         @router.get("/config")
-        def get_config(
-            request: Request, session: SessionDep, mac: str
-        ) -> PlainTextResponse:
-            extension = get_extension_by_extra_field(session, "mac", mac)
-            if not extension:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="found no extension for that mac",
-                )
-
-            return templates.TemplateResponse(
-                request,
-                "innovaphone.j2.cfg",
-                {"extension": extension},
-            )
+        def get_config(request: Request, mac: str) -> Response:
+            return self.provisioning.respond(request, mac)
 
         @router.get("/service-discovery")
-        def get_service_discovery():
-            result = list()
-
-            for _, extension in self.prometheus_sd_target.items():
-                target = {
-                    "targets": [f"{extension.get("last_ip")}"],
-                    "labels": {
-                        "instance": f"{extension.get("name")} <{extension.get("extension")}>",
-                        "__meta_model": f"{extension.get("type")}",
-                    },
-                }
-
-                for metric, key in {
-                    "__meta_location": "location_name",
-                    "__meta_latitude": "lat_float",
-                    "__meta_longitude": "lon_float",
-                }.items():
-                    value = extension.get(key, None)
-                    if value:
-                        target["labels"][metric] = value
-
-                result.append(target)
-
-            return result
+        def get_service_discovery() -> Response:
+            return Response(self.discovery.response(), media_type="application/json")
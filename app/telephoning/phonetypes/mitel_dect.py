@@ -5,26 +5,41 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+import asyncio
+from functools import partial
 from logging import getLogger
-from fastapi import HTTPException
+from fastapi import Depends, HTTPException
 from fastapi import status
 from fastapi.responses import PlainTextResponse
-import mitel_ommclient2
 from sqlmodel import Session
-from threading import Lock
+import time
 
 from app.core.security import generate_extension_password
 from app.models.crud.asterisk import (
     create_sip_account,
 )
 from app.models.crud.extension import (
+    count_free_tmp_extensions,
     delete_tmp_extension,
+    delete_tmp_extensions,
+    get_assigned_tmp_extensions,
     get_extension_by_token,
     get_tmp_extension_by_id,
+    take_free_tmp_extensions,
 )
 from app.models.extension import TemporaryExtensions
+from app.telephoning.agi import AGIChannel, AGIHangup, FastAGIServer
 from app.telephoning.flavor import PhoneFlavor
+from app.telephoning.omm import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    OMMTimeout,
+    OMMWorker,
+)
 from app.core.config import settings
+from app.core.ratelimit import RateLimit, RateLimiter
+from app.core.scheduler import LeaderElection
+from app.core.state import SharedState
 from app.core.db import (
     SessionAsteriskDep,
     SessionDep,
@@ -35,6 +50,9 @@ from app.telephoning.phonetypes.sip import SIP
 
 logger = getLogger(__name__)
 
+# namespace of the OMM user ids of registered extensions in the shared state
+STATE_NAMESPACE = "omm_users"
+
 
 class MitelDECT(SIP):
     PHONE_TYPES = ["DECT"]
@@ -47,140 +65,492 @@ class MitelDECT(SIP):
     JOB_INTERVAL = 10
 
     def __init__(self):
-        self.lock = Lock()
-        self.ommclient = mitel_ommclient2.OMMClient2(
-            host=settings.OMM_HOST,
-            port=settings.OMM_PORT,
-            username=settings.OMM_USER,
-            password=settings.OMM_PASSWORD,
-            ommsync=True,
-            verify_cert=settings.OMM_VERIFY_CERT,
+        # background requests and requests of users are executed by separate
+        # workers with their own connection, so a registration doesn't wait
+        # for a device sync. They connect to the OMM with their first request,
+        # a slow OMM therefore doesn't delay the startup.
+        self.omm = OMMWorker(self.connect)
+        self.omm_interactive = OMMWorker(self.connect, name="omm-interactive")
+
+        # ppn -> relation type of every device seen at the last sync, only
+        # devices whose relation changed are looked at
+        self.devices: dict[int, str] = {}
+        self.last_sync = 0.0
+        # the client offers no documented event api, new handsets are found
+        # by comparing the device list with the previous one
+        logger.info(
+            "Polling the OMM for new devices every "
+            f"{settings.OMM_FULL_SYNC_INTERVAL}s"
         )
-        logger.info("Created OMM client")
+
+        # called by asterisk in the pjsip_dect_tmp context
+        FastAGIServer.instance().register("dect_registration", self.agi_registration)
+
+    def stop(self):
+        self.omm_interactive.stop(settings.OMM_REQUEST_TIMEOUT)
+        self.omm.stop(settings.OMM_REQUEST_TIMEOUT)
+
+    def call_omm(
+        self,
+        name: str,
+        function,
+        priority: int = PRIORITY_BACKGROUND,
+        **kwargs,
+    ):
+        worker = self.omm_interactive if priority == PRIORITY_INTERACTIVE else self.omm
+        return worker.call(name, function, priority=priority, **kwargs)
 
     def generate_routes(self, router):
-        @router.post("/")
+        @router.post(
+            "/",
+            dependencies=[
+                Depends(RateLimit("dect-registration", "RATE_LIMIT_DECT_REGISTRATION"))
+            ],
+        )
         def dect_registration(
             session: SessionDep,
             session_asterisk: SessionAsteriskDep,
             data: dict,
         ) -> PlainTextResponse:
-            logger.info(
-                f"registration attempt from tmp extension {data['tmp_extension']} via token {data['token']}"
-            )
-
-            extension = get_extension_by_token(session, data["token"])
-            if not extension:
-                logger.error("unknown extension")
-                raise HTTPException(
-                    detail="could not find matching extension for token",
-                    status_code=status.HTTP_404_NOT_FOUND,
+            try:
+                self.register_device(
+                    session, session_asterisk, data["tmp_extension"], data["token"]
                 )
-
-            tmp_extension = get_tmp_extension_by_id(session, data["tmp_extension"])
-            if not tmp_extension:
-                logger.error("unknown tmp extension")
+            except LookupError as e:
                 raise HTTPException(
-                    detail="could not identify temporary extension from caller",
-                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=str(e), status_code=status.HTTP_404_NOT_FOUND
                 )
 
-            # detach temporary user from device
-            self.delete_user_from_device(
-                user_id=tmp_extension.uid, device_ppn=tmp_extension.ppn
-            )
+    def register_device(
+        self,
+        session: Session,
+        session_asterisk: Session,
+        tmp_extension_id: str,
+        token: str,
+    ):
+        """
+        moves the device of the temporary extension to the extension with
+        the given token
+        """
+        logger.info(
+            f"registration attempt from tmp extension {tmp_extension_id} via token {token}"
+        )
+
+        extension = get_extension_by_token(session, token)
+        if not extension:
+            logger.error("unknown extension")
+            raise LookupError("could not find matching extension for token")
+
+        tmp_extension = get_tmp_extension_by_id(session, tmp_extension_id)
+        if not tmp_extension or tmp_extension.ppn is None:
+            logger.error("unknown tmp extension")
+            raise LookupError("could not identify temporary extension from caller")
 
-            # atach real user to device
-            self.configure_user_on_device(
-                extension.name,
-                extension.extension,
-                extension.password,
-                tmp_extension.ppn,
+        # detach temporary user from device
+        self.delete_user_from_device(
+            user_id=tmp_extension.uid,
+            device_ppn=tmp_extension.ppn,
+            priority=PRIORITY_INTERACTIVE,
+        )
+
+        # atach real user to device
+        uid = self.configure_user_on_device(
+            extension.name,
+            extension.extension,
+            extension.password,
+            tmp_extension.ppn,
+            priority=PRIORITY_INTERACTIVE,
+        )
+        SharedState.instance().set(STATE_NAMESPACE, extension.extension, uid)
+
+        # delete tmp_extension
+        delete_tmp_extension(session, session_asterisk, tmp_extension)
+
+    def register_device_in_sessions(self, tmp_extension_id: str, token: str):
+        # token guesses by phoning from a handset are limited like the api
+        RateLimiter.instance().check(
+            "dect-registration-handset",
+            tmp_extension_id,
+            settings.RATE_LIMIT_DECT_REGISTRATION,
+        )
+
+        with Session(engine) as session, Session(engine_asterisk) as session_asterisk:
+            self.register_device(session, session_asterisk, tmp_extension_id, token)
+
+    async def agi_registration(self, channel: AGIChannel):
+        tmp_extension = channel.env.get("agi_callerid")
+        token = channel.env.get("agi_extension")
+
+        # answer call and log relevant information
+        await channel.answer()
+        await channel.verbose(f"{tmp_extension}/{token} registering")
+
+        # play registration message
+        await channel.stream_file("selfservice_ansage", escape_digits="6969")
+
+        try:
+            await asyncio.to_thread(
+                self.register_device_in_sessions, tmp_extension, token
             )
+            await channel.verbose(f"{tmp_extension}/{token} success")
+        except AGIHangup:
+            raise
+        except Exception as e:
+            # give user error message
+            await channel.verbose(f"{tmp_extension}/{token} error: {e}")
+            await channel.stream_file("selfservice_error")
+        finally:
+            try:
+                await channel.hangup()
+            except AGIHangup:
+                pass
 
-            # delete tmp_extension
-            delete_tmp_extension(session, session_asterisk, tmp_extension)
+    def connect(self):
+        # the client library is only imported with the first OMM request, it
+        # isn't needed to serve requests and would slow down the startup
+        import mitel_ommclient2
+
+        client = mitel_ommclient2.OMMClient2(
+            host=settings.OMM_HOST,
+            port=settings.OMM_PORT,
+            username=settings.OMM_USER,
+            password=settings.OMM_PASSWORD,
+            ommsync=True,
+            verify_cert=settings.OMM_VERIFY_CERT,
+        )
+        logger.info("Created OMM client")
+        return client
 
     def job(self):
-        self.enable_subscription_mode()
+        if time.monotonic() - self.last_sync >= settings.OMM_FULL_SYNC_INTERVAL:
+            self.last_sync = time.monotonic()
+            self.enable_subscription_mode()
 
-        for device in self.get_unbound_devices():
-            tmp_ext_id = TemporaryExtensions.generate_extension()
-            password = generate_extension_password()
+            new_devices = self.sync_devices()
+            # the scan takes a while, another worker may run the job by now
+            LeaderElection.instance().check_leader()
+            self.cleanup_tmp_extensions(new_devices)
+            if new_devices:
+                self.register_devices(new_devices)
 
-            logger.info(f"OMM: new unbound device: {device.ppn} @ {tmp_ext_id}")
+        LeaderElection.instance().check_leader()
+        with Session(engine) as session:
+            missing = settings.OMM_TMP_POOL_SIZE - count_free_tmp_extensions(session)
+        if missing > 0:
+            self.fill_pool(min(missing, settings.OMM_TMP_POOL_BATCH))
 
-            user_id = self.configure_user_on_device(
-                tmp_ext_id, tmp_ext_id, password, (device.ppn)
-            )
+    def sync_devices(self) -> list[int]:
+        """
+        updates the device index and returns the ppns of all devices which
+        became unbound since the last sync
+        """
+        import mitel_ommclient2
 
-            tmp_ext = TemporaryExtensions(
-                extension=tmp_ext_id,
-                password=password,
-                uid=user_id,
-                ppn=device.ppn,
-            )
+        unbound = mitel_ommclient2.types.PPRelTypeType("Unbound")
+        devices = self.omm.call(
+            "find_devices",
+            lambda omm: {
+                int(device.ppn): str(device.relType)
+                for device in omm.find_devices(lambda d: True)
+            },
+            timeout=settings.OMM_SYNC_TIMEOUT,
+        )
+
+        new_devices = [
+            ppn
+            for ppn, rel_type in devices.items()
+            if rel_type == str(unbound) and self.devices.get(ppn) != rel_type
+        ]
+        self.devices = devices
+
+        return new_devices
+
+    def register_devices(self, ppns: list[int]):
+        """
+        attaches a temporary user from the pool to every given device, the
+        pool is filled up first if it doesn't hold enough extensions. Every
+        device is attached by its own request, so interactive requests are
+        handled in between. It stops once this worker lost the scheduler lease.
+        """
+        with Session(engine) as session:
+            missing = len(ppns) - count_free_tmp_extensions(session)
+        if missing > 0:
+            self.fill_pool(missing)
+
+        attached = 0
+        with Session(engine) as session:
+            tmp_extensions = take_free_tmp_extensions(session, len(ppns))
+            assignments = dict(zip(ppns, tmp_extensions))
 
-            with Session(engine) as session:
+            for index, ppn in enumerate(ppns):
+                if not LeaderElection.instance().is_leader():
+                    # the lease was lost, the next leader handles the
+                    # remaining devices
+                    for remaining in ppns[index:]:
+                        self.devices.pop(remaining, None)
+                    break
+
+                tmp_ext = assignments.get(ppn)
+                if tmp_ext is None:
+                    # retry on the next sync
+                    self.devices.pop(ppn, None)
+                    continue
+
+                try:
+                    self.omm.call(
+                        "attach_tmp_user",
+                        lambda omm, uid=tmp_ext.uid, ppn=ppn: omm.attach_user_device(
+                            uid, ppn
+                        ),
+                        timeout=settings.OMM_REQUEST_TIMEOUT,
+                        reconcile=partial(
+                            self.assign_tmp_extension, tmp_ext.extension, ppn
+                        ),
+                    )
+                except OMMTimeout:
+                    # the OMM is busy, the remaining devices are retried on
+                    # the next sync
+                    logger.warning(f"OMM: timed out configuring device {ppn}")
+                    for remaining in ppns[index:]:
+                        self.devices.pop(remaining, None)
+                    break
+                except Exception:
+                    logger.exception(f"OMM: failed to configure device {ppn}")
+                    self.devices.pop(ppn, None)
+                    continue
+
+                logger.info(f"OMM: new unbound device: {ppn} @ {tmp_ext.extension}")
+                tmp_ext.ppn = ppn
+                session.add(tmp_ext)
+                attached += 1
+            session.commit()
+
+        logger.info(f"OMM: registered {attached} new devices")
+
+    @staticmethod
+    def assign_tmp_extension(tmp_ext_id: str, ppn: int, _=None):
+        """
+        stores the device of a temporary extension which was attached after
+        its request timed out
+        """
+        with Session(engine) as session:
+            tmp_ext = get_tmp_extension_by_id(session, tmp_ext_id)
+            if tmp_ext is not None:
+                tmp_ext.ppn = ppn
                 session.add(tmp_ext)
                 session.commit()
 
-                with Session(engine_asterisk) as session_asterisk:
-                    create_sip_account(
-                        session_asterisk,
-                        extension=tmp_ext_id,
-                        extension_name="DECT TMP",
-                        password=password,
-                        codec=self.get_codec(None),
-                        context="pjsip_dect_tmp",
+    def fill_pool(self, count: int):
+        """
+        creates count temporary extensions with their OMM user and sip
+        account, so a new handset only has to be attached. Every user is
+        created by its own request and stored right away. It stops once this
+        worker lost the scheduler lease.
+        """
+        credentials = {}
+        while len(credentials) < count:
+            credentials[str(TemporaryExtensions.generate_extension())] = (
+                generate_extension_password()
+            )
+
+        added = 0
+        for tmp_ext_id, password in credentials.items():
+            if not LeaderElection.instance().is_leader():
+                break
+
+            def create(omm, tmp_ext_id=tmp_ext_id, password=password) -> int:
+                user = omm.create_user(tmp_ext_id)
+                try:
+                    omm.set_user_sipauth(user.uid, tmp_ext_id, password)
+                    omm.set_user_name(user.uid, tmp_ext_id)
+                except Exception:
+                    omm.delete_pp_user(user.uid)
+                    raise
+                return int(user.uid)
+
+            store = partial(self.store_tmp_extension, tmp_ext_id, password)
+            try:
+                uid = self.omm.call(
+                    "create_tmp_user",
+                    create,
+                    timeout=settings.OMM_REQUEST_TIMEOUT,
+                    reconcile=store,
+                )
+            except Exception:
+                logger.exception("OMM: failed to create temporary user")
+                break
+
+            # a failure is logged, the next job run fills the pool again
+            try:
+                store(uid)
+            except Exception:
+                break
+            added += 1
+
+        logger.info(f"OMM: added {added} temporary extensions to the pool")
+
+    def store_tmp_extension(self, tmp_ext_id: str, password: str, uid: int):
+        """
+        stores a temporary extension and its sip account, the OMM user is
+        deleted if that fails
+        """
+        try:
+            with (
+                Session(engine) as session,
+                Session(engine_asterisk) as session_asterisk,
+            ):
+                session.add(
+                    TemporaryExtensions(
+                        extension=tmp_ext_id, password=password, uid=uid
                     )
+                )
+                create_sip_account(
+                    session_asterisk,
+                    extension=tmp_ext_id,
+                    extension_name="DECT TMP",
+                    password=password,
+                    codec=self.get_codec(None),
+                    context="pjsip_dect_tmp",
+                    autocommit=False,
+                )
+                session_asterisk.commit()
+                session.commit()
+        except Exception:
+            logger.exception("Failed to store temporary extension")
+            self.delete_tmp_users([uid])
+            raise
+
+    def cleanup_tmp_extensions(self, unbound: list[int]):
+        """
+        removes the temporary extensions of handsets which disappeared from
+        the OMM or lost their temporary user before they were registered
+        """
+        with Session(engine) as session, Session(engine_asterisk) as session_asterisk:
+            stale = [
+                tmp_ext
+                for tmp_ext in get_assigned_tmp_extensions(session)
+                if tmp_ext.ppn not in self.devices or tmp_ext.ppn in unbound
+            ]
+            if not stale:
+                return
+
+            self.delete_tmp_users([tmp_ext.uid for tmp_ext in stale])
+            delete_tmp_extensions(session, session_asterisk, stale)
+
+        logger.info(f"OMM: removed {len(stale)} unregistered temporary extensions")
+
+    def delete_tmp_users(self, uids: list[int]):
+        for uid in uids:
+
+            def delete(omm, uid=uid):
+                try:
+                    omm.detach_user_device_by_user(uid)
+                except Exception:
+                    # user was not attached to a device
+                    pass
+                omm.delete_pp_user(uid)
+
+            try:
+                self.omm.call(
+                    "delete_tmp_user", delete, timeout=settings.OMM_REQUEST_TIMEOUT
+                )
+            except Exception:
+                logger.warning(f"OMM: failed to delete temporary user {uid}")
 
     def enable_subscription_mode(self):
-        with self.lock:
-            mode = self.ommclient.get_subscription_mode()
+        def enable(omm):
+            mode = omm.get_subscription_mode()
             if mode != "Configured":
                 logger.info("enabled dect subscription mode")
-                self.ommclient.set_subscription_mode("Configured")
+                omm.set_subscription_mode("Configured")
 
-    def get_unbound_devices(self):
-        with self.lock:
-            return self.ommclient.find_devices(
-                lambda d: d.relType == mitel_ommclient2.types.PPRelTypeType("Unbound")
-            )
+        self.omm.call(
+            "enable_subscription_mode", enable, timeout=settings.OMM_REQUEST_TIMEOUT
+        )
 
-    def get_user_by_extension(self, extension: str):
-        with self.lock:
-            users = list(self.ommclient.find_users(lambda u: u.num == extension))
+    def get_user_by_extension(self, extension: str, priority=PRIORITY_BACKGROUND):
+        users = self.call_omm(
+            "find_users",
+            lambda omm: list(omm.find_users(lambda u: u.num == extension)),
+            priority=priority,
+            timeout=settings.OMM_SYNC_TIMEOUT,
+        )
 
         if len(users) != 1:
             raise RuntimeError(f"found {len(users)} for extension {extension} in OMM")
         return users[0]
 
+    def get_uid(self, extension: str) -> int:
+        """
+        returns the OMM user of an extension. The users created by the
+        registration are stored, older ones are searched once by the
+        background worker, the search lists all users.
+        """
+        state = SharedState.instance()
+        uid = state.get(STATE_NAMESPACE, extension)
+        if uid is None:
+            uid = int(self.get_user_by_extension(extension).uid)
+            state.set(STATE_NAMESPACE, extension, uid)
+        return uid
+
     def configure_user_on_device(
-        self, ext_name: str, ext_id: int, ext_password: str, device_ppn: int
+        self,
+        ext_name: str,
+        ext_id: int,
+        ext_password: str,
+        device_ppn: int,
+        priority=PRIORITY_BACKGROUND,
     ) -> int:
-        user = self.ommclient.create_user(str(ext_id))
-        with self.lock:
-            self.ommclient.set_user_sipauth(user.uid, str(ext_id), ext_password)
-            self.ommclient.set_user_name(user.uid, str(ext_name))
-            self.ommclient.attach_user_device(int(user.uid), device_ppn)
+        def configure(omm):
+            user = omm.create_user(str(ext_id))
+            omm.set_user_sipauth(user.uid, str(ext_id), ext_password)
+            omm.set_user_name(user.uid, str(ext_name))
+            omm.attach_user_device(int(user.uid), device_ppn)
+            return int(user.uid)
+
+        return self.call_omm(
+            "configure_user_on_device",
+            configure,
+            priority=priority,
+            timeout=settings.OMM_REQUEST_TIMEOUT,
+        )
 
-        return int(user.uid)
+    def delete_user_from_device(
+        self, user_id: int, device_ppn: int, priority=PRIORITY_BACKGROUND
+    ) -> None:
+        def delete(omm):
+            omm.detach_user_device(uid=user_id, ppn=device_ppn)
+            omm.delete_pp_user(id=user_id)
 
-    def delete_user_from_device(self, user_id: int, device_ppn: int) -> None:
-        with self.lock:
-            self.ommclient.detach_user_device(uid=user_id, ppn=device_ppn)
-            self.ommclient.delete_pp_user(id=user_id)
+        self.call_omm(
+            "delete_user_from_device",
+            delete,
+            priority=priority,
+            timeout=settings.OMM_REQUEST_TIMEOUT,
+        )
 
     def on_extension_delete(self, session, asterisk_session, user, extension):
         super().on_extension_delete(session, asterisk_session, user, extension)
-        user = self.get_user_by_extension(extension.extension)
-        with self.lock:
-            self.ommclient.detach_user_device_by_user(user.uid)
-            self.ommclient.delete_pp_user(user.uid)
+        uid = self.get_uid(extension.extension)
+
+        def delete(omm):
+            omm.detach_user_device_by_user(uid)
+            omm.delete_pp_user(uid)
+
+        self.call_omm(
+            "delete_user",
+            delete,
+            priority=PRIORITY_INTERACTIVE,
+            timeout=settings.OMM_REQUEST_TIMEOUT,
+        )
+        SharedState.instance().delete(STATE_NAMESPACE, extension.extension)
 
     def on_extension_update(self, session, asterisk_session, user, extension):
         super().on_extension_update(session, asterisk_session, user, extension)
-        user = self.get_user_by_extension(extension.extension)
-        with self.lock:
-            self.ommclient.set_user_name(user.uid, extension.name)
+        uid = self.get_uid(extension.extension)
+        self.call_omm(
+            "set_user_name",
+            lambda omm: omm.set_user_name(uid, extension.name),
+            priority=PRIORITY_INTERACTIVE,
+            timeout=settings.OMM_REQUEST_TIMEOUT,
+        )
@@ -0,0 +1,207 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+from logging import getLogger
+from threading import Lock
+import time
+from typing import TYPE_CHECKING
+
+from fastapi import HTTPException, Request, Response, status
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from sqlmodel import Session, col, select
+
+from app.core.config import settings
+from app.core.db import engine
+from app.core.metrics import Counter, registry
+from app.models.extension import Extension
+
+if TYPE_CHECKING:
+    from app.telephoning.flavor import PhoneFlavor
+
+logger = getLogger(__name__)
+
+TEMPLATE_DIRECTORY = "templates/telephoning"
+
+PROVISIONING_REQUESTS: Counter = registry.register(
+    Counter(
+        "uuru_provisioning_requests_total",
+        "Provisioning requests by result (not_modified, cached, rendered, unknown)",
+        ["flavor", "result"],
+    )
+)
+
+
+def create_environment(autoescape: bool) -> Environment:
+    bytecode_cache = None
+    if settings.PROVISIONING_BYTECODE_CACHE:
+        bytecode_cache = FileSystemBytecodeCache(
+            settings.PROVISIONING_BYTECODE_CACHE_DIR
+        )
+
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIRECTORY),
+        autoescape=autoescape,
+        # templates are compiled once, changes need a restart
+        auto_reload=False,
+        bytecode_cache=bytecode_cache,
+    )
+
+
+# autoescape -> environment, created on first use
+environments: dict[bool, Environment] = {}
+
+
+def get_environment(autoescape: bool) -> Environment:
+    if autoescape not in environments:
+        environments[autoescape] = create_environment(autoescape)
+    return environments[autoescape]
+
+
+class Provisioning(object):
+    """
+    Renders the provisioning file of a phone flavor for the extension whose
+    extra field PROVISIONING_KEY matches the requested value.
+
+    The index from key to extension number is rebuilt with a single query
+    when a key is unknown, a hit is always checked against the extension, so
+    changes made by other workers are noticed. Rendered files are cached by
+    a digest of the extension (including its assigned media), the context
+    and the template, which is also sent as ETag, so unchanged files are
+    neither rendered nor transferred again.
+    """
+
+    def __init__(self, flavor: "PhoneFlavor"):
+        self.flavor = flavor
+        self.name = type(flavor).__name__.lower()
+        self.key = flavor.PROVISIONING_KEY
+
+        self.template = get_environment(flavor.PROVISIONING_AUTOESCAPE).get_template(
+            flavor.PROVISIONING_TEMPLATE
+        )
+        with open(self.template.filename, "rb") as file:
+            self.template_digest = hashlib.blake2b(file.read()).hexdigest()
+
+        self.lock = Lock()
+        # key value -> extension number
+        self.index: dict[str, str] = {}
+        self.indexed_at = 0.0
+        # digest -> rendered file
+        self.cache: OrderedDict[str, bytes] = OrderedDict()
+
+    def rebuild_index(self, session: Session):
+        rows = session.exec(
+            select(Extension.extension, Extension.extra_fields).where(
+                col(Extension.type).in_(self.flavor.PHONE_TYPES)
+            )
+        ).all()
+
+        index = {}
+        for number, extra_fields in rows:
+            value = (extra_fields or {}).get(self.key)
+            if value is not None:
+                index[value] = number
+
+        with self.lock:
+            self.index = index
+            self.indexed_at = time.monotonic()
+
+    def lookup(self, session: Session, value: str) -> Extension | None:
+        for attempt in range(2):
+            number = self.index.get(value)
+            if number is not None:
+                extension = session.get(Extension, number)
+                if (
+                    extension is not None
+                    and extension.type in self.flavor.PHONE_TYPES
+                    and extension.extra_fields.get(self.key) == value
+                ):
+                    return extension
+
+            # unknown keys of unconfigured phones don't cause a scan each
+            if (
+                attempt > 0
+                or time.monotonic() - self.indexed_at
+                < settings.PROVISIONING_INDEX_REFRESH
+            ):
+                return None
+            self.rebuild_index(session)
+
+        return None
+
+    @staticmethod
+    def relations(extension: Extension) -> list:
+        """
+        returns the state of the relationships templates may use, they are
+        not part of model_dump
+        """
+        return sorted(
+            (assigned.name, str(assigned.media_id), assigned.media.stored_as)
+            for assigned in extension.assigned_media
+            if assigned.media is not None
+        )
+
+    def digest(self, extension: Extension, context: dict) -> str:
+        state = json.dumps(
+            [extension.model_dump(mode="json"), self.relations(extension), context],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.blake2b(
+            f"{self.template_digest}:{state}".encode(), digest_size=16
+        ).hexdigest()
+
+    def render(self, digest: str, extension: Extension, context: dict) -> bytes:
+        with self.lock:
+            body = self.cache.get(digest)
+            if body is not None:
+                self.cache.move_to_end(digest)
+                return body
+
+        body = self.template.render(
+            extension=extension, settings=settings, **context
+        ).encode()
+
+        with self.lock:
+            self.cache[digest] = body
+            while len(self.cache) > settings.PROVISIONING_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return body
+
+    def respond(self, request: Request, value: str) -> Response:
+        key = self.flavor.normalize_provisioning_key(value)
+
+        with Session(engine) as session:
+            extension = None if key is None else self.lookup(session, key)
+            if extension is None:
+                PROVISIONING_REQUESTS.inc(flavor=self.name, result="unknown")
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"no extension found for {self.key} {value}",
+                )
+
+            context = self.flavor.provisioning_context(session, extension)
+            digest = self.digest(extension, context)
+            etag = f'"{digest}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+            if etag in request.headers.get("if-none-match", ""):
+                PROVISIONING_REQUESTS.inc(flavor=self.name, result="not_modified")
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+                )
+
+            result = "cached" if digest in self.cache else "rendered"
+            body = self.render(digest, extension, context)
+
+        PROVISIONING_REQUESTS.inc(flavor=self.name, result=result)
+        logger.info(f"Send provisioning data to {self.name} @ {key}")
+        return Response(
+            body, media_type=self.flavor.PROVISIONING_MEDIA_TYPE, headers=headers
+        )
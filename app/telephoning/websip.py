@@ -1,20 +1,39 @@
 from logging import getLogger
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
+import time
 
-from sqlmodel import Session
+import sqlalchemy
+from sqlalchemy import Engine
+from sqlmodel import Session, col, delete, select
 
+from app.core.metrics import Counter, Gauge, registry
 from app.core.security import generate_extension_password
 from app.models.crud.asterisk import (
     create_sip_account,
     delete_sip_account,
+    delete_sip_accounts,
+    rotate_sip_account,
 )
 from app.models.user import User
+from app.models.websip import WebSIPSession, WebSIPStatus
 from app.core.config import settings
 
 logger = getLogger(__name__)
 
 
+JOB_INTERVAL = 30
+# sessions which weren't refreshed for this time are removed
+SESSION_TIMEOUT = 180
+
+WEBSIP_EXPIRED_SESSIONS: Counter = registry.register(
+    Counter(
+        "uuru_websip_expired_sessions_total",
+        "WebSIP sessions removed because they weren't refreshed",
+    )
+)
+
+
 class WebSIPExtension(BaseModel):
     aor: str
     extension: str
@@ -23,8 +42,28 @@ class WebSIPExtension(BaseModel):
     display_name: str
     last_seen: datetime
 
+    @staticmethod
+    def from_session(websip_session: WebSIPSession) -> "WebSIPExtension":
+        return WebSIPExtension(
+            aor=f"sip:{websip_session.extension}@{settings.ASTERISK_HOST}",
+            extension=websip_session.extension,
+            auth_user=websip_session.extension,
+            auth_pass=websip_session.auth_pass,
+            display_name=websip_session.display_name,
+            last_seen=websip_session.last_seen,
+        )
+
 
 class WebSIPManager(object):
+    """
+    Manages the temporary extensions used by the browser phone. The state of
+    every number in the WebSIP range is stored in the websipsession table, so
+    all workers share it. Numbers are allocated with row locks (SKIP LOCKED),
+    two workers therefore never hand out the same number. Optionally a number
+    of endpoints is created in advance, they only get new credentials when
+    they are handed out.
+    """
+
     _instance = None
 
     @staticmethod
@@ -35,73 +74,225 @@ class WebSIPManager(object):
         return WebSIPManager._instance
 
     def __init__(self):
-        self.active_extensions: list[WebSIPExtension] = []
+        # statistics of the expiry sweeps run by this worker
+        self.sweeps = 0
+        self.expired_total = 0
+        self.last_sweep_expired = 0
+        self.last_sweep_seconds = 0.0
+        # numbers by status, counted by the job
+        self.sessions: dict[str, int] = {}
+
+    @staticmethod
+    def in_range():
+        return sqlalchemy.cast(WebSIPSession.extension, sqlalchemy.Integer).between(
+            settings.WEBSIP_EXTENSION_RANGE[0], settings.WEBSIP_EXTENSION_RANGE[1]
+        )
+
+    def setup(self, session: Session):
+        """
+        creates the rows for all numbers in the WebSIP range, unused numbers
+        of a previous range are removed
+        """
+        session.exec(
+            delete(WebSIPSession)
+            .where(WebSIPSession.status == WebSIPStatus.FREE)
+            .where(~self.in_range())
+        )
+
+        numbers = {
+            str(i)
+            for i in range(
+                settings.WEBSIP_EXTENSION_RANGE[0],
+                settings.WEBSIP_EXTENSION_RANGE[1] + 1,
+            )
+        }
+        known = set(session.exec(select(WebSIPSession.extension)).all())
 
-    def teardown(self, session_asterisk: Session):
+        for number in numbers - known:
+            session.add(WebSIPSession(extension=number))
+        try:
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # another worker created them at the same time
+            session.rollback()
+
+    def teardown(self, session: Session, session_asterisk: Session):
         # deletes all websip extensions
-        for extension in self.active_extensions:
-            self.delete_extension(session_asterisk, extension)
+        websip_sessions = session.exec(
+            select(WebSIPSession)
+            .where(WebSIPSession.status != WebSIPStatus.FREE)
+            .with_for_update(skip_locked=True)
+        ).all()
+
+        for websip_session in websip_sessions:
+            delete_sip_account(session_asterisk, websip_session.extension)
+            self.reset(websip_session)
+            session.add(websip_session)
+        session.commit()
+
+    @staticmethod
+    def reset(websip_session: WebSIPSession):
+        websip_session.status = WebSIPStatus.FREE
+        websip_session.auth_pass = None
+        websip_session.display_name = None
+        websip_session.last_seen = None
+
+    def get_extension(self, session: Session, extension: str) -> WebSIPSession:
+        websip_session = session.get(WebSIPSession, extension)
+        if websip_session is None or websip_session.status != WebSIPStatus.ACTIVE:
+            raise LookupError("Unknown extension")
+        return websip_session
+
+    def refresh_extension(self, session: Session, extension: str):
+        result = session.exec(
+            sqlalchemy.update(WebSIPSession)
+            .where(WebSIPSession.extension == extension)
+            .where(WebSIPSession.status == WebSIPStatus.ACTIVE)
+            .values(last_seen=datetime.now())
+        )
+        if result.rowcount != 1:
+            session.rollback()
+            raise LookupError("Unknown extension")
+        session.commit()
 
-    def get_extension(self, extension: str):
-        ext = [e for e in self.active_extensions if e.extension == extension]
-        if len(ext) != 1:
-            raise AttributeError("Unknown extension")
-        return ext[0]
+    def delete_extension(
+        self, session: Session, session_asterisk: Session, extension: str
+    ):
+        websip_session = session.exec(
+            select(WebSIPSession)
+            .where(WebSIPSession.extension == extension)
+            .with_for_update()
+        ).first()
+        if websip_session is None or websip_session.status == WebSIPStatus.FREE:
+            session.rollback()
+            return
 
-    def delete_extension(self, session_asterisk: Session, extension: WebSIPExtension):
         try:
-            delete_sip_account(session_asterisk, extension.extension)
-            self.active_extensions.pop(self.active_extensions.index(extension))
+            delete_sip_account(session_asterisk, extension)
         except Exception as e:
+            session.rollback()
             logger.error(
                 f"Failed to delete WebSIP extension from asterisk DB: {str(e)}"
             )
             raise
 
-    def create_extension(self, session_asterisk: Session, user: User | None = None):
-        free_extension = None
-        for i in range(
-            settings.WEBSIP_EXTENSION_RANGE[0], settings.WEBSIP_EXTENSION_RANGE[1] + 1
-        ):
-            exts = [e for e in self.active_extensions if e.extension == str(i)]
-            if len(exts) == 0:
-                free_extension = str(i)
-                break
-
-        if free_extension is None:
+        self.reset(websip_session)
+        session.add(websip_session)
+        session.commit()
+
+    def lock_next(self, session: Session, status: WebSIPStatus) -> WebSIPSession | None:
+        return session.exec(
+            select(WebSIPSession)
+            .where(WebSIPSession.status == status)
+            .where(self.in_range())
+            .order_by(col(WebSIPSession.extension))
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+
+    def create_extension(
+        self, session: Session, session_asterisk: Session, user: User | None = None
+    ) -> WebSIPExtension:
+        websip_session = self.lock_next(session, WebSIPStatus.WARM)
+        warm = websip_session is not None
+        if not warm:
+            websip_session = self.lock_next(session, WebSIPStatus.FREE)
+
+        if websip_session is None:
+            session.rollback()
             raise Exception("No free extension found in WebSIP range")
-        free_extension = str(free_extension)
 
+        free_extension = websip_session.extension
         pwd = generate_extension_password()
         name = f"{user.username if user else 'Anonymous'} (Web)"
 
-        ext = WebSIPExtension(
-            aor=f"sip:{free_extension}@{settings.ASTERISK_HOST}",
-            extension=free_extension,
-            auth_user=free_extension,
-            auth_pass=pwd,
-            display_name=name,
-            last_seen=datetime.now(),
-        )
-
         try:
-            create_sip_account(
-                session_asterisk,
-                free_extension,
-                name,
-                pwd,
-                "opus,ulaw",
-                set_websip_fields=True,
-            )
+            if warm:
+                rotate_sip_account(session_asterisk, free_extension, name, pwd)
+            else:
+                # remove leftovers of a session which wasn't cleaned up
+                delete_sip_account(session_asterisk, free_extension, autocommit=False)
+                create_sip_account(
+                    session_asterisk,
+                    free_extension,
+                    name,
+                    pwd,
+                    "opus,ulaw",
+                    set_websip_fields=True,
+                )
         except Exception as e:
+            session.rollback()
             logger.error(f"Failed to create WebSIP extension in asterisk DB: {str(e)}")
             raise
 
-        self.active_extensions.append(ext)
+        websip_session.status = WebSIPStatus.ACTIVE
+        websip_session.auth_pass = pwd
+        websip_session.display_name = name
+        websip_session.last_seen = datetime.now()
+        session.add(websip_session)
+        session.commit()
+        session.refresh(websip_session)
+
+        return WebSIPExtension.from_session(websip_session)
 
-        return ext
+    def fill_warm_pool(self, session: Session, session_asterisk: Session):
+        """
+        creates endpoints until WEBSIP_WARM_POOL_SIZE unused ones exist
+        """
+        if settings.WEBSIP_WARM_POOL_SIZE <= 0:
+            return
 
-    def job(self, engine):
+        warm = session.exec(
+            select(sqlalchemy.func.count())
+            .select_from(WebSIPSession)
+            .where(WebSIPSession.status == WebSIPStatus.WARM)
+            .where(self.in_range())
+        ).one()
+        missing = settings.WEBSIP_WARM_POOL_SIZE - warm
+        if missing <= 0:
+            return
+
+        websip_sessions = session.exec(
+            select(WebSIPSession)
+            .where(WebSIPSession.status == WebSIPStatus.FREE)
+            .where(self.in_range())
+            .order_by(col(WebSIPSession.extension))
+            .limit(missing)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not websip_sessions:
+            session.rollback()
+            return
+
+        try:
+            for websip_session in websip_sessions:
+                delete_sip_account(
+                    session_asterisk, websip_session.extension, autocommit=False
+                )
+                create_sip_account(
+                    session_asterisk,
+                    websip_session.extension,
+                    "WebSIP (Idle)",
+                    generate_extension_password(),
+                    "opus,ulaw",
+                    set_websip_fields=True,
+                    autocommit=False,
+                )
+            session_asterisk.commit()
+        except Exception:
+            session_asterisk.rollback()
+            session.rollback()
+            logger.exception("Failed to fill WebSIP warm pool")
+            return
+
+        for websip_session in websip_sessions:
+            websip_session.status = WebSIPStatus.WARM
+            session.add(websip_session)
+        session.commit()
+
+        logger.info(f"Added {len(websip_sessions)} extensions to the WebSIP warm pool")
+
+    def job(self, engine: Engine, engine_asterisk: Engine):
         # clean up all extension which are since more than 3 minutes not seen
         # this actually may not cause calls to end which are still running but
         # removes all extensions which are not in use if the frontend failed to
@@ -109,11 +300,147 @@ class WebSIPManager(object):
         # The frontend should regulary do a PUT request to the websip endpoint
         # to refresh the last seen attribute to prevent the extension from
         # beeing deleted.
-        now = datetime.now()
-        with Session(engine) as session_asterisk:
-            for extension in self.active_extensions:
-                if (now - extension.last_seen).total_seconds() > 180:
-                    self.delete_extension(session_asterisk, extension)
-                    logger.info(
-                        f"Deleted WebSIP extension <{extension.extension}> due to 180 seconds of inactivity!"
-                    )
+        with Session(engine) as session, Session(engine_asterisk) as session_asterisk:
+            self.sweep(session, session_asterisk)
+            self.remove_outside_range(session, session_asterisk)
+            self.fill_warm_pool(session, session_asterisk)
+            self.count_sessions(session)
+
+    def remove_outside_range(self, session: Session, session_asterisk: Session):
+        """
+        removes the unused numbers which are no longer part of the WebSIP
+        range, active sessions are removed after they expired
+        """
+        unused = session.exec(
+            select(WebSIPSession)
+            .where(
+                col(WebSIPSession.status).in_([WebSIPStatus.FREE, WebSIPStatus.WARM])
+            )
+            .where(~self.in_range())
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not unused:
+            session.rollback()
+            return
+
+        warm = [
+            websip_session.extension
+            for websip_session in unused
+            if websip_session.status == WebSIPStatus.WARM
+        ]
+        try:
+            if warm:
+                delete_sip_accounts(session_asterisk, warm)
+        except Exception:
+            session.rollback()
+            logger.exception("Failed to delete WebSIP extensions outside the range")
+            return
+
+        for websip_session in unused:
+            session.delete(websip_session)
+        session.commit()
+
+        logger.info(f"Removed {len(unused)} numbers outside the WebSIP range")
+
+    def count_sessions(self, session: Session):
+        counts = dict(
+            session.exec(
+                select(WebSIPSession.status, sqlalchemy.func.count()).group_by(
+                    WebSIPSession.status
+                )
+            ).all()
+        )
+        self.sessions = {
+            status.value: counts.get(status, 0) for status in WebSIPStatus
+        }
+
+    def stats(self) -> dict:
+        return {
+            "sweeps": self.sweeps,
+            "expired_total": self.expired_total,
+            "last_sweep_expired": self.last_sweep_expired,
+            "last_sweep_seconds": self.last_sweep_seconds,
+            "sessions": self.sessions,
+        }
+
+    def sweep(self, session: Session, session_asterisk: Session):
+        """
+        removes all sessions which expired at once, the index on last_seen
+        keeps the sessions ordered by their expiry
+        """
+        started = time.monotonic()
+        cutoff = datetime.now() - timedelta(seconds=SESSION_TIMEOUT)
+
+        expired = session.exec(
+            select(WebSIPSession)
+            .where(WebSIPSession.status == WebSIPStatus.ACTIVE)
+            .where(WebSIPSession.last_seen < cutoff)
+            .with_for_update(skip_locked=True)
+        ).all()
+        extensions = [websip_session.extension for websip_session in expired]
+
+        if extensions:
+            try:
+                delete_sip_accounts(session_asterisk, extensions)
+            except Exception:
+                session.rollback()
+                logger.exception("Failed to delete expired WebSIP extensions")
+                return
+
+            session.exec(
+                sqlalchemy.update(WebSIPSession)
+                .where(col(WebSIPSession.extension).in_(extensions))
+                .values(
+                    status=WebSIPStatus.FREE,
+                    auth_pass=None,
+                    display_name=None,
+                    last_seen=None,
+                )
+            )
+        session.commit()
+
+        self.sweeps += 1
+        self.expired_total += len(extensions)
+        WEBSIP_EXPIRED_SESSIONS.inc(len(extensions))
+        self.last_sweep_expired = len(extensions)
+        self.last_sweep_seconds = time.monotonic() - started
+
+        if extensions:
+            logger.info(
+                f"Deleted {len(extensions)} WebSIP extensions due to "
+                f"{SESSION_TIMEOUT} seconds of inactivity in "
+                f"{self.last_sweep_seconds:.3f}s: {', '.join(extensions)}"
+            )
+
+
+def collect_last_sweep(name: str) -> list[tuple[dict[str, str], float]]:
+    # only the worker running the job has swept
+    stats = WebSIPManager.instance().stats()
+    return [({}, stats[name])] if stats["sweeps"] else []
+
+
+registry.register(
+    Gauge(
+        "uuru_websip_sweep_duration_seconds",
+        "Duration of the last sweep for expired WebSIP sessions",
+        collector=lambda: collect_last_sweep("last_sweep_seconds"),
+    )
+)
+registry.register(
+    Gauge(
+        "uuru_websip_sweep_expired_sessions",
+        "WebSIP sessions removed by the last sweep",
+        collector=lambda: collect_last_sweep("last_sweep_expired"),
+    )
+)
+registry.register(
+    Gauge(
+        "uuru_websip_sessions",
+        "Numbers of the WebSIP range by status (free, warm, active)",
+        ["status"],
+        collector=lambda: [
+            ({"status": status}, count)
+            for status, count in WebSIPManager.instance().stats()["sessions"].items()
+        ],
+    )
+)
@@ -0,0 +1,114 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections.abc import Callable, Generator
+from types import SimpleNamespace
+import time
+
+import httpx
+import pytest
+
+from app.api.client import http
+from app.api.client.http import FederationClient
+from app.core.config import settings
+
+PEER = "https://peer.example"
+
+
+@pytest.fixture()
+def sleeps(monkeypatch) -> list[float]:
+    """
+    records the backoff of the client instead of waiting
+    """
+    sleeps = []
+    monkeypatch.setattr(
+        http,
+        "time",
+        SimpleNamespace(sleep=sleeps.append, perf_counter=time.perf_counter),
+    )
+    monkeypatch.setattr(settings, "FEDERATION_HTTP_RETRIES", 2)
+    monkeypatch.setattr(settings, "FEDERATION_HTTP_BACKOFF", 0.5)
+    return sleeps
+
+
+@pytest.fixture()
+def peer() -> Generator[Callable, None, None]:
+    """
+    returns a function which answers the requests of a new client with the
+    given responses or exceptions, in order
+    """
+    clients = []
+
+    def answer(*results) -> tuple[FederationClient, list[httpx.Request]]:
+        requests = []
+        remaining = list(results)
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            result = remaining.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return httpx.Response(result)
+
+        client = FederationClient()
+        client.close()
+        client.client = httpx.Client(transport=httpx.MockTransport(handler))
+        clients.append(client)
+        return client, requests
+
+    yield answer
+
+    for client in clients:
+        client.close()
+
+
+def test_retry_with_backoff(peer, sleeps: list[float]) -> None:
+    client, requests = peer(503, 502, 200)
+    assert client.get(PEER, "/api/v1/extension/phonebook").status_code == 200
+    assert len(requests) == 3
+    assert str(requests[0].url) == f"{PEER}/api/v1/extension/phonebook"
+    assert sleeps == [0.5, 1.0]
+
+
+def test_last_response_is_returned(peer, sleeps: list[float]) -> None:
+    client, requests = peer(503, 503, 503)
+    assert client.get(PEER, "/").status_code == 503
+    assert len(requests) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_post_is_not_repeated(peer, sleeps: list[float]) -> None:
+    # the peer may have handled the request already
+    client, requests = peer(503)
+    assert client.post(PEER, "/").status_code == 503
+
+    client, requests = peer(httpx.ReadTimeout("timed out"))
+    with pytest.raises(httpx.ReadTimeout):
+        client.post(PEER, "/")
+    assert len(requests) == 1
+    assert sleeps == []
+
+
+def test_connect_errors_are_repeated(peer, sleeps: list[float]) -> None:
+    # the request never reached the peer, even a POST can be sent again
+    client, requests = peer(httpx.ConnectError("refused"), 200)
+    assert client.post(PEER, "/").status_code == 200
+    assert len(requests) == 2
+
+    client, requests = peer(*[httpx.ConnectError("refused")] * 3)
+    with pytest.raises(httpx.ConnectError):
+        client.get(PEER, "/")
+    assert len(requests) == 3
+
+
+def test_idempotent_requests_repeated_after_transport_errors(
+    peer, sleeps: list[float]
+) -> None:
+    client, requests = peer(httpx.ReadTimeout("timed out"), 204)
+    assert client.delete(PEER, "/").status_code == 204
+    assert len(requests) == 2
+    assert sleeps == [0.5]
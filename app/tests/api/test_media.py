@@ -0,0 +1,137 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import io
+import os
+
+from fastapi.testclient import TestClient
+from fastapi import status
+from PIL import Image
+import pytest
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.models.crud.media import delete_media, get_media_by_id
+from app.models.crud.user import get_user_by_username
+from app.models.media import ImageFormat, Media, MediaType
+from app.util import media as media_utils
+
+
+@pytest.fixture()
+def media_path(tmp_path, monkeypatch) -> str:
+    monkeypatch.setattr(settings, "MEDIA_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "MEDIA_IMAGE_STORAGE_FORMAT", "png")
+    return str(tmp_path)
+
+
+def create_image(color: str) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, "png")
+    return buffer.getvalue()
+
+
+def upload(
+    client: TestClient, headers: dict[str, str], name: str, content: bytes
+) -> dict:
+    r = client.post(
+        f"{settings.API_V1_STR}/media/",
+        params={"name": name, "supposed_type": MediaType.IMAGE.value},
+        files={"file": (f"{name}.png", content, "image/png")},
+        headers=headers,
+    )
+    assert r.status_code == status.HTTP_200_OK
+    return r.json()
+
+
+def delete(client: TestClient, headers: dict[str, str], media: dict) -> None:
+    r = client.delete(f"{settings.API_V1_STR}/media/{media['id']}", headers=headers)
+    assert r.status_code == status.HTTP_204_NO_CONTENT
+
+
+def test_dedupe_and_delete(
+    client: TestClient, root_token_headers: dict[str, str], media_path: str
+) -> None:
+    content = create_image("red")
+    first = upload(client, root_token_headers, "first", content)
+    second = upload(client, root_token_headers, "second", content)
+    other = upload(client, root_token_headers, "other", create_image("blue"))
+
+    # the same content is stored once
+    assert first["id"] != second["id"]
+    assert first["stored_as"] == second["stored_as"]
+    assert first["stored_as"] != other["stored_as"]
+    path = os.path.join(media_path, first["stored_as"])
+    assert os.path.isfile(path)
+
+    # the file is kept while a media references it
+    delete(client, root_token_headers, first)
+    assert os.path.isfile(path)
+    r = client.get(f"{settings.API_V1_STR}/media/byid/{second['id']}")
+    assert r.status_code == status.HTTP_200_OK
+
+    delete(client, root_token_headers, second)
+    assert not os.path.exists(path)
+    assert os.path.isfile(os.path.join(media_path, other["stored_as"]))
+
+    # uploading the content again stores it again
+    third = upload(client, root_token_headers, "third", content)
+    assert os.path.isfile(os.path.join(media_path, third["stored_as"]))
+
+    delete(client, root_token_headers, third)
+    delete(client, root_token_headers, other)
+    # no temporary or deleted files are left behind
+    assert os.listdir(media_path) == []
+
+
+def test_failed_delete_keeps_file(
+    client: TestClient,
+    root_token_headers: dict[str, str],
+    media_path: str,
+    db: Session,
+    monkeypatch,
+) -> None:
+    media = upload(client, root_token_headers, "media", create_image("green"))
+    path = os.path.join(media_path, media["stored_as"])
+    user = get_user_by_username(db, settings.DEFAULT_ROOT_USER)
+
+    def fail():
+        raise RuntimeError("commit failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db, "commit", fail)
+        with pytest.raises(RuntimeError):
+            delete_media(db, user, get_media_by_id(db, media["id"]))
+    db.rollback()
+
+    # the file is only removed once the media is gone
+    assert os.listdir(media_path) == [media["stored_as"]]
+    assert os.path.isfile(path)
+    delete(client, root_token_headers, media)
+    assert not os.path.exists(path)
+
+
+def test_renditions_per_stored_file(media_path: str) -> None:
+    content_hash = "0" * 64
+    png = Media(name="png", type=MediaType.IMAGE, stored_as=f"{content_hash}.png")
+    jpeg = Media(name="jpeg", type=MediaType.IMAGE, stored_as=f"{content_hash}.jpeg")
+    raw = Media(name="raw", type=MediaType.RAW, stored_as=content_hash)
+    format = ImageFormat(out_type="bmp", width=2)
+
+    png_rendition = media_utils.get_rendition_path(png, format)
+    jpeg_rendition = media_utils.get_rendition_path(jpeg, format)
+    assert png_rendition != jpeg_rendition
+
+    os.makedirs(media_utils.get_rendition_directory())
+    for path in (png_rendition, jpeg_rendition):
+        with open(path, "wb") as file:
+            file.write(b"rendition")
+
+    # deleting one stored file keeps the renditions of the others
+    media_utils.delete_renditions(raw)
+    media_utils.delete_renditions(png)
+    assert not os.path.exists(png_rendition)
+    assert os.path.isfile(jpeg_rendition)
@@ -0,0 +1,121 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from fastapi.testclient import TestClient
+from fastapi import status
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.ratelimit import MemoryRateLimitBackend, RateLimiter
+from app.models.crud.extension import compact_phonebook_changes
+
+
+def get_changes(client: TestClient, since: int) -> dict:
+    r = client.get(
+        f"{settings.API_V1_STR}/extension/phonebook/changes", params={"since": since}
+    )
+    assert r.status_code == status.HTTP_200_OK
+    return r.json()
+
+
+def create_extension(
+    client: TestClient, headers: dict[str, str], extension: str
+) -> None:
+    data = {
+        "extension": extension,
+        "name": f"phonebook {extension}",
+        "info": "",
+        "public": True,
+        "type": "SIP",
+    }
+    r = client.post(f"{settings.API_V1_STR}/extension", json=data, headers=headers)
+    assert r.status_code == status.HTTP_201_CREATED
+
+
+def delete_extension(
+    client: TestClient, headers: dict[str, str], extension: str
+) -> None:
+    r = client.delete(f"{settings.API_V1_STR}/extension/{extension}", headers=headers)
+    assert r.status_code == status.HTTP_204_NO_CONTENT
+
+
+def test_phonebook_changes(
+    client: TestClient, root_token_headers: dict[str, str], monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "FEDERATION_PHONEBOOK_CHANGE_DELAY", 0)
+
+    full = get_changes(client, 0)
+    assert full["full"]
+
+    create_extension(client, root_token_headers, "2345")
+    changes = get_changes(client, full["seq"])
+    assert not changes["full"]
+    assert changes["seq"] > full["seq"]
+    assert [e["extension"] for e in changes["upserts"]] == ["2345"]
+
+    # recent changes are not handed out yet, they may still be uncommitted
+    monkeypatch.setattr(settings, "FEDERATION_PHONEBOOK_CHANGE_DELAY", 3600)
+    create_extension(client, root_token_headers, "2346")
+    pending = get_changes(client, changes["seq"])
+    assert pending["seq"] == changes["seq"]
+    assert pending["upserts"] == []
+
+    monkeypatch.setattr(settings, "FEDERATION_PHONEBOOK_CHANGE_DELAY", 0)
+    delete_extension(client, root_token_headers, "2345")
+    changes = get_changes(client, changes["seq"])
+    assert [e["extension"] for e in changes["upserts"]] == ["2346"]
+    assert changes["deletes"] == ["2345"]
+
+    delete_extension(client, root_token_headers, "2346")
+
+
+def test_unchanged_phonebook(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "FEDERATION_PHONEBOOK_CHANGE_DELAY", 3600)
+
+    # peers of an unchanged phonebook get a sync position and empty deltas
+    full = get_changes(client, 0)
+    assert full["seq"] > 0
+    changes = get_changes(client, full["seq"])
+    assert not changes["full"]
+    assert changes["seq"] == full["seq"]
+    assert changes["upserts"] == [] and changes["deletes"] == []
+
+
+def test_compaction(
+    client: TestClient, root_token_headers: dict[str, str], db: Session, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "FEDERATION_PHONEBOOK_CHANGE_DELAY", 0)
+    start = get_changes(client, 0)["seq"]
+    create_extension(client, root_token_headers, "2347")
+    create_extension(client, root_token_headers, "2348")
+    before = get_changes(client, start)
+    assert before["seq"] >= start + 2
+
+    monkeypatch.setattr(settings, "FEDERATION_PHONEBOOK_CHANGE_RETENTION", -1)
+    compact_phonebook_changes(db.get_bind())
+
+    # the newest change is kept, peers which are behind get a full sync
+    latest = get_changes(client, before["seq"])
+    assert not latest["full"]
+    assert latest["seq"] == before["seq"]
+    assert get_changes(client, start)["full"]
+
+    delete_extension(client, root_token_headers, "2347")
+    delete_extension(client, root_token_headers, "2348")
+
+
+def test_phonebook_rate_limit(client: TestClient, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_FEDERATION_IP", 2)
+    monkeypatch.setattr(RateLimiter.instance(), "backend", MemoryRateLimitBackend())
+
+    # both endpoints can be polled without authentication and share the limit
+    get_changes(client, 0)
+    r = client.get(f"{settings.API_V1_STR}/extension/phonebook")
+    assert r.status_code == status.HTTP_200_OK
+    r = client.get(f"{settings.API_V1_STR}/extension/phonebook")
+    assert r.status_code == status.HTTP_429_TOO_MANY_REQUESTS
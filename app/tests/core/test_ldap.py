@@ -0,0 +1,244 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections.abc import Generator
+from types import SimpleNamespace
+import time
+
+from ldap3.core.results import RESULT_NO_SUCH_OBJECT, RESULT_OTHER, RESULT_SUCCESS
+import pytest
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.ldap import LDAPPool
+from app.core.scheduler import LeaderElection, LeaderLost
+from app.models.crud.ldap import LDAPSync
+from app.models.extension import Extension
+
+
+class StubConnection(object):
+    """
+    keeps the directory in a dict, writes of the numbers in failing fail
+    """
+
+    def __init__(self):
+        self.entries: dict[str, dict] = {}
+        self.failing: set[str] = set()
+        self.result = {"result": RESULT_SUCCESS}
+        self.page_sizes: list[int] = []
+        self.extend = SimpleNamespace(
+            standard=SimpleNamespace(paged_search=self.paged_search)
+        )
+
+    def succeeds(self, dn: str) -> bool:
+        number = dn.split(",")[0].removeprefix("cn=")
+        self.result = {
+            "result": RESULT_OTHER if number in self.failing else RESULT_SUCCESS
+        }
+        return number not in self.failing
+
+    def add(self, dn: str, attributes: dict):
+        if self.succeeds(dn):
+            self.entries[dn] = {
+                key: value if isinstance(value, list) else [value]
+                for key, value in attributes.items()
+            }
+
+    def modify(self, dn: str, changes: dict):
+        if not self.succeeds(dn):
+            return
+        if dn not in self.entries:
+            self.result = {"result": RESULT_NO_SUCH_OBJECT}
+            return
+        for key, [(_, values)] in changes.items():
+            self.entries[dn][key] = values
+
+    def delete(self, dn: str):
+        if self.succeeds(dn) and self.entries.pop(dn, None) is None:
+            self.result = {"result": RESULT_NO_SUCH_OBJECT}
+
+    def paged_search(self, base, filter, attributes, paged_size, generator):
+        self.page_sizes.append(paged_size)
+        for dn, entry in self.entries.items():
+            yield {
+                "type": "searchResEntry",
+                "dn": dn,
+                "attributes": {
+                    "cn": [dn.split(",")[0].removeprefix("cn=")],
+                    **{key: entry.get(key, []) for key in ("sn", "l")},
+                },
+            }
+        yield {"type": "searchResDone"}
+
+
+class StubPool(object):
+    def __init__(self, connection: StubConnection):
+        self.connection = connection
+
+    def acquire(self) -> StubConnection:
+        return self.connection
+
+    def release(self, connection: StubConnection):
+        pass
+
+
+@pytest.fixture()
+def connection(monkeypatch) -> StubConnection:
+    connection = StubConnection()
+    monkeypatch.setattr(LDAPPool, "instance", lambda: StubPool(connection))
+    return connection
+
+
+@pytest.fixture()
+def extensions(db: Session) -> Generator[list[Extension], None, None]:
+    extensions = [
+        Extension(
+            extension=number,
+            name=f"ldap {number}",
+            location_name=location,
+            public=public,
+            type="SIP",
+            token="",
+            password="",
+            info="",
+        )
+        for number, location, public in [
+            ("2401", "Tent", True),
+            ("2402", None, True),
+            ("2403", None, False),
+            ("2404", None, True),
+        ]
+    ]
+    db.add_all(extensions)
+    db.commit()
+    yield extensions
+
+    for extension in extensions:
+        db.delete(extension)
+    db.commit()
+
+
+@pytest.fixture()
+def sync(db: Session, monkeypatch) -> LDAPSync:
+    monkeypatch.setattr(settings, "LDAP_SYNC_BATCH_DELAY", 0)
+    sync = LDAPSync()
+    # batches are taken by the test instead of the background thread
+    sync.engine = db.get_bind()
+    sync.running = True
+    return sync
+
+
+def dn(number: str) -> str:
+    return f"cn={number},{settings.LDAP_BASE_DN}"
+
+
+def test_batches(
+    sync: LDAPSync, connection: StubConnection, extensions, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "LDAP_SYNC_BATCH_SIZE", 2)
+    connection.entries[dn("2403")] = {"sn": ["private"]}
+
+    sync.enqueue(["2401", "2402"])
+    sync.enqueue(["2401", "2403"])
+    first = sync.take_batch()
+    assert len(first) == 2
+    second = sync.take_batch()
+    assert sorted(first + second) == ["2401", "2402", "2403"]
+
+    sync.sync(first)
+    sync.sync(second)
+    assert connection.entries[dn("2401")]["sn"] == ["ldap 2401"]
+    assert connection.entries[dn("2401")]["l"] == ["Tent"]
+    assert "l" not in connection.entries[dn("2402")]
+    # entries of extensions which aren't public are removed
+    assert dn("2403") not in connection.entries
+
+
+def test_retry_backoff(
+    sync: LDAPSync, connection: StubConnection, extensions, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "LDAP_SYNC_RETRY_BACKOFF", 10)
+    monkeypatch.setattr(settings, "LDAP_SYNC_MAX_BACKOFF", 25)
+    connection.failing.add("2402")
+
+    delays = []
+    for _ in range(3):
+        start = time.monotonic()
+        sync.sync(["2401", "2402"])
+        delays.append(sync.pending["2402"] - start)
+        del sync.pending["2402"]
+
+    # only the failed entry is retried, the delay doubles up to the maximum
+    assert dn("2401") in connection.entries
+    assert [round(delay) for delay in delays] == [10, 20, 25]
+    assert sync.attempts == {"2402": 3}
+
+    connection.failing.clear()
+    sync.sync(["2402"])
+    assert sync.attempts == {}
+    assert dn("2402") in connection.entries
+
+
+def test_failed_batch_is_retried(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "LDAP_SYNC_BATCH_DELAY", 0)
+    monkeypatch.setattr(settings, "LDAP_SYNC_RETRY_BACKOFF", 60)
+
+    def unavailable():
+        raise ConnectionError("No ldap connection available")
+
+    pool = SimpleNamespace(acquire=unavailable)
+    monkeypatch.setattr(LDAPPool, "instance", lambda: pool)
+
+    sync = LDAPSync()
+    sync.start(db.get_bind())
+    sync.enqueue(["2401", "2402"])
+    for _ in range(500):
+        if len(sync.attempts) == 2:
+            break
+        time.sleep(0.01)
+    sync.stop()
+
+    # the whole batch waits for the next attempt
+    assert sync.attempts == {"2401": 1, "2402": 1}
+    assert sorted(sync.pending) == ["2401", "2402"]
+
+
+def test_reconcile(
+    sync: LDAPSync, connection: StubConnection, extensions, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "LDAP_RECONCILE_PAGE_SIZE", 2)
+    monkeypatch.setattr(settings, "SCHEDULER_LEADER_ELECTION", False)
+    connection.entries = {
+        dn("2401"): {"sn": ["ldap 2401"], "l": ["Tent"]},
+        dn("2402"): {"sn": ["renamed"]},
+        dn("2403"): {"sn": ["ldap 2403"]},
+    }
+
+    sync.reconcile()
+    assert connection.page_sizes == [2]
+    # changed, private and missing entries are queued, matching ones aren't
+    assert {"2402", "2403", "2404"} <= sync.pending.keys()
+    assert "2401" not in sync.pending
+
+    while sync.pending:
+        sync.sync(sync.take_batch())
+    assert connection.entries[dn("2402")]["sn"] == ["ldap 2402"]
+    assert dn("2403") not in connection.entries
+    assert dn("2404") in connection.entries
+
+
+def test_reconcile_stops_without_lease(
+    sync: LDAPSync, connection: StubConnection, extensions, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "SCHEDULER_LEADER_ELECTION", True)
+    monkeypatch.setattr(LeaderElection.instance(), "leader_until", 0.0)
+    connection.entries = {dn("2402"): {"sn": ["renamed"]}}
+
+    # another worker may reconcile by now, nothing is queued
+    with pytest.raises(LeaderLost):
+        sync.reconcile()
+    assert sync.pending == {}
@@ -0,0 +1,110 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from types import SimpleNamespace
+
+from fastapi import Request
+import pytest
+from sqlmodel import create_engine
+
+from app.core import ratelimit
+from app.core.config import settings
+from app.core.ratelimit import (
+    DatabaseRateLimitBackend,
+    RateLimiter,
+    RateLimitExceeded,
+    get_client_address,
+)
+
+WINDOW = 60
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    """
+    replaces the time used by the rate limiter, starts at the beginning of
+    a window
+    """
+    clock = SimpleNamespace(now=1000 * WINDOW)
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    return clock
+
+
+def make_request(client: str, forwarded: str | None = None) -> Request:
+    headers = [] if forwarded is None else [(b"x-forwarded-for", forwarded.encode())]
+    return Request(
+        {"type": "http", "client": (client, 1234), "headers": headers},
+    )
+
+
+def test_limit_exceeded(clock) -> None:
+    limiter = RateLimiter()
+    for _ in range(3):
+        limiter.check("test", "key", 3, WINDOW)
+
+    with pytest.raises(RateLimitExceeded) as exc:
+        limiter.check("test", "key", 3, WINDOW)
+    assert exc.value.retry_after == WINDOW
+
+    # other keys are counted on their own
+    limiter.check("test", "other", 3, WINDOW)
+
+
+def test_sliding_window(clock) -> None:
+    limiter = RateLimiter()
+    for _ in range(4):
+        limiter.check("test", "key", 4, WINDOW)
+
+    # half of the previous window is still covered, it counts for 2 requests
+    clock.now += WINDOW * 1.5
+    for _ in range(2):
+        limiter.check("test", "key", 4, WINDOW)
+    with pytest.raises(RateLimitExceeded):
+        limiter.check("test", "key", 4, WINDOW)
+
+    # the counters of old windows are removed
+    clock.now += WINDOW * 2
+    limiter.cleanup()
+    assert limiter.backend.counters == {}
+
+
+def test_database_backend(clock) -> None:
+    engine = create_engine(str(settings.SQLALCHEMY_TEST_DATABASE_URI))
+    limiter = RateLimiter()
+    limiter.backend = DatabaseRateLimitBackend(engine)
+
+    for _ in range(2):
+        limiter.check("test-db", "key", 2, WINDOW)
+    with pytest.raises(RateLimitExceeded):
+        limiter.check("test-db", "key", 2, WINDOW)
+
+    clock.now += WINDOW
+    assert limiter.backend.hit("test-db:key", 1001) == (3, 1)
+
+    clock.now += WINDOW * 2
+    limiter.cleanup()
+    assert limiter.backend.hit("test-db:key", 1001) == (0, 1)
+    engine.dispose()
+
+
+def test_client_address(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "TRUSTED_PROXIES", ["10.0.0.0/8"])
+
+    # the header of untrusted clients is ignored
+    request = make_request("192.0.2.1", "198.51.100.1")
+    assert get_client_address(request) == "192.0.2.1"
+
+    # the last address which isn't a trusted proxy is the client, the first
+    # one may have been sent by the client itself
+    request = make_request("10.0.0.2", "198.51.100.1, 192.0.2.7, 10.0.0.1")
+    assert get_client_address(request) == "192.0.2.7"
+
+    assert get_client_address(make_request("10.0.0.2")) == "10.0.0.2"
+    assert get_client_address(make_request("testclient", "192.0.2.7")) == (
+        "testclient"
+    )
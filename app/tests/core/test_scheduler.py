@@ -0,0 +1,121 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections.abc import Generator
+import time
+
+import pytest
+from sqlmodel import Session
+
+from app.core import scheduler
+from app.core.config import settings
+from app.core.scheduler import LeaderElection, leader_job
+from app.models.crud import scheduler as crud_scheduler
+from app.models.crud.scheduler import acquire_job_lease, release_job_lease
+from app.models.scheduler import JobLease
+
+
+@pytest.fixture()
+def lease(db: Session, request) -> Generator[str, None, None]:
+    name = f"test-{request.node.name}"[:64]
+    yield name
+
+    db.expire_all()
+    job_lease = db.get(JobLease, name)
+    if job_lease is not None:
+        db.delete(job_lease)
+        db.commit()
+
+
+def as_worker(monkeypatch, holder: str):
+    monkeypatch.setattr(crud_scheduler, "HOLDER", holder)
+
+
+def test_acquire_and_renew(db: Session, lease: str, monkeypatch) -> None:
+    as_worker(monkeypatch, "first")
+    assert acquire_job_lease(db, lease, 30)
+    expires = db.get(JobLease, lease).expires
+
+    # the holder renews the lease, other workers can't take it
+    assert acquire_job_lease(db, lease, 60)
+    db.expire_all()
+    assert db.get(JobLease, lease).expires > expires
+
+    as_worker(monkeypatch, "second")
+    assert not acquire_job_lease(db, lease, 30)
+    db.expire_all()
+    assert db.get(JobLease, lease).holder == "first"
+
+
+def test_failover(db: Session, lease: str, monkeypatch) -> None:
+    # the lease of a worker which stopped renewing it expires
+    as_worker(monkeypatch, "first")
+    assert acquire_job_lease(db, lease, -1)
+
+    as_worker(monkeypatch, "second")
+    assert acquire_job_lease(db, lease, 30)
+    as_worker(monkeypatch, "first")
+    assert not acquire_job_lease(db, lease, 30)
+
+
+def test_release(db: Session, lease: str, monkeypatch) -> None:
+    as_worker(monkeypatch, "first")
+    assert acquire_job_lease(db, lease, 30)
+
+    # only the holder can release the lease
+    as_worker(monkeypatch, "second")
+    release_job_lease(db, lease)
+    assert not acquire_job_lease(db, lease, 30)
+
+    as_worker(monkeypatch, "first")
+    release_job_lease(db, lease)
+    as_worker(monkeypatch, "second")
+    assert acquire_job_lease(db, lease, 30)
+
+
+def test_election(db: Session, lease: str, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "SCHEDULER_LEADER_ELECTION", True)
+    monkeypatch.setattr(scheduler, "LEASE_NAME", lease)
+    first, second = LeaderElection(), LeaderElection()
+    first.engine = second.engine = db.get_bind()
+
+    as_worker(monkeypatch, "first")
+    first.elect()
+    as_worker(monkeypatch, "second")
+    second.elect()
+    assert first.is_leader()
+    assert not second.is_leader()
+
+    # the lease is released on shutdown, the next worker takes over right away
+    as_worker(monkeypatch, "first")
+    first.stop()
+    assert not first.is_leader()
+    as_worker(monkeypatch, "second")
+    second.elect()
+    assert second.is_leader()
+
+
+def test_job_stops_without_lease(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "SCHEDULER_LEADER_ELECTION", True)
+    election = LeaderElection.instance()
+    monkeypatch.setattr(election, "leader_until", time.monotonic() + 30)
+
+    steps = []
+
+    def job():
+        for step in range(3):
+            election.check_leader()
+            steps.append(step)
+            # the lease runs out while the job is running
+            election.leader_until = 0.0
+
+    leader_job("test_fencing", job)()
+    assert steps == [0]
+
+    # workers which don't hold the lease don't start the job
+    leader_job("test_fencing", job)()
+    assert steps == [0]
@@ -0,0 +1,57 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.state import SharedState
+from app.models.crud.user import UserCache, get_user_by_username
+
+
+def test_invalidation_reaches_other_workers(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "USER_CACHE_TTL", 30)
+    monkeypatch.setattr(settings, "USER_CACHE_SYNC_INTERVAL", 0)
+    user = get_user_by_username(db, settings.DEFAULT_ROOT_USER)
+
+    # both caches use the same shared state, like two workers
+    worker, other_worker = UserCache(), UserCache()
+    version = worker.version(user.id)
+    worker.put(user, version)
+    assert worker.get(user.id, version).username == user.username
+
+    other_worker.invalidate(user.id)
+    assert worker.get(user.id, worker.version(user.id)) is None
+
+    # copies loaded after the invalidation are cached again
+    version = worker.version(user.id)
+    worker.put(user, version)
+    assert worker.get(user.id, version) is not None
+
+
+def test_versions_are_read_once_per_interval(db: Session, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "USER_CACHE_TTL", 30)
+    monkeypatch.setattr(settings, "USER_CACHE_SYNC_INTERVAL", 60)
+    user = get_user_by_username(db, settings.DEFAULT_ROOT_USER)
+
+    reads = []
+    items = SharedState.instance().items
+    monkeypatch.setattr(
+        SharedState.instance(),
+        "items",
+        lambda namespace: reads.append(namespace) or items(namespace),
+    )
+
+    cache = UserCache()
+    cache.put(user, cache.version(user.id))
+    for _ in range(10):
+        assert cache.get(user.id, cache.version(user.id)) is not None
+    assert len(reads) == 1
+
+    # invalidations of this worker apply right away
+    cache.invalidate(user.id)
+    assert cache.get(user.id, cache.version(user.id)) is None
+    assert len(reads) == 1
@@ -0,0 +1,135 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import multiprocessing
+import os
+import secrets
+from types import SimpleNamespace
+
+from pydantic import ValidationError
+import pytest
+from sqlmodel import create_engine
+
+# spawned workers import this module first, the models have to be loaded
+# before the scheduler like in app.main
+import app.models  # noqa: F401
+from app.core.config import Settings, settings
+from app.core.ratelimit import DatabaseRateLimitBackend
+from app.core.scheduler import LeaderElection
+from app.core.state import DatabaseStateBackend, SharedState
+
+WORKERS = 4
+
+
+def run_worker(number: int, barrier) -> dict:
+    """
+    behaves like the startup of a worker process, all workers start at the
+    same time
+    """
+    engine = create_engine(str(settings.SQLALCHEMY_TEST_DATABASE_URI))
+    state = SharedState()
+    state.backend = DatabaseStateBackend(engine)
+
+    election = LeaderElection()
+    election.engine = engine
+    settings.SCHEDULER_LEADER_ELECTION = True
+
+    barrier.wait()
+    token = state.add("test", "token", secrets.token_urlsafe(32))
+    state.set("test", f"worker-{number}", number)
+    election.elect()
+
+    barrier.wait()
+    result = {
+        "token": token,
+        "items": state.items("test"),
+        "leader": election.is_leader(),
+    }
+
+    barrier.wait()
+    election.stop()
+    engine.dispose()
+    return result
+
+
+def test_workers_share_state() -> None:
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    barrier = manager.Barrier(WORKERS)
+
+    with context.Pool(WORKERS) as pool:
+        results = pool.starmap(
+            run_worker, [(number, barrier) for number in range(WORKERS)]
+        )
+
+    # every worker uses the value added first
+    assert len({result["token"] for result in results}) == 1
+
+    # every worker sees the entries of all workers
+    expected = {f"worker-{number}": number for number in range(WORKERS)}
+    for result in results:
+        assert {
+            key: value
+            for key, value in result["items"].items()
+            if key.startswith("worker-")
+        } == expected
+
+    # exactly one worker runs the background jobs
+    assert sum(result["leader"] for result in results) == 1
+
+
+def test_leader_failover() -> None:
+    engine = create_engine(str(settings.SQLALCHEMY_TEST_DATABASE_URI))
+    leader = LeaderElection()
+    leader.engine = engine
+    leader.elect()
+    assert leader.is_leader()
+
+    # another process can't take the lease while it is held
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    with context.Pool(1) as pool:
+        assert not pool.apply(run_worker, (0, manager.Barrier(1)))["leader"]
+
+    # after the leader released its lease the next worker takes over
+    leader.stop()
+    with context.Pool(1) as pool:
+        assert pool.apply(run_worker, (0, manager.Barrier(1)))["leader"]
+
+    engine.dispose()
+
+
+def test_workers_require_shared_settings() -> None:
+    shared = {
+        "SECRET_KEY": "this-is-not-secret",
+        "STATE_BACKEND": "database",
+        "RATE_LIMIT_BACKEND": "database",
+    }
+    assert Settings(_env_file=None, WORKERS=4, **shared).WORKERS == 4
+
+    # the workers would sign tokens with different keys
+    if "UURU_SECRET_KEY" not in os.environ:
+        with pytest.raises(ValidationError):
+            Settings(
+                _env_file=None,
+                WORKERS=4,
+                STATE_BACKEND="database",
+                RATE_LIMIT_BACKEND="database",
+            )
+
+    for name in ("STATE_BACKEND", "RATE_LIMIT_BACKEND"):
+        with pytest.raises(ValidationError):
+            Settings(_env_file=None, WORKERS=4, **{**shared, name: "memory"})
+
+
+def test_unsupported_database_is_rejected() -> None:
+    # the shared backends rely on upserts, fail on startup instead of with
+    # the first request
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="oracle"))
+    for backend in (DatabaseStateBackend, DatabaseRateLimitBackend):
+        with pytest.raises(RuntimeError):
+            backend(engine)
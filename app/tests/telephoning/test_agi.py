@@ -0,0 +1,86 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.telephoning.agi import AGIChannel, FastAGIServer
+
+
+@pytest.fixture()
+def agi_settings(monkeypatch):
+    monkeypatch.setattr(settings, "FASTAGI_ENABLED", True)
+    monkeypatch.setattr(settings, "FASTAGI_HOST", "127.0.0.1")
+    monkeypatch.setattr(settings, "FASTAGI_PORT", 0)
+    monkeypatch.setattr(settings, "FASTAGI_ALLOWED_NETWORKS", ["127.0.0.0/8"])
+    monkeypatch.setattr(settings, "FASTAGI_SECRET", "secret")
+
+
+async def call_script(script: str) -> tuple[list[dict[str, str]], list[str]]:
+    """
+    starts a server with a test script and calls the given script like
+    asterisk does, returns the environments the script was called with and
+    the commands sent to asterisk
+    """
+    calls = []
+
+    async def handler(channel: AGIChannel):
+        calls.append(channel.env)
+        await channel.answer()
+
+    server = FastAGIServer()
+    server.register("test", handler)
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    commands = []
+    try:
+        writer.write(
+            (
+                f"agi_network_script: {script}\n"
+                "agi_callerid: 4711\n"
+                "agi_extension: 1234\n"
+                "\n"
+            ).encode()
+        )
+        await writer.drain()
+
+        while line := await reader.readline():
+            commands.append(line.decode().strip())
+            writer.write(b"200 result=0\n")
+            await writer.drain()
+    except ConnectionError:
+        # rejected connections are closed right away
+        pass
+
+    writer.close()
+    await server.stop()
+    return calls, commands
+
+
+def test_valid_secret(agi_settings) -> None:
+    calls, commands = asyncio.run(call_script("test?secret=secret"))
+    assert len(calls) == 1
+    assert calls[0]["agi_callerid"] == "4711"
+    assert commands == ["ANSWER"]
+
+
+def test_invalid_secret(agi_settings) -> None:
+    for script in ("test", "test?secret=guess"):
+        calls, commands = asyncio.run(call_script(script))
+        assert calls == []
+        assert commands == ["HANGUP"]
+
+
+def test_unknown_network(agi_settings, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "FASTAGI_ALLOWED_NETWORKS", ["192.0.2.0/24"])
+    calls, commands = asyncio.run(call_script("test?secret=secret"))
+    assert calls == []
+    assert commands == []
@@ -0,0 +1,141 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections.abc import Generator
+from threading import Event, Thread
+import time
+
+import pytest
+
+from app.telephoning.omm import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    OMMTimeout,
+    OMMWorker,
+)
+
+
+class StubClient(object):
+    def __init__(self):
+        self.calls: list[str] = []
+        # blocks the requests which wait for it until set
+        self.release = Event()
+        self.blocked = Event()
+
+    def block(self):
+        self.blocked.set()
+        assert self.release.wait(5)
+
+    def record(self, name: str) -> str:
+        self.calls.append(name)
+        return name
+
+
+@pytest.fixture()
+def client() -> StubClient:
+    return StubClient()
+
+
+@pytest.fixture()
+def worker(client: StubClient) -> Generator[OMMWorker, None, None]:
+    connections = []
+
+    def connect():
+        connections.append(client)
+        return client
+
+    worker = OMMWorker(connect)
+    worker.connections = connections
+    yield worker
+
+    client.release.set()
+    worker.stop(5)
+
+
+def call_in_background(worker: OMMWorker, *args, **kwargs) -> Thread:
+    thread = Thread(target=worker.call, args=args, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(worker: OMMWorker, size: int):
+    for _ in range(500):
+        if worker.queue.qsize() == size:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"queue didn't reach {size} requests")
+
+
+def test_interactive_requests_first(worker: OMMWorker, client: StubClient) -> None:
+    blocker = call_in_background(worker, "block", lambda omm: omm.block())
+    assert client.blocked.wait(5)
+
+    background = call_in_background(
+        worker, "background", lambda omm: omm.record("background")
+    )
+    wait_for_queue(worker, 1)
+    interactive = call_in_background(
+        worker,
+        "interactive",
+        lambda omm: omm.record("interactive"),
+        priority=PRIORITY_INTERACTIVE,
+    )
+    wait_for_queue(worker, 2)
+
+    client.release.set()
+    for thread in (blocker, background, interactive):
+        thread.join(5)
+    assert client.calls == ["interactive", "background"]
+
+
+def test_queued_request_is_cancelled(worker: OMMWorker, client: StubClient) -> None:
+    call_in_background(worker, "block", lambda omm: omm.block())
+    assert client.blocked.wait(5)
+
+    with pytest.raises(OMMTimeout):
+        worker.call("late", lambda omm: omm.record("late"), timeout=0.1)
+
+    client.release.set()
+    assert worker.call("next", lambda omm: omm.record("next"), timeout=5) == "next"
+    # the request which timed out in the queue never ran
+    assert client.calls == ["next"]
+
+
+def test_running_request_is_reconciled(worker: OMMWorker, client: StubClient) -> None:
+    reconciled = []
+    done = Event()
+
+    def reconcile(result):
+        reconciled.append(result)
+        done.set()
+
+    def slow(omm):
+        omm.block()
+        return omm.record("slow")
+
+    with pytest.raises(OMMTimeout):
+        worker.call(
+            "slow", slow, PRIORITY_BACKGROUND, timeout=0.5, reconcile=reconcile
+        )
+    assert client.blocked.is_set()
+
+    # the request finishes after the caller gave up, its result isn't lost
+    client.release.set()
+    assert done.wait(5)
+    assert reconciled == ["slow"]
+
+
+def test_reconnect_after_connection_error(
+    worker: OMMWorker, client: StubClient
+) -> None:
+    def fail(omm):
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        worker.call("fail", fail, timeout=5)
+    assert worker.call("next", lambda omm: omm.record("next"), timeout=5) == "next"
+    assert len(worker.connections) == 2
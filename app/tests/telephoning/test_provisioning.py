@@ -0,0 +1,87 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections.abc import Generator
+
+from fastapi import HTTPException, status
+import pytest
+from sqlmodel import Session
+from starlette.requests import Request
+
+from app.models.extension import Extension
+from app.models.media import ExtensionMedia, Media, MediaType
+from app.telephoning import provisioning as provisioning_module
+from app.telephoning.phonetypes.innovaphone import Innovaphone
+
+MAC = "00-11-22-33-44-55"
+
+
+def provisioning_request(etag: str | None = None) -> Request:
+    headers = [] if etag is None else [(b"if-none-match", etag.encode())]
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+@pytest.fixture()
+def provisioning(
+    db: Session, monkeypatch
+) -> Generator[provisioning_module.Provisioning, None, None]:
+    monkeypatch.setattr(provisioning_module, "engine", db.get_bind())
+
+    extension = Extension(
+        extension="4711",
+        name="provisioning",
+        type="Innovaphone 112",
+        token="token",
+        password="password",
+        info="",
+        extra_fields={"mac": MAC},
+    )
+    db.add(extension)
+    db.commit()
+
+    flavor = Innovaphone()
+    yield provisioning_module.Provisioning(flavor)
+
+    flavor.stop()
+    for assigned in extension.assigned_media:
+        db.delete(assigned)
+        db.delete(assigned.media)
+    db.delete(extension)
+    db.commit()
+
+
+def test_lookup_and_etag(provisioning: provisioning_module.Provisioning) -> None:
+    response = provisioning.respond(provisioning_request(), MAC)
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers["etag"]
+
+    # other spellings of the mac find the same phone
+    response = provisioning.respond(provisioning_request(etag), "00:11:22:33:44:55")
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    with pytest.raises(HTTPException) as error:
+        provisioning.respond(provisioning_request(), "00-11-22-33-44-66")
+    assert error.value.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_assigned_media_changes_config(
+    db: Session, provisioning: provisioning_module.Provisioning
+) -> None:
+    response = provisioning.respond(provisioning_request(), MAC)
+    etag = response.headers["etag"]
+    assert b"bg-image" not in response.body
+
+    extension = db.get(Extension, "4711")
+    media = Media(name="background", type=MediaType.IMAGE, stored_as="0" * 64)
+    db.add(ExtensionMedia(name="background_image", media=media, extension=extension))
+    db.commit()
+
+    # neither the cached file nor a 304 is sent after the media was assigned
+    response = provisioning.respond(provisioning_request(etag), MAC)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+    assert b"bg-image" in response.body
@@ -0,0 +1,125 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from collections.abc import Generator
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.core.db import engine_asterisk
+from app.models.asterisk import PSEndpoint
+from app.models.websip import WebSIPSession, WebSIPStatus
+from app.telephoning.websip import SESSION_TIMEOUT, WebSIPManager
+
+
+@pytest.fixture()
+def session_asterisk() -> Generator[Session, None, None]:
+    with Session(engine_asterisk) as session_asterisk:
+        yield session_asterisk
+
+
+@pytest.fixture()
+def manager(
+    db: Session, session_asterisk: Session, monkeypatch
+) -> Generator[WebSIPManager, None, None]:
+    monkeypatch.setattr(settings, "WEBSIP_WARM_POOL_SIZE", 0)
+    manager = WebSIPManager()
+    manager.setup(db)
+    yield manager
+
+    manager.teardown(db, session_asterisk)
+
+
+def get_status(db: Session, extension: str) -> WebSIPStatus:
+    db.expire_all()
+    return db.get(WebSIPSession, extension).status
+
+
+def test_create_and_delete(
+    db: Session, session_asterisk: Session, manager: WebSIPManager
+) -> None:
+    first = manager.create_extension(db, session_asterisk)
+    second = manager.create_extension(db, session_asterisk)
+    assert first.extension != second.extension
+    assert get_status(db, first.extension) == WebSIPStatus.ACTIVE
+    assert session_asterisk.get(PSEndpoint, first.extension) is not None
+
+    manager.delete_extension(db, session_asterisk, first.extension)
+    assert get_status(db, first.extension) == WebSIPStatus.FREE
+    session_asterisk.expire_all()
+    assert session_asterisk.get(PSEndpoint, first.extension) is None
+
+    # the number is handed out again
+    assert manager.create_extension(db, session_asterisk).extension == (
+        first.extension
+    )
+
+
+def test_warm_pool(
+    db: Session, session_asterisk: Session, manager: WebSIPManager, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "WEBSIP_WARM_POOL_SIZE", 2)
+    manager.fill_warm_pool(db, session_asterisk)
+    warm = db.exec(
+        select(WebSIPSession.extension).where(
+            WebSIPSession.status == WebSIPStatus.WARM
+        )
+    ).all()
+    assert len(warm) == 2
+
+    # warm endpoints are handed out first and only get new credentials
+    extension = manager.create_extension(db, session_asterisk)
+    assert extension.extension in warm
+    session_asterisk.expire_all()
+    endpoint = session_asterisk.get(PSEndpoint, extension.extension)
+    assert endpoint.callerid.startswith("Anonymous (Web)")
+
+    manager.count_sessions(db)
+    assert manager.stats()["sessions"]["warm"] == 1
+    assert manager.stats()["sessions"]["active"] == 1
+
+
+def test_sweep(db: Session, session_asterisk: Session, manager: WebSIPManager) -> None:
+    expired = manager.create_extension(db, session_asterisk)
+    active = manager.create_extension(db, session_asterisk)
+
+    websip_session = db.get(WebSIPSession, expired.extension)
+    websip_session.last_seen = datetime.now() - timedelta(seconds=SESSION_TIMEOUT + 1)
+    db.add(websip_session)
+    db.commit()
+
+    manager.sweep(db, session_asterisk)
+    assert get_status(db, expired.extension) == WebSIPStatus.FREE
+    assert get_status(db, active.extension) == WebSIPStatus.ACTIVE
+    assert manager.stats()["last_sweep_expired"] == 1
+    assert manager.stats()["expired_total"] == 1
+
+
+def test_range_change(
+    db: Session, session_asterisk: Session, manager: WebSIPManager, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "WEBSIP_EXTENSION_RANGE", (9950, 9999))
+    manager.setup(db)
+
+    # unused numbers of the previous range are removed and never handed out
+    assert db.get(WebSIPSession, "9900") is None
+    assert int(manager.create_extension(db, session_asterisk).extension) >= 9950
+
+
+def test_unknown_extension(db: Session, manager: WebSIPManager) -> None:
+    with pytest.raises(LookupError):
+        manager.refresh_extension(db, "9900")
+    with pytest.raises(LookupError):
+        manager.get_extension(db, "9900")
+
+
+def test_refresh_unknown_extension(client: TestClient) -> None:
+    r = client.put(f"{settings.API_V1_STR}/telephoning/websip?extension=1")
+    assert r.status_code == 404
@@ -5,21 +5,34 @@ Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
 Licensed under the MIT license. See LICENSE file in the project root for details.
 """
 
+from email.utils import formatdate
+import glob
+import hashlib
+from logging import getLogger
 import os
 from typing import Generator
 import filetype
 
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse
 from PIL import Image
 import sox
 import tempfile
 
 from app.core.config import settings
+from app.core.metrics import MEDIA_CONVERSION_SECONDS
 from app.models.media import AudioFormat, ImageFormat, Media, MediaType
 
+logger = getLogger(__name__)
 
 SUPPORTED_IMAGE_FORMATS = ["avif", "bmp", "gif", "jpeg", "png", "tiff", "webp"]
 SUPPORTED_AUDIO_FORMATS = ["gsm", "wav", "ogg", "mp3", "flac"]
 
+# size of the chunks yielded when a converted file has to be streamed
+STREAM_CHUNK_SIZE = 64 * 1024
+# length of the format digest in the names of renditions
+RENDITION_DIGEST_LENGTH = 16
+
 
 def human_readable_filesize(num_bytes) -> str:
     """
@@ -91,10 +104,11 @@ def convert_audio(
     return tfm.build(source_path, target_path)
 
 
-def get_converted_stream(
-    media: Media, format: AudioFormat | ImageFormat | None
-) -> Generator[any, any, any]:
-    # check if format is matching for media type
+def check_format(media: Media, format: AudioFormat | ImageFormat | None):
+    """
+    raises a RuntimeError if the given format can not be applied to the
+    type of the given media
+    """
     if (
         (media.type == MediaType.AUDIO and not isinstance(format, AudioFormat))
         or (media.type == MediaType.IMAGE and not isinstance(format, ImageFormat))
@@ -102,19 +116,160 @@ def get_converted_stream(
     ):
         raise RuntimeError("Given media and flavor do not match!")
 
-    suffix = ""
-    if format is not None:
-        suffix = "." + format.out_type
 
-    source_path = os.path.join(settings.MEDIA_PATH, media.stored_as)
+def get_mime_type(media: Media, format: AudioFormat | ImageFormat | None) -> str:
+    """
+    returns the mime type of the media when delivered in the given format,
+    if no format is given the storage format of the media is used
+    """
     if media.type == MediaType.RAW:
-        with open(source_path, "rb") as tmp:
-            yield from tmp
+        return "application/octet-stream"
+
+    out_type = format.out_type if format is not None else None
+    if out_type is None:
+        out_type = os.path.splitext(media.stored_as)[1].lstrip(".")
+
+    return f"{media.type.value}/{out_type}"
+
+
+def get_stored_path(media: Media) -> str:
+    """
+    returns the path of the file in which the media is stored
+    """
+    return os.path.join(settings.MEDIA_PATH, media.stored_as)
+
 
-    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+def get_rendition_directory() -> str:
+    return os.path.join(settings.MEDIA_PATH, settings.MEDIA_RENDITION_DIRECTORY)
+
+
+def get_rendition_path(media: Media, format: AudioFormat | ImageFormat) -> str:
+    """
+    returns the path where the media converted to the given format is
+    cached. The name is derived from the stored file and the format so that
+    every combination is converted only once. The whole name of the stored
+    file is used, the same content may be stored in several formats.
+    """
+    digest = hashlib.sha256(format.model_dump_json().encode()).hexdigest()[
+        :RENDITION_DIGEST_LENGTH
+    ]
+    return os.path.join(
+        get_rendition_directory(), f"{media.stored_as}.{digest}.{format.out_type}"
+    )
+
+
+def convert(
+    media: Media, source_path: str, target_path: str, format: AudioFormat | ImageFormat
+):
+    with MEDIA_CONVERSION_SECONDS.time(type=media.type.value):
         if media.type == MediaType.IMAGE:
-            convert_image(source_path, tmp.name, format)
+            convert_image(source_path, target_path, format)
         elif media.type == MediaType.AUDIO:
-            convert_audio(source_path, tmp.name, format)
+            convert_audio(source_path, target_path, format)
+
+
+def get_rendition(media: Media, format: AudioFormat | ImageFormat | None) -> str:
+    """
+    returns the path of a file containing the media in the given format.
+    RAW media and media without format are served from the stored file,
+    everything else is converted once and cached in the rendition directory.
+    """
+    check_format(media, format)
+
+    source_path = get_stored_path(media)
+    if media.type == MediaType.RAW or format is None:
+        return source_path
+
+    target_path = get_rendition_path(media, format)
+    if os.path.isfile(target_path):
+        return target_path
+
+    os.makedirs(get_rendition_directory(), exist_ok=True)
+
+    # convert into a temporary file next to the target and move it in place
+    # afterwards, so concurrent requests never see a partially written file
+    fd, tmp_path = tempfile.mkstemp(
+        suffix=f".{format.out_type}", dir=get_rendition_directory()
+    )
+    os.close(fd)
+    try:
+        convert(media, source_path, tmp_path, format)
+        os.replace(tmp_path, target_path)
+    except Exception:
+        logger.exception(f"Failed to convert media {media.id} to {format}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return target_path
+
+
+def delete_renditions(media: Media):
+    """
+    removes all cached renditions of the given media
+    """
+    # only match the digest of the format, a raw file named by the hash alone
+    # must not match the renditions of the same content stored as an image
+    digest = "[0-9a-f]" * RENDITION_DIGEST_LENGTH
+    pattern = f"{glob.escape(media.stored_as)}.{digest}.*"
+    for path in glob.glob(os.path.join(get_rendition_directory(), pattern)):
+        os.remove(path)
+
+
+def get_converted_stream(
+    media: Media, format: AudioFormat | ImageFormat | None
+) -> Generator[bytes, None, None]:
+    """
+    converts the media into the given format and yields the result in chunks
+    of STREAM_CHUNK_SIZE bytes. This is used if renditions are not cached.
+    """
+    check_format(media, format)
+
+    source_path = get_stored_path(media)
+    if media.type == MediaType.RAW:
+        with open(source_path, "rb") as source:
+            yield from iter(lambda: source.read(STREAM_CHUNK_SIZE), b"")
+        return
+
+    with tempfile.NamedTemporaryFile(suffix="." + format.out_type) as tmp:
+        convert(media, source_path, tmp.name, format)
+        yield from iter(lambda: tmp.read(STREAM_CHUNK_SIZE), b"")
+
+
+def get_etag(path: str) -> str:
+    stat = os.stat(path)
+    tag = hashlib.md5(
+        f"{stat.st_mtime}-{stat.st_size}".encode(), usedforsecurity=False
+    ).hexdigest()
+    return f'"{tag}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
+
+
+def media_file_response(request: Request, path: str, media_type: str) -> Response:
+    """
+    creates a response for a file on disk. Conditional requests are answered
+    with 304 Not Modified, everything else is handled by FileResponse which
+    supports range requests and sendfile (where the server supports it)
+    """
+    etag = get_etag(path)
+    headers = {
+        "etag": etag,
+        "cache-control": f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}",
+    }
+
+    if is_not_modified(request, etag):
+        headers["last-modified"] = formatdate(os.stat(path).st_mtime, usegmt=True)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-        yield from tmp
+    return FileResponse(path, media_type=media_type, headers=headers)
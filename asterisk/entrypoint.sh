@@ -8,6 +8,11 @@ export UURU_ASTERISK_AMI_PASS="${UURU_ASTERISK_AMI_PASS:-uuru_ami_secret}"
 export UURU_ASTERISK_AMI_ADDR="${UURU_ASTERISK_AMI_ADDR:-172.17.0.1}"
 export UURU_ASTERISK_AMI_PORT="${UURU_ASTERISK_AMI_PORT:-5038}"
 
+# uURU serves the AGI scripts (FastAGI)
+export UURU_AGI_HOST="${UURU_AGI_HOST:-127.0.0.1:4573}"
+# has to match UURU_FASTAGI_SECRET of uURU
+export UURU_AGI_SECRET="${UURU_AGI_SECRET:-}"
+
 # execute alembic database migrations
 cd /etc/alembic
 envsubst < config.ini.tmpl > config.ini
@@ -0,0 +1,100 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+
+Load test against a running instance, e.g.
+
+    locust -f benchmarks/locustfile.py --host http://127.0.0.1:8000 \\
+        --headless -u 50 -r 10 -t 2m --json > load-results.json
+
+Provisioning requests need Snom extensions with MACs in the form of
+benchmarks.util.mac_of(0..UURU_BENCHMARK_MACS).
+"""
+
+import os
+import random
+
+from locust import HttpUser, between, task
+
+API = os.environ.get("UURU_API_V1_STR", "/api/v1")
+TELEPHONING = os.environ.get("UURU_TELEPHONING_PREFIX", "/telephoning")
+USERNAME = os.environ.get("UURU_BENCHMARK_USER", "root")
+PASSWORD = os.environ.get("UURU_BENCHMARK_PASSWORD", "rootpasswd")
+MACS = int(os.environ.get("UURU_BENCHMARK_MACS", "0"))
+# extensions created by the load test, must not be used otherwise
+EXTENSIONS = range(
+    *map(int, os.environ.get("UURU_BENCHMARK_EXTENSIONS", "8000-9000").split("-"))
+)
+
+
+def mac_of(number: int) -> str:
+    return f"{number:012x}"
+
+
+class PhonebookUser(HttpUser):
+    """
+    anonymous clients and phones reading the phonebook and provisioning
+    """
+
+    weight = 5
+    wait_time = between(0.5, 2)
+
+    @task(5)
+    def phonebook(self):
+        self.client.get(f"{API}/extension/phonebook")
+
+    @task(2)
+    def phonebook_changes(self):
+        self.client.get(f"{API}/extension/phonebook/changes?since=0")
+
+    @task(3)
+    def provisioning(self):
+        if MACS == 0:
+            return
+
+        mac = mac_of(random.randrange(MACS))
+        self.client.get(
+            f"{TELEPHONING}/snom/snom-{mac}", name=f"{TELEPHONING}/snom/snom-[mac]"
+        )
+
+
+class ExtensionUser(HttpUser):
+    """
+    logged in users managing their extensions
+    """
+
+    weight = 1
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        self.client.post(
+            f"{API}/user/login", json={"username": USERNAME, "password": PASSWORD}
+        )
+
+    @task
+    def extension_lifecycle(self):
+        extension = str(random.choice(EXTENSIONS))
+
+        r = self.client.post(
+            f"{API}/extension/",
+            json={
+                "extension": extension,
+                "name": "Load test",
+                "info": "",
+                "public": True,
+                "type": "SIP",
+            },
+        )
+        if not r.ok:
+            return
+
+        self.client.patch(
+            f"{API}/extension/{extension}",
+            json={"name": "Load test updated", "public": True, "media": {}},
+            name=f"{API}/extension/[extension]",
+        )
+        self.client.delete(
+            f"{API}/extension/{extension}", name=f"{API}/extension/[extension]"
+        )
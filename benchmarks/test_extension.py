@@ -0,0 +1,147 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from itertools import count
+
+import pytest
+from sqlmodel import Session, delete
+
+from app.core.config import settings
+from app.models.crud.extension import (
+    create_extension,
+    delete_extension,
+    filter_extensions_by_name,
+    generate_free_extension,
+    get_extension_by_id,
+    update_extension,
+)
+from app.models.extension import (
+    Extension,
+    ExtensionBase,
+    ExtensionCreate,
+    ExtensionUpdate,
+)
+from app.models.user import User
+from app.telephoning.dialplan import Dial, Dialplan
+
+from benchmarks.util import populate
+
+pytest.importorskip("pytest_benchmark")
+
+numbers = count(1000)
+
+
+def next_extension() -> str:
+    return str(next(numbers) % 10**settings.EXTENSION_DIGITS).zfill(
+        settings.EXTENSION_DIGITS
+    )
+
+
+def new_extension(session, session_asterisk, user) -> Extension:
+    return create_extension(
+        session,
+        session_asterisk,
+        user,
+        ExtensionCreate(
+            extension=next_extension(),
+            name="Benchmark",
+            info="",
+            public=True,
+            type="SIP",
+        ),
+    )
+
+
+def test_create_extension(benchmark, session, session_asterisk, admin):
+    user = session.get(User, admin.id)
+
+    def setup():
+        data = ExtensionCreate(
+            extension=next_extension(),
+            name="Benchmark",
+            info="",
+            public=True,
+            type="SIP",
+        )
+        return (session, session_asterisk, user, data), {}
+
+    benchmark.pedantic(create_extension, setup=setup, rounds=200)
+
+
+def test_update_extension(benchmark, session, session_asterisk, admin):
+    user = session.get(User, admin.id)
+    extension = new_extension(session, session_asterisk, user)
+    names = count()
+
+    def setup():
+        # the frontend always sends the complete form
+        data = ExtensionUpdate(
+            name=f"Benchmark {next(names)}",
+            info="",
+            public=True,
+            unset_coordinates=False,
+            media={},
+        )
+        return (session, session_asterisk, user, extension, data), {}
+
+    benchmark.pedantic(update_extension, setup=setup, rounds=200)
+
+
+def test_delete_extension(benchmark, session, session_asterisk, admin):
+    user = session.get(User, admin.id)
+
+    def setup():
+        extension = new_extension(session, session_asterisk, user)
+        return (session, session_asterisk, user, extension), {}
+
+    benchmark.pedantic(delete_extension, setup=setup, rounds=200)
+
+
+def test_phonebook(benchmark, session, extensions):
+    def phonebook():
+        return [
+            ExtensionBase.model_validate(e).model_dump(mode="json")
+            for e in filter_extensions_by_name(session)
+        ]
+
+    result = benchmark.pedantic(phonebook, rounds=5)
+    assert len(result) == extensions - extensions // 5
+
+
+def test_phonebook_search(benchmark, session, extensions):
+    result = benchmark.pedantic(
+        filter_extensions_by_name, args=(session, None, "Benchmark 99"), rounds=5
+    )
+    assert result
+
+
+def test_get_extension_by_id(benchmark, session, extensions, rng):
+    numbers = [f"{rng.randrange(extensions):06d}" for _ in range(100)]
+
+    def lookup():
+        for number in numbers:
+            get_extension_by_id(session, number, public=False)
+
+    benchmark(lookup)
+
+
+@pytest.mark.parametrize("fill", [0.5, 0.9])
+def test_generate_free_extension(benchmark, engine, session, admin, fill):
+    # only numbers with EXTENSION_DIGITS digits block the number space
+    populate(engine, admin, int(10**settings.EXTENSION_DIGITS * fill))
+    try:
+        benchmark(generate_free_extension, session, None, "random")
+    finally:
+        session.exec(delete(Extension))
+        session.commit()
+
+
+def test_dialplan_store(benchmark, session_asterisk):
+    dialplan = Dialplan(exten="9999", context="pjsip_internal")
+    dialplan.add(Dial(devices=["${PJSIP_DIAL_CONTACTS(9999)}"]), 1)
+
+    benchmark(dialplan.store, session_asterisk)
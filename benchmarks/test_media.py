@@ -0,0 +1,52 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import shutil
+
+from PIL import Image
+import pytest
+
+from app.models.media import AudioFormat, ImageFormat
+from app.util.media import convert_audio, convert_image
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture(scope="module")
+def image(tmp_path_factory) -> str:
+    path = tmp_path_factory.mktemp("media") / "source.png"
+    Image.effect_noise((1024, 768), 64).convert("RGB").save(path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def audio(tmp_path_factory) -> str:
+    if shutil.which("sox") is None:
+        pytest.skip("sox is not installed")
+
+    import sox
+
+    path = tmp_path_factory.mktemp("media") / "source.wav"
+    tfm = sox.Transformer()
+    tfm.synth(10, "sine", 440)
+    tfm.build(input_filepath=None, output_filepath=str(path), input_duration=10)
+    return str(path)
+
+
+@pytest.mark.parametrize("out_type", ["png", "bmp"])
+def test_convert_image(benchmark, image, tmp_path, out_type):
+    target = str(tmp_path / f"target.{out_type}")
+    format = ImageFormat(out_type=out_type, width=320, height=240, colormode="RGB")
+
+    benchmark(convert_image, image, target, format)
+
+
+def test_convert_audio(benchmark, audio, tmp_path):
+    target = str(tmp_path / "target.mp3")
+    format = AudioFormat(out_type="mp3", samplerate=8000, channels=1, bitdepth=16)
+
+    benchmark.pedantic(convert_audio, args=(audio, target, format), rounds=5)
@@ -0,0 +1,98 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+import pytest
+from sqlmodel import Session, delete
+from starlette.requests import Request
+
+from app.models.crud.extension import get_extension_by_extra_field
+from app.models.extension import TemporaryExtensions
+from app.telephoning.omm import OMMWorker
+from app.telephoning.phonetypes.snom import Snom
+
+from benchmarks.util import StubOMMClient, mac_of
+
+pytest.importorskip("pytest_benchmark")
+
+
+def test_mac_lookup(benchmark, session, extensions, rng):
+    macs = [mac_of(rng.randrange(extensions)) for _ in range(3)]
+
+    def lookup():
+        for mac in macs:
+            assert get_extension_by_extra_field(session, "mac", mac) is not None
+
+    benchmark.pedantic(lookup, rounds=3)
+
+
+@pytest.fixture
+def provisioning(engine, monkeypatch):
+    """
+    provisioning of the Snom flavor on the benchmark database
+    """
+    provisioning = pytest.importorskip("app.telephoning.provisioning")
+    monkeypatch.setattr(provisioning, "engine", engine)
+    return provisioning.Provisioning(Snom())
+
+
+def provisioning_request(etag: str | None = None) -> Request:
+    headers = [] if etag is None else [(b"if-none-match", etag.encode())]
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+@pytest.mark.parametrize("conditional", [False, True])
+def test_provisioning(benchmark, provisioning, extensions, rng, conditional):
+    macs = [mac_of(rng.randrange(extensions)) for _ in range(3)]
+    etags = {
+        mac: provisioning.respond(provisioning_request(), mac).headers["etag"]
+        for mac in macs
+    }
+
+    def provision():
+        for mac in macs:
+            response = provisioning.respond(
+                provisioning_request(etags[mac] if conditional else None), mac
+            )
+            assert response.status_code == (304 if conditional else 200)
+
+    benchmark.pedantic(provision, rounds=10)
+
+
+@pytest.fixture
+def mitel_dect(engine, engine_asterisk, monkeypatch):
+    """
+    Mitel DECT flavor talking to a stubbed OMM
+    """
+    mitel_dect = pytest.importorskip("app.telephoning.phonetypes.mitel_dect")
+    monkeypatch.setattr(mitel_dect, "engine", engine)
+    monkeypatch.setattr(mitel_dect, "engine_asterisk", engine_asterisk)
+
+    flavor = mitel_dect.MitelDECT.__new__(mitel_dect.MitelDECT)
+    client = StubOMMClient()
+    flavor.omm = OMMWorker(lambda: client)
+    flavor.omm_interactive = OMMWorker(lambda: client, name="omm-interactive")
+    flavor.devices = {}
+    flavor.last_sync = 0.0
+
+    yield flavor
+
+    flavor.omm.stop()
+    flavor.omm_interactive.stop()
+    with Session(engine) as session:
+        session.exec(delete(TemporaryExtensions))
+        session.commit()
+
+
+@pytest.mark.parametrize("handsets", [10, 100])
+def test_dect_onboarding(benchmark, mitel_dect, handsets):
+    ppns = iter(range(10**9))
+
+    def setup():
+        mitel_dect.fill_pool(handsets)
+        return ([next(ppns) for _ in range(handsets)],), {}
+
+    benchmark.pedantic(mitel_dect.register_devices, setup=setup, rounds=10)
@@ -0,0 +1,99 @@
+"""
+uURU - Micro User Registration Utility
+
+Copyright (c) Ole Lange, Gregor Michels and contributors. All rights reserved.
+Licensed under the MIT license. See LICENSE file in the project root for details.
+"""
+
+from sqlalchemy import insert
+from sqlmodel import Session, delete
+
+from app.core.security import generate_extension_password, generate_extension_token
+from app.models.extension import Extension
+from app.models.user import User
+
+
+class StubLDAPSync(object):
+    def __init__(self):
+        self.queued = 0
+
+    def enqueue(self, extensions, delay=None):
+        self.queued += len(list(extensions))
+
+
+class StubAMIClient(object):
+    def login(self, *args, **kwargs):
+        pass
+
+    def logoff(self):
+        pass
+
+    def send_action(self, *args, **kwargs):
+        pass
+
+
+class StubOMMUser(object):
+    def __init__(self, uid: int, num: str):
+        self.uid = uid
+        self.num = num
+
+
+class StubOMMClient(object):
+    """
+    answers the OMM calls used by the Mitel DECT flavor without a network
+    """
+
+    def __init__(self):
+        self.users: dict[int, StubOMMUser] = {}
+        self.attached: dict[int, int] = {}
+
+    def create_user(self, num: str) -> StubOMMUser:
+        user = StubOMMUser(len(self.users) + 1, num)
+        self.users[user.uid] = user
+        return user
+
+    def set_user_sipauth(self, uid, username, password):
+        pass
+
+    def set_user_name(self, uid, name):
+        pass
+
+    def attach_user_device(self, uid, ppn):
+        self.attached[int(ppn)] = int(uid)
+
+    def detach_user_device_by_user(self, uid):
+        self.attached = {p: u for p, u in self.attached.items() if u != uid}
+
+    def delete_pp_user(self, uid):
+        self.users.pop(uid, None)
+
+
+def mac_of(number: int) -> str:
+    return "-".join(f"{number:012x}"[i : i + 2] for i in range(0, 12, 2))
+
+
+def populate(engine, admin: User, size: int):
+    """
+    replaces all extensions with size Snom extensions, every fifth one is
+    private
+    """
+    rows = [
+        {
+            "extension": f"{number:06d}",
+            "name": f"Benchmark {number}",
+            "info": "",
+            "public": number % 5 != 0,
+            "type": "Snom 300",
+            "password": generate_extension_password(),
+            "token": generate_extension_token(),
+            "user_id": admin.id,
+            "extra_fields": {"mac": mac_of(number)},
+        }
+        for number in range(size)
+    ]
+
+    with Session(engine) as session:
+        session.exec(delete(Extension))
+        for start in range(0, size, 1000):
+            session.exec(insert(Extension).values(rows[start : start + 1000]))
+        session.commit()
@@ -7,4 +7,4 @@ cd /app
 uv run alembic upgrade head
 
 # execute app
-uvicorn app.main:app --workers 1 --host 0.0.0.0
\ No newline at end of file
+uvicorn app.main:app --workers ${UURU_WORKERS:-1} --host 0.0.0.0
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""discovery target
+
+Revision ID: 2b7d9e4c8a16
+Revises: 9c3e5f1a7d20
+Create Date: 2026-10-19 19:11:52.408316
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2b7d9e4c8a16"
+down_revision: Union[str, Sequence[str], None] = "9c3e5f1a7d20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "discoverytarget",
+        sa.Column("extension", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("flavor", sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+        sa.Column("last_ip", sqlmodel.sql.sqltypes.AutoString(length=45), nullable=False),
+        sa.Column("last_seen", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("extension"),
+    )
+    op.create_index(
+        op.f("ix_discoverytarget_flavor"), "discoverytarget", ["flavor"], unique=False
+    )
+    op.create_index(
+        op.f("ix_discoverytarget_last_seen"),
+        "discoverytarget",
+        ["last_seen"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_discoverytarget_last_seen"), table_name="discoverytarget")
+    op.drop_index(op.f("ix_discoverytarget_flavor"), table_name="discoverytarget")
+    op.drop_table("discoverytarget")
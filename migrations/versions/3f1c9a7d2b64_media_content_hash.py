@@ -0,0 +1,41 @@
+"""media content hash
+
+Revision ID: 3f1c9a7d2b64
+Revises: 69a30a0afb72
+Create Date: 2026-10-19 10:12:41.204518
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1c9a7d2b64"
+down_revision: Union[str, Sequence[str], None] = "69a30a0afb72"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "media",
+        sa.Column(
+            "content_hash", sqlmodel.sql.sqltypes.AutoString(length=64), nullable=True
+        ),
+    )
+    op.create_index(
+        op.f("ix_media_content_hash"), "media", ["content_hash"], unique=False
+    )
+    op.create_index(op.f("ix_media_stored_as"), "media", ["stored_as"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_media_stored_as"), table_name="media")
+    op.drop_index(op.f("ix_media_content_hash"), table_name="media")
+    op.drop_column("media", "content_hash")
@@ -0,0 +1,32 @@
+"""user token version
+
+Revision ID: 5d7a0e93c41f
+Revises: 8b2e4d61c0a7
+Create Date: 2026-10-19 14:03:27.118342
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5d7a0e93c41f"
+down_revision: Union[str, Sequence[str], None] = "8b2e4d61c0a7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "user",
+        sa.Column("token_version", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("user", "token_version")
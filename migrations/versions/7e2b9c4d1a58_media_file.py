@@ -0,0 +1,40 @@
+"""media file
+
+Revision ID: 7e2b9c4d1a58
+Revises: f5a1c3e8b9d2
+Create Date: 2026-10-19 22:41:12.503817
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7e2b9c4d1a58"
+down_revision: Union[str, Sequence[str], None] = "f5a1c3e8b9d2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "mediafile",
+        sa.Column(
+            "stored_as", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("stored_as"),
+    )
+    # every file which is already stored gets its lock row
+    op.execute(
+        "INSERT INTO mediafile (stored_as) SELECT DISTINCT stored_as FROM media"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("mediafile")
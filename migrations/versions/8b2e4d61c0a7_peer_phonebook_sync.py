@@ -0,0 +1,71 @@
+"""peer phonebook sync
+
+Revision ID: 8b2e4d61c0a7
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-19 11:03:17.553104
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b2e4d61c0a7"
+down_revision: Union[str, Sequence[str], None] = "3f1c9a7d2b64"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "phonebookchange",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("extension", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_phonebookchange_extension"),
+        "phonebookchange",
+        ["extension"],
+        unique=False,
+    )
+    op.create_table(
+        "peerphonebookentry",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("peer_id", sa.Uuid(), nullable=False),
+        sa.Column("extension", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("name", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("type", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("location_name", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("lat", sa.Integer(), nullable=True),
+        sa.Column("lon", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["peer_id"], ["peer.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("peer_id", "extension"),
+    )
+    op.create_index(
+        op.f("ix_peerphonebookentry_peer_id"),
+        "peerphonebookentry",
+        ["peer_id"],
+        unique=False,
+    )
+    op.add_column(
+        "peer",
+        sa.Column("phonebook_seq", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("peer", "phonebook_seq")
+    op.drop_index(
+        op.f("ix_peerphonebookentry_peer_id"), table_name="peerphonebookentry"
+    )
+    op.drop_table("peerphonebookentry")
+    op.drop_index(op.f("ix_phonebookchange_extension"), table_name="phonebookchange")
+    op.drop_table("phonebookchange")
@@ -0,0 +1,46 @@
+"""shared state
+
+Revision ID: 9c3e5f1a7d20
+Revises: e4a8d2c61f37
+Create Date: 2026-10-19 18:02:37.281945
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9c3e5f1a7d20"
+down_revision: Union[str, Sequence[str], None] = "e4a8d2c61f37"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "sharedstateentry",
+        sa.Column(
+            "namespace", sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False
+        ),
+        sa.Column("key", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+        sa.Column("value", sa.Text(), nullable=False),
+        sa.Column("expires", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("namespace", "key"),
+    )
+    op.create_index(
+        op.f("ix_sharedstateentry_expires"),
+        "sharedstateentry",
+        ["expires"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_sharedstateentry_expires"), table_name="sharedstateentry")
+    op.drop_table("sharedstateentry")
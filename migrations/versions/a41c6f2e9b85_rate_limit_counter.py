@@ -0,0 +1,36 @@
+"""rate limit counter
+
+Revision ID: a41c6f2e9b85
+Revises: 5d7a0e93c41f
+Create Date: 2026-10-19 15:21:09.604711
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a41c6f2e9b85"
+down_revision: Union[str, Sequence[str], None] = "5d7a0e93c41f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "ratelimitcounter",
+        sa.Column("name", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+        sa.Column("slot", sa.Integer(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name", "slot"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("ratelimitcounter")
@@ -0,0 +1,61 @@
+"""websip session
+
+Revision ID: c7e19b3d5a02
+Revises: a41c6f2e9b85
+Create Date: 2026-10-19 16:47:52.310294
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c7e19b3d5a02"
+down_revision: Union[str, Sequence[str], None] = "a41c6f2e9b85"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "joblease",
+        sa.Column("name", sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+        sa.Column("holder", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("expires", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.create_table(
+        "websipsession",
+        sa.Column(
+            "extension", sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False
+        ),
+        sa.Column(
+            "status",
+            sa.Enum("FREE", "WARM", "ACTIVE", name="websipstatus"),
+            nullable=False,
+        ),
+        sa.Column("auth_pass", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("display_name", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("last_seen", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("extension"),
+    )
+    op.create_index(
+        op.f("ix_websipsession_status"), "websipsession", ["status"], unique=False
+    )
+    op.create_index(
+        op.f("ix_websipsession_last_seen"), "websipsession", ["last_seen"], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_websipsession_last_seen"), table_name="websipsession")
+    op.drop_index(op.f("ix_websipsession_status"), table_name="websipsession")
+    op.drop_table("websipsession")
+    op.drop_table("joblease")
+    sa.Enum(name="websipstatus").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,44 @@
+"""tmp extension pool
+
+Revision ID: e4a8d2c61f37
+Revises: c7e19b3d5a02
+Create Date: 2026-10-19 18:21:05.583102
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e4a8d2c61f37"
+down_revision: Union[str, Sequence[str], None] = "c7e19b3d5a02"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column(
+        "temporaryextensions", "ppn", existing_type=sa.Integer(), nullable=True
+    )
+    op.create_index(
+        op.f("ix_temporaryextensions_ppn"),
+        "temporaryextensions",
+        ["ppn"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        op.f("ix_temporaryextensions_ppn"), table_name="temporaryextensions"
+    )
+    # extensions in the pool have no handset
+    op.execute("DELETE FROM temporaryextensions WHERE ppn IS NULL")
+    op.alter_column(
+        "temporaryextensions", "ppn", existing_type=sa.Integer(), nullable=False
+    )
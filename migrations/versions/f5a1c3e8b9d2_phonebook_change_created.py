@@ -0,0 +1,44 @@
+"""phonebook change created
+
+Revision ID: f5a1c3e8b9d2
+Revises: 2b7d9e4c8a16
+Create Date: 2026-10-19 21:04:37.915204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f5a1c3e8b9d2"
+down_revision: Union[str, Sequence[str], None] = "2b7d9e4c8a16"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "phonebookchange",
+        sa.Column(
+            "created",
+            sa.DateTime(),
+            nullable=False,
+            server_default=sa.func.current_timestamp(),
+        ),
+    )
+    op.create_index(
+        op.f("ix_phonebookchange_created"),
+        "phonebookchange",
+        ["created"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_phonebookchange_created"), table_name="phonebookchange")
+    op.drop_column("phonebookchange", "created")